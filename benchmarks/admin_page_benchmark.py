@@ -0,0 +1,133 @@
+"""Measures the memory of one /admin page against loading the whole withdrawal queue.
+
+For each queue size in --sizes, seeds that many pending withdrawal requests
+into a scratch database and measures, with tracemalloc:
+
+  - full: every pending request loaded with find().to_list() and rendered
+    into one Markdown string by repeated +=, as /admin did before paging
+  - page: one get_pending_withdrawal_requests_page() call plus
+    render_withdrawal_page(), for the first, a middle and the last page
+
+"retained" is what the bot still holds once the call returned (the rows and
+the rendered message); "peak" is the high-water mark during the call. With
+mongod the query itself runs in the server, so both stay flat per page
+whatever the queue size. mongomock runs the query in this process and
+sorts the whole collection for every page, which shows up in "peak" but not
+in "retained".
+
+    python benchmarks/admin_page_benchmark.py --sizes 1000,10000,100000
+    python benchmarks/admin_page_benchmark.py --backend mongomock --sizes 1000,10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+os.environ.setdefault("MONGO_DB_NAME", "earning_bot_bench")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:BENCHMARK")
+
+SEED_BATCH = 10000
+
+async def seed(db_manager, size: int) -> None:
+    await db_manager.client.drop_database(db_manager.db.name)
+    await db_manager.ensure_indexes()
+    start = datetime(2024, 1, 1)
+    for offset in range(0, size, SEED_BATCH):
+        await db_manager.withdrawal_requests_collection.insert_many([
+            {
+                "user_tg_id": 1_000_000 + index,
+                "amount": 10.0 + index % 50,
+                "upi_id": f"user{index}@upi",
+                "status": "pending",
+                "timestamp": start + timedelta(seconds=index),
+            }
+            for index in range(offset, min(size, offset + SEED_BATCH))
+        ])
+
+async def measure(func) -> dict:
+    """Runs func() under tracemalloc; the result is kept alive until "retained" is read."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    result = await func()
+    seconds = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {"seconds": seconds, "retained_kib": (current - before) / 1024, "peak_kib": (peak - before) / 1024}
+
+async def run(args) -> list:
+    from database import db_manager, encode_page_cursor
+    from main import render_withdrawal_page
+
+    if args.backend == "mongomock":
+        import database
+        from fakes import mongomock_client_class
+        database.AsyncIOMotorClient = mongomock_client_class()
+    db_manager.connect()
+
+    async def full_queue():
+        requests = await db_manager.withdrawal_requests_collection.find({"status": "pending"}).to_list(length=None)
+        message = "🗓️ *Pending Withdrawal Requests:*\n\n"
+        for req in requests:
+            message += (
+                f"• *Request ID:* `{req['_id']}`\n"
+                f"  *User TG ID:* `{req['user_tg_id']}`\n"
+                f"  *Amount:* ₹{req['amount']:.2f}\n"
+                f"  *UPI ID:* `{req['upi_id']}`\n"
+                f"  *Requested On:* `{req['timestamp'].strftime('%Y-%m-%d %H:%M')}`\n\n"
+            )
+        return requests, message
+
+    def page_after(cursor):
+        async def page():
+            requests, has_more = await db_manager.get_pending_withdrawal_requests_page(after=cursor)
+            return requests, render_withdrawal_page(requests, cursor is not None, has_more)
+        return page
+
+    results = []
+    for size in args.sizes:
+        await seed(db_manager, size)
+        # Cursors just before the middle and the last page, found outside the measurement
+        cursors = {"first": None}
+        for name, skip in (("middle", size // 2), ("last", max(0, size - args.page_size) - 1)):
+            doc = await db_manager.withdrawal_requests_collection.find({"status": "pending"}).sort(
+                [("timestamp", 1), ("_id", 1)]
+            ).skip(skip).limit(1).to_list(length=1)
+            cursors[name] = encode_page_cursor(doc[0])
+        row = {"size": size, "full": await measure(full_queue)}
+        for name, cursor in cursors.items():
+            row[f"page_{name}"] = await measure(page_after(cursor))
+        results.append(row)
+        print(f"{size:8d} requests")
+        for name in ("full", "page_first", "page_middle", "page_last"):
+            stats = row[name]
+            print(
+                f"    {name:12} retained {stats['retained_kib']:10.1f} KiB   peak {stats['peak_kib']:10.1f} KiB"
+                f"   {stats['seconds'] * 1000:9.1f} ms"
+            )
+    db_manager.close()
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=[1000, 10000, 100000])
+    parser.add_argument("--page-size", type=int, default=10, help="ADMIN_PAGE_SIZE")
+    parser.add_argument("--backend", choices=("mongod", "mongomock"), default="mongod")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    os.environ["ADMIN_PAGE_SIZE"] = str(args.page_size)
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
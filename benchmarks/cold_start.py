@@ -0,0 +1,145 @@
+"""Measures cold-start time: from spawning the bot process to its first handled update.
+
+Each run starts a fresh interpreter that imports main, builds the
+Application, runs post_init (MongoDB connection and index bootstrap, link
+pool, credit batcher, postback and metrics servers), starts it and feeds
+it one /start update. The update counts as handled when the bot's reply
+reaches the fake Bot API. Reported per run, relative to the spawn:
+
+  - import: `import main` done (config, database, handlers)
+  - ready: post_init and Application.start() done
+  - first update: the /start reply sent
+
+--tree points at another checkout to compare revisions; the fakes and
+this driver always come from this one. The Bot API client is swapped for
+the fake where the ApplicationBuilder creates it, so revisions whose
+build_application() takes no request can be measured too.
+
+    git worktree add /tmp/before <revision>
+    python benchmarks/cold_start.py --runs 10 --tree /tmp/before
+    python benchmarks/cold_start.py --runs 10
+
+The scratch database (MONGO_DB_NAME, default earning_bot_cold_start) is
+dropped before every run, so each one bootstraps its indexes from scratch.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+PHASES = ("import", "ready", "first_update")
+
+async def child(args) -> dict:
+    """Runs in the spawned process: starts the bot and times its first update."""
+    import telegram.ext._applicationbuilder as applicationbuilder
+
+    from fakes import FakeTelegramRequest, UpdateFactory
+
+    class FirstReplyRequest(FakeTelegramRequest):
+        def __init__(self):
+            super().__init__()
+            self.replied = asyncio.Event()
+
+        def _message(self, endpoint: str, params: dict) -> dict:
+            self.replied.set()
+            return super()._message(endpoint, params)
+
+    request = FirstReplyRequest()
+    applicationbuilder.HTTPXRequest = lambda **kwargs: request
+    if args.backend == "mongomock":
+        import motor.motor_asyncio
+        from fakes import mongomock_client_class
+        motor.motor_asyncio.AsyncIOMotorClient = mongomock_client_class()
+    # The bot modules come from the tree under test, not from this checkout
+    sys.path.insert(0, args.tree)
+
+    timings = {}
+    import main as bot
+    timings["import"] = time.time()
+    application = bot.build_application(updater=False)
+    async with application:
+        await bot.post_init(application)
+        await application.start()
+        timings["ready"] = time.time()
+        await application.update_queue.put(UpdateFactory(application.bot).command(1_000_000, "/start"))
+        await asyncio.wait_for(request.replied.wait(), 30)
+        timings["first_update"] = time.time()
+        await application.stop()
+        await bot.post_shutdown(application)
+    return {phase: timings[phase] - args.spawned_at for phase in PHASES}
+
+def drop_database(args) -> None:
+    if args.backend == "mongod":
+        from pymongo import MongoClient
+
+        with MongoClient(args.mongo_uri) as client:
+            client.drop_database(args.db_name)
+
+def tree_revision(tree: str) -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=tree, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def spawn(args) -> dict:
+    command = [
+        sys.executable, os.path.abspath(__file__), "--child",
+        "--tree", args.tree, "--backend", args.backend, "--spawned-at", repr(time.time()),
+    ]
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode != 0:
+        sys.stderr.write(process.stderr[-5000:])
+        raise RuntimeError(f"The bot process exited with code {process.returncode}")
+    return json.loads(process.stdout.splitlines()[-1])
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--tree", default=ROOT_DIR, help="checkout whose bot is started")
+    parser.add_argument("--backend", choices=("mongod", "mongomock"), default="mongod")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--db-name", default="earning_bot_cold_start", help="scratch database, dropped before every run")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--spawned-at", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.tree = os.path.abspath(args.tree)
+
+    sys.path.insert(0, BENCH_DIR)
+    if args.child:
+        print(json.dumps(asyncio.run(child(args))))
+        return
+
+    from load_test import configure_environment, free_port
+
+    args.gplinks_port = free_port()
+    args.postback_port = free_port()
+    args.production_limits = True
+    configure_environment(args)
+    runs = []
+    for _ in range(args.runs):
+        drop_database(args)
+        runs.append(spawn(args))
+    results = {
+        "meta": {"revision": tree_revision(args.tree), "args": vars(args)},
+        "runs": runs,
+        "median_ms": {phase: statistics.median(run[phase] for run in runs) * 1000 for phase in PHASES},
+    }
+    print(f"{args.runs} cold starts of {args.tree}, median since spawn:")
+    for phase in PHASES:
+        print(f"  {phase:14}{results['median_ms'][phase]:8.0f} ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
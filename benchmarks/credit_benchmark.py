@@ -0,0 +1,123 @@
+"""Compares crediting link completions one write at a time with the write-behind CreditBatcher.
+
+  - direct: every completion is one update_user_balance and one add_link,
+    the writes a completion cost before batching
+  - batched: completions are queued on a CreditBatcher and written by its
+    periodic flusher as one users bulk_write and one links insert_many
+
+Completions arrive as fast as --concurrency allows, spread over --users
+users. Reports completions/s, MongoDB operations and completions per call, and
+checks that both runs credited exactly the same total. The scratch database
+(MONGO_DB_NAME, default earning_bot_bench) is dropped before each run.
+
+    python benchmarks/credit_benchmark.py --completions 50000 --users 5000
+    python benchmarks/credit_benchmark.py --backend mongomock --completions 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+os.environ.setdefault("MONGO_DB_NAME", "earning_bot_bench")
+
+async def seed(db_manager, users: int) -> None:
+    await db_manager.client.drop_database(db_manager.db.name)
+    await db_manager.ensure_indexes()
+    await db_manager.users_collection.insert_many([
+        {"tg_id": tg_id, "balance": 0.0, "completed_links": 0, "total_links": 0, "total_earned": 0.0, "upi_id": None}
+        for tg_id in range(1, users + 1)
+    ])
+
+async def run_mode(mode: str, args, db_operations) -> dict:
+    from crediting import CreditBatcher
+    from database import db_manager
+
+    await seed(db_manager, args.users)
+    db_manager.user_cache = type(db_manager.user_cache)(args.users, 300)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    batcher = CreditBatcher(db_manager)
+
+    async def complete(index: int) -> None:
+        tg_id = index % args.users + 1
+        url = f"https://gplinks.test/{index}"
+        async with semaphore:
+            if mode == "direct":
+                await db_manager.update_user_balance(tg_id, 1.0)
+                await db_manager.add_link(tg_id, url, status="completed")
+            else:
+                batcher.credit(tg_id, 1.0)
+                batcher.add_link(tg_id, url, index // args.users + 1, status="completed")
+                await asyncio.sleep(0) # Completions keep arriving while the flusher runs
+
+    calls_before = sum(db_operations.values())
+    started = time.perf_counter()
+    if mode == "batched":
+        await batcher.start()
+    await asyncio.gather(*(complete(index) for index in range(args.completions)))
+    if mode == "batched":
+        await batcher.close() # The final flush counts: the credits are only durable after it
+    seconds = time.perf_counter() - started
+    calls = sum(db_operations.values()) - calls_before
+
+    cursor = db_manager.users_collection.aggregate([{"$group": {"_id": None, "balance": {"$sum": "$balance"}}}])
+    credited = (await cursor.to_list(length=1))[0]["balance"]
+    if credited != args.completions:
+        raise AssertionError(f"{mode}: credited {credited}, expected {args.completions}")
+    return {
+        "completions": args.completions,
+        "seconds": seconds,
+        "completions_per_second": args.completions / seconds,
+        "db_calls": calls,
+        "completions_per_db_call": args.completions / calls,
+        "flushes": batcher.flushes,
+    }
+
+async def run(args) -> dict:
+    from database import db_manager
+    from fakes import count_collection_operations
+
+    if args.backend == "mongomock":
+        import database
+        from fakes import mongomock_client_class
+        database.AsyncIOMotorClient = mongomock_client_class()
+    db_operations = count_collection_operations(db_manager)
+    results = {"users": args.users, "concurrency": args.concurrency}
+    try:
+        for mode in ("direct", "batched"):
+            results[mode] = await run_mode(mode, args, db_operations)
+            result = results[mode]
+            print(
+                f"{mode:8} {result['completions']:7d} completions in {result['seconds']:7.2f} s  "
+                f"{result['completions_per_second']:9.0f}/s  {result['db_calls']:7.0f} DB calls  "
+                f"{result['completions_per_db_call']:7.1f} completions/call"
+            )
+    finally:
+        db_manager.close()
+    results["speedup"] = results["batched"]["completions_per_second"] / results["direct"]["completions_per_second"]
+    print(f"speedup {results['speedup']:.1f}x")
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--completions", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=256, help="completions written concurrently")
+    parser.add_argument("--flush-interval", type=float, default=0.5, help="CREDIT_FLUSH_INTERVAL")
+    parser.add_argument("--batch-size", type=int, default=500, help="CREDIT_BATCH_SIZE")
+    parser.add_argument("--backend", choices=("mongod", "mongomock"), default="mongod")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    os.environ["CREDIT_FLUSH_INTERVAL"] = str(args.flush_interval)
+    os.environ["CREDIT_BATCH_SIZE"] = str(args.batch_size)
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
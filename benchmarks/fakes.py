@@ -0,0 +1,307 @@
+"""Local stand-ins for Telegram and GP Links used by the benchmarks."""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from urllib.parse import parse_qs, urlsplit
+
+from aiohttp import web
+from telegram import Bot, Update
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {"id": 999999999, "is_bot": True, "first_name": "BenchBot", "username": "bench_bot"}
+
+class FakeTelegramRequest(BaseRequest):
+    """Answers Bot API calls locally, the way a healthy Telegram would.
+
+    Sent messages get increasing message_ids; the last one per chat is kept
+    so a driver can press its inline buttons. `latency` seconds are added to
+    every call to model the round-trip to Telegram.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.last_message: dict[int, dict] = {}
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self) -> float | None:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData | None = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        return 200, json.dumps({"ok": True, "result": await self.answer(endpoint, params)}).encode()
+
+    async def answer(self, endpoint: str, params: dict):
+        """The result of one Bot API call."""
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            return self._message(endpoint, params)
+        return True # answerCallbackQuery, setWebhook, deleteWebhook, ...
+
+    def _message(self, endpoint: str, params: dict) -> dict:
+        chat_id = int(params["chat_id"])
+        previous = self.last_message.get(chat_id, {})
+        message = {
+            "message_id": next(self._message_ids) if endpoint == "sendMessage" else int(params["message_id"]),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", previous.get("text", "")),
+        }
+        markup = params.get("reply_markup")
+        if isinstance(markup, str):
+            markup = json.loads(markup)
+        if markup and "inline_keyboard" in markup:
+            message["reply_markup"] = markup
+        self.last_message[chat_id] = message
+        return message
+
+class FakeBotAPI(FakeTelegramRequest):
+    """The same fake Bot API served over HTTP, for bot processes pointed at it with TELEGRAM_API_URL.
+
+    Every message sent to a chat is also queued for that chat, so a driver
+    can wait for the bot's reply to what it just sent.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.replies: defaultdict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self._runner: web.AppRunner | None = None
+
+    def _message(self, endpoint: str, params: dict) -> dict:
+        message = super()._message(endpoint, params)
+        if endpoint == "sendMessage":
+            self.replies[message["chat"]["id"]].put_nowait(message)
+        return message
+
+    async def handle(self, request: web.Request) -> web.Response:
+        params = dict(await request.post()) # Form-encoded, values JSON-encoded as the Bot API expects
+        result = await self.answer(request.match_info["method"], params)
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host: str, port: int):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port, backlog=1024).start()
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def next_reply(self, chat_id: int, timeout: float = 30.0) -> dict:
+        """Waits for the next message the bot sends to chat_id."""
+        return await asyncio.wait_for(self.replies[chat_id].get(), timeout)
+
+class SlowCollection:
+    """Forwards to a collection, sleeping a random moment before and after every call.
+
+    The sleeps let concurrent reads and writes of the same user overlap the
+    way they do against a real server.
+    """
+
+    def __init__(self, collection, rng: random.Random, max_delay: float = 0.002):
+        self._collection = collection
+        self._rng = rng
+        self._max_delay = max_delay
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(self._rng.random() * self._max_delay)
+            result = await attr(*args, **kwargs)
+            await asyncio.sleep(self._rng.random() * self._max_delay)
+            return result
+        return call
+
+class CountingCollection:
+    """Forwards to a collection, counting every operation sent to the server in `counts`.
+
+    Awaited methods count once per call; find() and aggregate() count once
+    per cursor opened, whatever number of batches it then fetches.
+    """
+
+    CURSOR_METHODS = frozenset({"find", "aggregate"})
+
+    def __init__(self, collection, counts: Counter):
+        self._collection = collection
+        self._counts = counts
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in self.CURSOR_METHODS:
+            def open_cursor(*args, **kwargs):
+                self._counts[f"{self._collection.name}.{name}"] += 1
+                return attr(*args, **kwargs)
+            return open_cursor
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            self._counts[f"{self._collection.name}.{name}"] += 1
+            return await attr(*args, **kwargs)
+        return call
+
+def count_collection_operations(db_manager) -> Counter:
+    """Wraps the manager's collections in CountingCollection and returns their shared counts."""
+    counts: Counter[str] = Counter()
+    db_manager.connect()
+    for name in db_manager._CONNECTION_ATTRS:
+        if name.endswith("_collection"):
+            setattr(db_manager, name, CountingCollection(getattr(db_manager, name), counts))
+    return counts
+
+class UpdateFactory:
+    """Builds Telegram updates as a private chat with each simulated user would send them."""
+
+    def __init__(self, bot: Bot | None = None):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def _user(tg_id: int) -> dict:
+        return {"id": tg_id, "is_bot": False, "first_name": f"User {tg_id}", "username": f"user{tg_id}"}
+
+    def command_json(self, tg_id: int, text: str) -> dict:
+        """The raw JSON Telegram would post for a command message."""
+        command = text.split(maxsplit=1)[0]
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": tg_id, "type": "private"},
+                "from": self._user(tg_id),
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+            },
+        }
+
+    def command(self, tg_id: int, text: str) -> Update:
+        return Update.de_json(self.command_json(tg_id, text), self.bot)
+
+    def callback(self, tg_id: int, data: str, message: dict) -> Update:
+        """A press of the button with callback_data `data` on a message the bot sent."""
+        return Update.de_json({
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self._user(tg_id),
+                "chat_instance": str(tg_id),
+                "message": message,
+                "data": data,
+            },
+        }, self.bot)
+
+class FakeShortener:
+    """GP Links-compatible API (`?api=<key>&url=<url>`) served locally.
+
+    Each call waits `latency` seconds (± `jitter`) and fails with HTTP 503 at
+    `error_rate`. Short URLs map back to their target, so a simulated user
+    can "complete" a link by following it.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, error_rate: float = 0.0, seed: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.targets: dict[str, str] = {}
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._runner: web.AppRunner | None = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503)
+        short_url = f"https://gplinks.test/{len(self.targets) + 1}"
+        self.targets[short_url] = request.query["url"]
+        return web.json_response({"status": "success", "shortenedUrl": short_url})
+
+    async def start(self, host: str, port: int, path: str = "/api"):
+        app = web.Application()
+        app.router.add_get(path, self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def target_params(self, short_url: str) -> dict[str, str]:
+        """The user, link_seq and token query params of the page short_url points to."""
+        target = self.targets.get(short_url, short_url) # A raw fallback link is the target itself
+        return {key: values[0] for key, values in parse_qs(urlsplit(target).query).items()}
+
+def mongomock_client_class():
+    """mongomock_motor's client class, also answering the `hello` command of ensure_indexes().
+
+    mongomock does not implement `hello`; the mock presents itself as a
+    standalone server, so the bot runs without transactions.
+    """
+    from mongomock.collection import BulkOperationBuilder
+    from mongomock_motor import AsyncMongoMockClient
+
+    # pymongo >= 4.11 passes `sort` to bulk updates, which mongomock does not accept yet
+    add_update = BulkOperationBuilder.add_update
+    if not getattr(add_update, "ignores_sort", False):
+        def add_update_ignoring_sort(self, *args, sort=None, **kwargs):
+            return add_update(self, *args, **kwargs)
+        add_update_ignoring_sort.ignores_sort = True
+        BulkOperationBuilder.add_update = add_update_ignoring_sort
+
+    class StandaloneAdmin:
+        def __init__(self, database):
+            self._database = database
+
+        def __getattr__(self, name):
+            return getattr(self._database, name)
+
+        async def command(self, command, *args, **kwargs):
+            if command == "hello":
+                return {"isWritablePrimary": True}
+            return await self._database.command(command, *args, **kwargs)
+
+    class MockClient(AsyncMongoMockClient):
+        def __getattr__(self, name):
+            database = super().__getattr__(name)
+            return StandaloneAdmin(database) if name == "admin" else database
+
+    return MockClient
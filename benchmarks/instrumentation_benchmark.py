@@ -0,0 +1,82 @@
+"""Measures what the metrics instrumentation adds to each handler and MongoDB call.
+
+Times a trivial coroutine called bare and through instrument_db() and
+instrument_handler(), plus the raw Counter.inc() / Histogram.observe()
+and one render() of every metric main.py registers, as a /metrics scrape
+does.
+The difference between bare and decorated calls is the per-call overhead;
+an update costs one handler wrapper plus one wrapper per MongoDB call.
+
+    python benchmarks/instrumentation_benchmark.py --calls 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:BENCHMARK")
+os.environ.setdefault("GPLINKS_API_KEY", "benchmark")
+
+async def time_calls(func, calls: int) -> float:
+    """Seconds per awaited call of func()."""
+    started = time.perf_counter()
+    for _ in range(calls):
+        await func()
+    return (time.perf_counter() - started) / calls
+
+def time_sync(func, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        func(0.001)
+    return (time.perf_counter() - started) / calls
+
+async def run(args) -> dict:
+    import main  # noqa: F401  (registers the bot's metrics and component stats collector)
+    import metrics
+
+    async def bare():
+        return None
+
+    db_method = metrics.instrument_db("benchmark")(bare)
+    handler = metrics.instrument_handler("benchmark")(bare)
+    counter = metrics.DB_CALLS.labels("benchmark")
+    histogram = metrics.DB_LATENCY.labels("benchmark")
+
+    results = {"calls": args.calls}
+    for name, func in (("bare", bare), ("instrument_db", db_method), ("instrument_handler", handler)):
+        results[f"{name}_ns"] = min([await time_calls(func, args.calls) for _ in range(args.repeat)]) * 1e9
+    results["counter_inc_ns"] = min(time_sync(counter.inc, args.calls) for _ in range(args.repeat)) * 1e9
+    results["histogram_observe_ns"] = min(time_sync(histogram.observe, args.calls) for _ in range(args.repeat)) * 1e9
+    started = time.perf_counter()
+    text = metrics.render()
+    results["render_ms"] = (time.perf_counter() - started) * 1000
+    results["render_lines"] = text.count("\n")
+
+    for name in ("instrument_db", "instrument_handler"):
+        results[f"{name}_overhead_ns"] = results[f"{name}_ns"] - results["bare_ns"]
+    print(f"bare coroutine            {results['bare_ns']:8.0f} ns")
+    for name in ("instrument_db", "instrument_handler"):
+        print(f"{name:26}{results[f'{name}_ns']:8.0f} ns  (+{results[f'{name}_overhead_ns']:.0f} ns)")
+    print(f"Counter.inc()             {results['counter_inc_ns']:8.0f} ns")
+    print(f"Histogram.observe()       {results['histogram_observe_ns']:8.0f} ns")
+    print(f"render()                  {results['render_ms']:8.2f} ms  ({results['render_lines']} lines)")
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=1_000_000, help="calls per measurement")
+    parser.add_argument("--repeat", type=int, default=3, help="the fastest of this many runs is reported")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
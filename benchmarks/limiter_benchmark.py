@@ -0,0 +1,129 @@
+"""Measures the per-update cost of the rate limiting middleware with a million tracked users.
+
+Replaces the /getlink, command and warning limiters of main.py with ones
+sized for --users users (RATE_LIMIT_MAX_USERS) and fills them, then times:
+
+  - allow: one KeyedRateLimiter.allow() for a random tracked user
+  - middleware allowed: enforce_rate_limits() on a /balance update that passes
+  - middleware rejected: enforce_rate_limits() on a /getlink update over the
+    limit, up to the ApplicationHandlerStop that drops it (the warning
+    limiter is full, so no "slow down" reply is sent)
+  - sweep: the one-off pass over all tracked users when one more user
+    arrives past the limit
+
+The memory of the tracked users is measured with tracemalloc. Nothing
+touches MongoDB, Telegram or GP Links.
+
+    python benchmarks/limiter_benchmark.py --users 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:BENCHMARK")
+os.environ.setdefault("GPLINKS_API_KEY", "benchmark")
+
+FIRST_USER_ID = 1_000_000
+
+def fill(limiter, users: int) -> None:
+    for tg_id in range(FIRST_USER_ID, FIRST_USER_ID + users):
+        limiter.allow(tg_id)
+
+async def time_middleware(middleware, updates: list) -> float:
+    """Seconds per update for the middleware, counting a dropped update as handled."""
+    from telegram.ext import ApplicationHandlerStop
+
+    started = time.perf_counter()
+    for update in updates:
+        try:
+            await middleware(update, None)
+        except ApplicationHandlerStop:
+            pass
+    return (time.perf_counter() - started) / len(updates)
+
+async def run(args) -> dict:
+    import main as bot
+    from fakes import UpdateFactory
+    from rate_limit import KeyedRateLimiter
+
+    rng = random.Random(args.seed)
+    keys = [FIRST_USER_ID + rng.randrange(args.users) for _ in range(args.samples)]
+
+    # Built up front: parsing updates is the Application's cost, not the limiter's
+    factory = UpdateFactory()
+    balance_updates = [factory.command(key, "/balance") for key in keys]
+    hammering = keys[:100]
+    getlink_updates = [factory.command(hammering[index % len(hammering)], "/getlink") for index in range(len(keys))]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    getlink = KeyedRateLimiter(bot.config.GETLINK_RATE, bot.config.GETLINK_BURST, args.users)
+    fill(getlink, args.users)
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    command = KeyedRateLimiter(bot.config.COMMAND_RATE, bot.config.COMMAND_BURST, args.users)
+    fill(command, args.users)
+    # Filled last: a user's "slow down" reply is suppressed for 30 s from here
+    warning = KeyedRateLimiter(1 / 30, 1, args.users)
+    fill(warning, args.users)
+    bot.getlink_limiter, bot.command_limiter, bot.warning_limiter = getlink, command, warning
+
+    allow = command.allow
+    started = time.perf_counter()
+    for key in keys:
+        allow(key)
+    allow_seconds = (time.perf_counter() - started) / len(keys)
+
+    allowed_seconds = await time_middleware(bot.enforce_rate_limits, balance_updates)
+    # A small set of users hammering /getlink: past their burst every update is dropped
+    for key in hammering:
+        for _ in range(bot.config.GETLINK_BURST):
+            getlink.allow(key)
+    rejected_before = getlink.rejected
+    rejected_seconds = await time_middleware(bot.enforce_rate_limits, getlink_updates)
+    rejected = getlink.rejected - rejected_before
+
+    started = time.perf_counter()
+    getlink.allow(FIRST_USER_ID + args.users) # One user too many
+    sweep_seconds = time.perf_counter() - started
+
+    results = {
+        "users": args.users,
+        "samples": args.samples,
+        "bytes_per_user": memory / args.users,
+        "allow_us": allow_seconds * 1e6,
+        "middleware_allowed_us": allowed_seconds * 1e6,
+        "middleware_rejected_us": rejected_seconds * 1e6,
+        "rejected": rejected,
+        "sweep_ms": sweep_seconds * 1000,
+        "users_after_sweep": len(getlink),
+    }
+    print(f"{args.users} tracked users, {results['bytes_per_user']:.0f} bytes each")
+    print(f"allow()                    {results['allow_us']:8.2f} us")
+    print(f"middleware, allowed        {results['middleware_allowed_us']:8.2f} us")
+    print(f"middleware, rejected       {results['middleware_rejected_us']:8.2f} us  ({rejected} of {len(keys)} rejected)")
+    print(f"sweep past the limit       {results['sweep_ms']:8.1f} ms  ({results['users_after_sweep']} users kept)")
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000, help="tracked users")
+    parser.add_argument("--samples", type=int, default=200_000, help="timed calls per measurement")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
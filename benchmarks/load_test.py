@@ -0,0 +1,324 @@
+"""Drives simulated users through the whole bot offline and reports its performance.
+
+Telegram is replaced by a fake Bot API request and GP Links by a local
+server with configurable latency. MongoDB is a local mongod (default) or
+mongomock. Every update goes through Application.process_update with
+the handlers, rate limiting, link pool, credit batcher and postback
+server of main.py. The flow runs in phases, and all users run
+concurrently within each phase:
+
+  /start -> (/getlink -> link completion postback) x --links -> /balance
+  -> /withdraw -> /admin paging and approve buttons, then /admin approveall
+
+Each phase reports throughput, latency percentiles per command, and
+MongoDB operations per update (collection calls sent to the server;
+user cache hits do not count).
+The per-user rate limits are lifted, but the GP Links budget
+(GPLINKS_RATE_LIMIT / GPLINKS_BURST) is kept, so the link pool and live
+calls share it as in production.
+With --output the results are also written as JSON, so runs on
+different commits can be compared.
+
+mongomock needs no server. It has no real indexes, though: every query
+is a full scan run inside the event loop, so its latencies grow with the
+data. Use it for small smoke runs and for DB operations per update, and a
+mongod for latency and throughput.
+
+    python benchmarks/load_test.py --users 2000 --output results.json
+    python benchmarks/load_test.py --backend mongomock --users 200
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+ADMIN_ID = 1
+FIRST_USER_ID = 1_000_000
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def configure_environment(args) -> None:
+    """Points config at the fakes. Must run before any bot module is imported."""
+    os.environ.update(
+        TELEGRAM_BOT_TOKEN="123456:BENCHMARK",
+        GPLINKS_API_KEY="benchmark",
+        GPLINKS_API_URL=f"http://127.0.0.1:{args.gplinks_port}/api",
+        POSTBACK_SECRET="benchmark",
+        POSTBACK_LISTEN="127.0.0.1",
+        POSTBACK_PORT=str(args.postback_port),
+        METRICS_LISTEN="127.0.0.1",
+        METRICS_PORT=str(free_port()),
+        MONGO_URI=args.mongo_uri,
+        MONGO_DB_NAME=args.db_name,
+        ADMIN_IDS=str(ADMIN_ID),
+    )
+    if not args.production_limits:
+        # Simulated users act far faster than people; keep the per-user limiters out of the way.
+        # The GP Links budget stays as configured: it is what the link pool has to live with.
+        for name, value in (
+            ("GETLINK_RATE", "1000"), ("GETLINK_BURST", "1000"),
+            ("COMMAND_RATE", "1000"), ("COMMAND_BURST", "1000"),
+            ("TELEGRAM_BROADCAST_RATE", "100000"), ("NOTIFY_PER_CHAT_RATE", "100000"),
+        ):
+            os.environ.setdefault(name, value)
+
+def percentiles(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    def at(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {
+        "count": len(ordered),
+        "p50_ms": at(0.50),
+        "p90_ms": at(0.90),
+        "p99_ms": at(0.99),
+        "max_ms": ordered[-1] * 1000,
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+    }
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class LoadTest:
+    def __init__(self, args, bot_module, application, telegram, shortener, updates, db_operations):
+        self.args = args
+        self.bot = bot_module
+        self.application = application
+        self.telegram = telegram
+        self.shortener = shortener
+        self.updates = updates
+        self.db_operations = db_operations
+        self.users = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.phases: dict[str, dict] = {}
+        self.session = None
+
+    def db_calls(self) -> int:
+        return sum(self.db_operations.values())
+
+    @staticmethod
+    def handler_errors() -> float:
+        from metrics import HANDLER_ERRORS
+        return sum(child.value for child in HANDLER_ERRORS._children.values())
+
+    async def send(self, command: str, update) -> None:
+        async with self.semaphore:
+            started = time.perf_counter()
+            await self.application.process_update(update)
+            self.latencies[command].append(time.perf_counter() - started)
+
+    def update_count(self) -> int:
+        return sum(len(samples) for name, samples in self.latencies.items() if name != "postback")
+
+    async def phase(self, name: str, jobs) -> None:
+        """Runs the jobs (coroutines that each send updates) concurrently and records the phase.
+
+        Repeated phases (one per /getlink round) are summed up under one name.
+        """
+        updates_before = self.update_count()
+        postbacks_before = len(self.latencies["postback"])
+        db_before = self.db_calls()
+        started = time.perf_counter()
+        await asyncio.gather(*jobs)
+        record = self.phases.setdefault(name, {"seconds": 0.0, "updates": 0, "postbacks": 0, "db_calls": 0})
+        record["seconds"] += time.perf_counter() - started
+        record["updates"] += self.update_count() - updates_before
+        record["postbacks"] += len(self.latencies["postback"]) - postbacks_before
+        record["db_calls"] += self.db_calls() - db_before
+        # Postbacks write to MongoDB too, so they count as updates here
+        handled = record["updates"] + record["postbacks"]
+        record["updates_per_second"] = handled / record["seconds"] if record["seconds"] else 0.0
+        record["db_calls_per_update"] = record["db_calls"] / handled if handled else 0.0
+
+    def sent_link(self, tg_id: int) -> str | None:
+        text = self.telegram.last_message.get(tg_id, {}).get("text", "")
+        parts = text.split("`")
+        return parts[1] if len(parts) > 2 else None
+
+    async def complete_link(self, tg_id: int) -> None:
+        """Follows the link the user was last sent and fires the completion postback for it."""
+        short_link = self.sent_link(tg_id)
+        if short_link is None:
+            return
+        params = self.shortener.target_params(short_link)
+        async with self.semaphore:
+            started = time.perf_counter()
+            async with self.session.get(
+                f"http://127.0.0.1:{self.args.postback_port}{self.bot.config.POSTBACK_PATH}", params=params
+            ) as response:
+                await response.read()
+            self.latencies["postback"].append(time.perf_counter() - started)
+
+    async def getlink_and_complete(self, tg_id: int) -> None:
+        await self.send("getlink", self.updates.command(tg_id, "/getlink"))
+        await self.complete_link(tg_id)
+
+    async def admin_queue(self) -> None:
+        """The admin pages through the queue, approving every request with its button."""
+        await self.send("admin", self.updates.command(ADMIN_ID, "/admin"))
+        for _ in range(self.args.admin_pages):
+            message = self.telegram.last_message.get(ADMIN_ID, {})
+            rows = message.get("reply_markup", {}).get("inline_keyboard", [])
+            approvals = [row[0]["callback_data"] for row in rows if row[0]["callback_data"].startswith("wd:approve:")]
+            if not approvals:
+                break
+            for data in approvals:
+                await self.send("admin_callback", self.updates.callback(ADMIN_ID, data, self.telegram.last_message[ADMIN_ID]))
+            # The approved rows are gone, so a fresh /admin shows the next page
+            await self.send("admin", self.updates.command(ADMIN_ID, "/admin"))
+
+    async def run(self) -> dict:
+        import aiohttp
+        from crediting import credit_batcher
+
+        self.session = aiohttp.ClientSession()
+        started = time.perf_counter()
+        try:
+            await self.phase("start", [self.send("start", self.updates.command(user, "/start")) for user in self.users])
+            for _ in range(self.args.links):
+                await self.phase("getlink", [self.getlink_and_complete(user) for user in self.users])
+                # Buffered credits reach MongoDB (and the user cache) before the next round
+                await credit_batcher.flush()
+            await self.phase("balance", [self.send("balance", self.updates.command(user, "/balance")) for user in self.users])
+            await self.phase("withdraw", [
+                self.send("withdraw", self.updates.command(user, f"/withdraw user{user}@upi")) for user in self.users
+            ])
+            await self.phase("admin", [self.admin_queue()])
+            await self.phase("approveall", [self.send("admin", self.updates.command(ADMIN_ID, f"/admin approveall {datetime.now():%Y-%m-%d}"))])
+            await self.phase("stats", [self.send("stats", self.updates.command(ADMIN_ID, "/stats"))] + [
+                self.send("top", self.updates.command(user, "/top")) for user in self.users
+            ])
+        finally:
+            await self.session.close()
+        elapsed = time.perf_counter() - started
+
+        updates = self.update_count()
+        totals, _ = await self.bot.db_manager.get_stats(1)
+        return {
+            "meta": {
+                "revision": git_revision(),
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "args": {key: value for key, value in vars(self.args).items() if not key.endswith("_port")},
+            },
+            "totals": {
+                "seconds": elapsed,
+                "updates": updates,
+                "updates_per_second": updates / elapsed,
+                "postbacks": len(self.latencies["postback"]),
+                "handler_errors": self.handler_errors(),
+                "telegram_calls": dict(self.telegram.calls),
+                "shortener_requests": self.shortener.requests,
+                "shortener_errors": self.shortener.errors,
+                "links_completed": totals.get("links_completed", 0),
+                "withdrawals_approved": totals.get("approved_count", 0),
+                "link_pool": self.bot.link_pool.stats(),
+                "shortener_budget_rejected": self.bot.shortener_client.budget_rejected,
+                "user_cache": self.bot.db_manager.user_cache.stats(),
+                "db_operations": dict(sorted(self.db_operations.items())),
+            },
+            "phases": self.phases,
+            "commands": {name: percentiles(samples) for name, samples in sorted(self.latencies.items()) if samples},
+        }
+
+async def main_async(args) -> dict:
+    from fakes import FakeShortener, FakeTelegramRequest, UpdateFactory, count_collection_operations, mongomock_client_class
+    import main as bot
+    from database import db_manager
+
+    logging.getLogger().setLevel(args.log_level)
+
+    if args.backend == "mongomock":
+        import database
+        database.AsyncIOMotorClient = mongomock_client_class()
+    db_operations = count_collection_operations(db_manager)
+    await db_manager.client.drop_database(args.db_name)
+
+    shortener = FakeShortener(args.gplinks_latency, args.gplinks_jitter, args.gplinks_error_rate)
+    await shortener.start("127.0.0.1", args.gplinks_port)
+    telegram = FakeTelegramRequest(args.telegram_latency)
+    application = bot.build_application(updater=False, request=telegram)
+    try:
+        async with application:
+            await bot.post_init(application)
+            try:
+                test = LoadTest(args, bot, application, telegram, shortener, UpdateFactory(application.bot), db_operations)
+                results = await test.run()
+            finally:
+                await bot.post_shutdown(application)
+    finally:
+        await shortener.close()
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000, help="simulated users")
+    parser.add_argument("--links", type=int, default=10, help="links each user gets and completes")
+    parser.add_argument("--concurrency", type=int, default=256, help="max updates/postbacks in flight")
+    parser.add_argument("--admin-pages", type=int, default=20, help="/admin pages approved button by button")
+    parser.add_argument("--gplinks-latency", type=float, default=0.05, help="seconds per fake GP Links call")
+    parser.add_argument("--gplinks-jitter", type=float, default=0.02)
+    parser.add_argument("--gplinks-error-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="seconds per fake Bot API call")
+    parser.add_argument("--backend", choices=("mongod", "mongomock"), default="mongod")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--db-name", default="earning_bot_load_test", help="scratch database, dropped first")
+    parser.add_argument("--production-limits", action="store_true", help="keep the configured rate limits")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    args.gplinks_port = free_port()
+    args.postback_port = free_port()
+
+    configure_environment(args)
+    results = asyncio.run(main_async(args))
+
+    print(f"{'phase':12}{'updates':>9}{'postbacks':>11}{'seconds':>10}{'per s':>9}{'DB ops/update':>17}")
+    for name, phase in results["phases"].items():
+        print(
+            f"{name:12}{phase['updates']:9d}{phase['postbacks']:11d}{phase['seconds']:10.2f}"
+            f"{phase['updates_per_second']:9.0f}{phase['db_calls_per_update']:17.2f}"
+        )
+    totals = results["totals"]
+    print(
+        f"\n{totals['updates']} updates + {totals['postbacks']} postbacks in {totals['seconds']:.2f} s "
+        f"({totals['updates_per_second']:.0f} updates/s), {totals['handler_errors']:.0f} handler errors"
+    )
+    pool = totals["link_pool"]
+    print(
+        f"link pool hit ratio {pool['hit_ratio']:.1%}, {pool['generated']} links pre-generated, "
+        f"{totals['shortener_budget_rejected']} live GP Links calls refused by the budget"
+    )
+    print(f"{'command':16}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, stats in results["commands"].items():
+        print(
+            f"{name:16}{stats['count']:8d}{stats['p50_ms']:10.2f}{stats['p90_ms']:10.2f}"
+            f"{stats['p99_ms']:10.2f}{stats['max_ms']:10.2f}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Fires signed completion postbacks at the postback server and checks every link is paid once.
+
+A fake postback generator stands in for the target page: it signs
+(user, link_seq) pairs with tracking.link_token, re-sends a share of them
+(--duplicate-rate, as retrying senders do) and mixes in postbacks with bad
+tokens (--invalid-rate), all in random order, --concurrency at a time over
+HTTP to the real postback server with its credit batcher.
+
+Reports postbacks/s, latency percentiles and the responses by kind. After
+the final flush it checks that the balances add up to exactly one reward
+per distinct valid link and that no completed link is left uncredited.
+The scratch database (MONGO_DB_NAME, default earning_bot_bench) is dropped
+first.
+
+    python benchmarks/postback_load.py --users 2000 --links 10
+    python benchmarks/postback_load.py --backend mongomock --users 200
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from load_test import free_port, percentiles  # noqa: E402
+
+def generate_postbacks(args) -> tuple[list[dict], int]:
+    """Returns the postback query params to send and the number of distinct valid links among them."""
+    from tracking import link_token
+
+    rng = random.Random(args.seed)
+    valid = [
+        {"user": str(user), "link_seq": str(seq), "token": link_token(user, seq)}
+        for user in range(1, args.users + 1)
+        for seq in range(1, args.links + 1)
+    ]
+    postbacks = list(valid)
+    postbacks += [dict(params) for params in rng.sample(valid, int(len(valid) * args.duplicate_rate))]
+    postbacks += [
+        {**params, "token": "0" * 32} for params in rng.sample(valid, int(len(valid) * args.invalid_rate))
+    ]
+    rng.shuffle(postbacks)
+    return postbacks, len(valid)
+
+async def run(args) -> dict:
+    import aiohttp
+    import config
+    from crediting import credit_batcher
+    from database import db_manager
+    from postback_server import postback_server
+
+    if args.backend == "mongomock":
+        import database
+        from fakes import mongomock_client_class
+        database.AsyncIOMotorClient = mongomock_client_class()
+    db_manager.connect()
+    await db_manager.client.drop_database(db_manager.db.name)
+    await db_manager.ensure_indexes()
+    await db_manager.users_collection.insert_many([
+        {"tg_id": tg_id, "balance": 0.0, "completed_links": 0, "total_links": 0, "total_earned": 0.0, "upi_id": None}
+        for tg_id in range(1, args.users + 1)
+    ])
+
+    postbacks, expected_links = generate_postbacks(args)
+    url = f"http://127.0.0.1:{config.POSTBACK_PORT}{config.POSTBACK_PATH}"
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: list[float] = []
+    responses: Counter[str] = Counter()
+
+    async def send(session, params: dict) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.get(url, params=params) as response:
+                body = await response.text()
+            latencies.append(time.perf_counter() - started)
+            responses[body if response.status == 200 else str(response.status)] += 1
+
+    await credit_batcher.start()
+    await postback_server.start()
+    try:
+        connector = aiohttp.TCPConnector(limit=args.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            started = time.perf_counter()
+            await asyncio.gather(*(send(session, params) for params in postbacks))
+            seconds = time.perf_counter() - started
+    finally:
+        await postback_server.close()
+        await credit_batcher.close()
+
+    cursor = db_manager.users_collection.aggregate([{"$group": {"_id": None, "balance": {"$sum": "$balance"}}}])
+    credited = (await cursor.to_list(length=1))[0]["balance"]
+    uncredited = await db_manager.links_collection.count_documents({"credited": False})
+    db_manager.close()
+
+    results = {
+        "postbacks": len(postbacks),
+        "distinct_links": expected_links,
+        "seconds": seconds,
+        "postbacks_per_second": len(postbacks) / seconds,
+        "responses": dict(responses),
+        "latency": percentiles(latencies),
+        "credited": credited,
+        "expected_credit": expected_links * config.LINK_REWARD,
+        "uncredited_links": uncredited,
+    }
+    print(
+        f"{len(postbacks)} postbacks in {seconds:.2f} s ({results['postbacks_per_second']:.0f}/s)  "
+        f"p50 {results['latency']['p50_ms']:.2f} ms  p99 {results['latency']['p99_ms']:.2f} ms"
+    )
+    print(f"responses: {dict(responses)}")
+    print(f"credited {credited} of {results['expected_credit']}, {uncredited} links left uncredited")
+    if credited != results["expected_credit"] or uncredited:
+        raise SystemExit("Credits do not match the completed links")
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--links", type=int, default=10, help="distinct completed links per user")
+    parser.add_argument("--duplicate-rate", type=float, default=0.2, help="share of links whose postback is re-sent")
+    parser.add_argument("--invalid-rate", type=float, default=0.05, help="share of extra postbacks with a bad token")
+    parser.add_argument("--concurrency", type=int, default=256, help="postbacks in flight")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--backend", choices=("mongod", "mongomock"), default="mongod")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--log-level", default="ERROR")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+    os.environ.update(
+        MONGO_URI=args.mongo_uri,
+        POSTBACK_SECRET="benchmark",
+        POSTBACK_LISTEN="127.0.0.1",
+        POSTBACK_PORT=str(free_port()),
+    )
+    os.environ.setdefault("MONGO_DB_NAME", "earning_bot_bench")
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""Measures how throughput scales with the number of BOT_MODE=cluster workers.
+
+For each worker count from 1 to --max-workers the bot runs as it does in
+production: `python main.py` with BOT_MODE=cluster starts the front
+process, which spawns the workers and forwards every update and postback
+to the worker owning the user over its Unix socket. All workers share one
+MongoDB database, dropped before each run. The Bot API is a local
+FakeBotAPI the bot reaches through TELEGRAM_API_URL, and GP Links a local
+FakeShortener.
+
+Simulated users POST their updates to the front's webhook with the secret
+token, as Telegram would, and wait for the bot's reply before their next
+step:
+
+  /start -> (/getlink -> completion postback to the front) x --links -> /balance
+
+An update is handled when its reply reaches the fake Bot API, so reply
+latency covers the front, the socket hop, the worker and MongoDB. Reports
+updates/s (postbacks included), the speedup over one worker and reply
+latency percentiles for each worker count. The driver and the fakes run
+in this one process; if it saturates a core first, the numbers measure
+the driver.
+
+The workers are separate processes, so they need a real mongod:
+
+    python benchmarks/scaling.py --max-workers 8 --users 2000 --output scaling.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from load_test import FIRST_USER_ID, configure_environment, free_port, git_revision, percentiles  # noqa: E402
+
+SECRET_TOKEN = "benchmark"
+# Seconds the front gets to spawn its workers and register the webhook
+FRONT_START_TIMEOUT = 60.0
+
+def reset_database(args) -> None:
+    from pymongo import MongoClient
+
+    with MongoClient(args.mongo_uri) as client:
+        client.drop_database(args.db_name)
+
+async def links_completed() -> int:
+    from database import db_manager
+
+    totals, _ = await db_manager.get_stats(1)
+    db_manager.close()
+    return totals.get("links_completed", 0)
+
+class ClusterDriver:
+    """Plays the users against the front process and times each update until the bot's reply."""
+
+    def __init__(self, args, api, shortener, session, webhook_url: str, postback_url: str):
+        from fakes import UpdateFactory
+
+        self.args = args
+        self.api = api
+        self.shortener = shortener
+        self.session = session
+        self.webhook_url = webhook_url
+        self.postback_url = postback_url
+        self.updates = UpdateFactory()
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+        self.latencies: dict[str, list[float]] = {}
+
+    def record(self, name: str, started: float) -> None:
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+
+    async def send(self, tg_id: int, text: str) -> dict:
+        async with self.semaphore:
+            started = time.perf_counter()
+            async with self.session.post(
+                self.webhook_url,
+                json=self.updates.command_json(tg_id, text),
+                headers={"X-Telegram-Bot-Api-Secret-Token": SECRET_TOKEN},
+            ) as response:
+                if response.status != 200:
+                    raise RuntimeError(f"The front answered {text} with HTTP {response.status}")
+            reply = await self.api.next_reply(tg_id)
+            self.record(text.split()[0].lstrip("/"), started)
+            return reply
+
+    async def complete_link(self, short_link: str) -> None:
+        async with self.semaphore:
+            started = time.perf_counter()
+            async with self.session.get(self.postback_url, params=self.shortener.target_params(short_link)) as response:
+                await response.read()
+            self.record("postback", started)
+
+    async def user_flow(self, tg_id: int) -> None:
+        await self.send(tg_id, "/start")
+        for _ in range(self.args.links):
+            parts = (await self.send(tg_id, "/getlink"))["text"].split("`")
+            if len(parts) > 2:
+                await self.complete_link(parts[1])
+        await self.send(tg_id, "/balance")
+
+async def wait_for_front(front, api) -> None:
+    """Returns once the front has started every worker and registered the webhook."""
+    deadline = time.monotonic() + FRONT_START_TIMEOUT
+    while not api.calls["setWebhook"]:
+        if front.returncode is not None:
+            raise RuntimeError(f"The front process exited with code {front.returncode} during startup.")
+        if time.monotonic() > deadline:
+            raise RuntimeError("The cluster did not start in time.")
+        await asyncio.sleep(0.1)
+
+async def run_cluster(workers: int, args, log) -> dict:
+    import aiohttp
+
+    import config
+    from fakes import FakeBotAPI, FakeShortener
+
+    reset_database(args)
+    api_port, webhook_port = free_port(), free_port()
+    api = FakeBotAPI(args.telegram_latency)
+    await api.start("127.0.0.1", api_port)
+    shortener = FakeShortener(args.gplinks_latency, args.gplinks_jitter)
+    await shortener.start("127.0.0.1", args.gplinks_port)
+
+    env = dict(
+        os.environ,
+        BOT_MODE="cluster",
+        CLUSTER_WORKERS=str(workers),
+        CLUSTER_SOCKET_DIR=args.socket_dir,
+        TELEGRAM_API_URL=f"http://127.0.0.1:{api_port}/bot",
+        WEBHOOK_URL="https://bench.test/telegram",
+        WEBHOOK_LISTEN="127.0.0.1",
+        WEBHOOK_PORT=str(webhook_port),
+        WEBHOOK_SECRET_TOKEN=SECRET_TOKEN,
+        METRICS_PORT=str(free_port()),
+    )
+    front = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(os.path.dirname(BENCH_DIR), "main.py"), env=env, stdout=log, stderr=log,
+    )
+    try:
+        await wait_for_front(front, api)
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.concurrency)) as session:
+            driver = ClusterDriver(
+                args, api, shortener, session,
+                f"http://127.0.0.1:{webhook_port}/{config.WEBHOOK_PATH.lstrip('/')}",
+                f"http://127.0.0.1:{args.postback_port}{config.POSTBACK_PATH}",
+            )
+            users = range(FIRST_USER_ID, FIRST_USER_ID + args.users)
+            started = time.perf_counter()
+            await asyncio.gather(*(driver.user_flow(tg_id) for tg_id in users))
+            seconds = time.perf_counter() - started
+    finally:
+        if front.returncode is None:
+            front.send_signal(signal.SIGTERM)
+        await front.wait() # The workers flush their buffered credits on the way out
+        await shortener.close()
+        await api.close()
+
+    replies = [sample for name, samples in driver.latencies.items() if name != "postback" for sample in samples]
+    updates = len(replies) + len(driver.latencies.get("postback", []))
+    return {
+        "workers": workers,
+        "updates": updates,
+        "seconds": seconds,
+        "per_second": updates / seconds,
+        "reply_latency": percentiles(replies),
+        "commands": {name: percentiles(samples) for name, samples in sorted(driver.latencies.items())},
+        "links_completed": await links_completed(),
+        "shortener_requests": shortener.requests,
+    }
+
+async def run(args) -> dict:
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp, open(os.path.join(tmp, "cluster.log"), "w+") as log:
+        args.socket_dir = tmp
+        for workers in range(1, args.max_workers + 1):
+            try:
+                result = await run_cluster(workers, args, log)
+            except Exception:
+                log.seek(0)
+                sys.stderr.write(log.read()[-5000:])
+                raise
+            result["speedup"] = result["per_second"] / runs[0]["per_second"] if runs else 1.0
+            result["efficiency"] = result["speedup"] / workers
+            runs.append(result)
+            latency = result["reply_latency"]
+            print(
+                f"{workers:3d} workers: {result['updates']:7d} updates in {result['seconds']:7.2f} s  "
+                f"{result['per_second']:8.0f}/s  speedup {result['speedup']:5.2f}x  efficiency {result['efficiency']:4.0%}  "
+                f"reply p50 {latency['p50_ms']:.1f} ms  p99 {latency['p99_ms']:.1f} ms"
+            )
+    return {"meta": {"revision": git_revision(), "cpu_count": os.cpu_count(), "args": vars(args)}, "runs": runs}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--users", type=int, default=2000, help="simulated users, all active at once")
+    parser.add_argument("--links", type=int, default=3, help="links each user gets and completes")
+    parser.add_argument("--concurrency", type=int, default=256, help="max updates/postbacks in flight")
+    parser.add_argument("--gplinks-latency", type=float, default=0.05, help="seconds per fake GP Links call")
+    parser.add_argument("--gplinks-jitter", type=float, default=0.02)
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="seconds per fake Bot API call")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--db-name", default="earning_bot_scaling", help="scratch database, dropped before each run")
+    parser.add_argument("--production-limits", action="store_true", help="keep the configured rate limits")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    args.gplinks_port = free_port()
+    args.postback_port = free_port()
+
+    configure_environment(args)
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
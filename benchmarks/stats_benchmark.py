@@ -0,0 +1,123 @@
+"""Compares /stats and /top served by full scans with the incremental counters.
+
+Seeds synthetic users and withdrawal requests into a scratch database, then
+times, per query:
+  - totals: rebuild_stats() (the aggregation scans) vs get_stats() (counter reads)
+  - top-K: a collection scan sort vs get_top_earners() (total_earned index walk)
+
+Needs a MongoDB server at MONGO_URI. The scratch database (MONGO_DB_NAME,
+default earning_bot_bench) is dropped before seeding.
+
+    python benchmarks/stats_benchmark.py --users 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_DB_NAME", "earning_bot_bench")
+
+from database import db_manager  # noqa: E402
+
+SEED_BATCH = 10000
+
+async def seed(users: int, withdrawals_per_user: float) -> None:
+    await db_manager.client.drop_database(db_manager.db.name)
+    await db_manager.ensure_indexes()
+    rng = random.Random(42)
+    batch = []
+    for tg_id in range(1, users + 1):
+        earned = float(rng.randint(0, 500))
+        batch.append({
+            "tg_id": tg_id,
+            "balance": earned % 10,
+            "completed_links": int(earned % 10),
+            "total_links": int(earned),
+            "total_earned": earned,
+            "upi_id": None,
+        })
+        if len(batch) == SEED_BATCH:
+            await db_manager.users_collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await db_manager.users_collection.insert_many(batch, ordered=False)
+
+    requests = [
+        {
+            "user_tg_id": rng.randint(1, users),
+            "amount": 10.0,
+            "upi_id": "bench@upi",
+            "status": rng.choice(("pending", "approve", "reject")),
+            "timestamp": datetime.now(),
+        }
+        for _ in range(int(users * withdrawals_per_user))
+    ]
+    for start in range(0, len(requests), SEED_BATCH):
+        await db_manager.withdrawal_requests_collection.insert_many(requests[start:start + SEED_BATCH], ordered=False)
+
+async def time_calls(func, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - started)
+    return {"median_ms": statistics.median(samples) * 1000, "max_ms": max(samples) * 1000}
+
+async def scan_top(limit: int) -> list:
+    # $natural forces a collection scan, as without the total_earned index
+    cursor = (
+        db_manager.users_collection.find({}, {"_id": 0, "tg_id": 1, "total_earned": 1})
+        .sort("total_earned", -1)
+        .hint([("$natural", 1)])
+        .limit(limit)
+    )
+    return await cursor.to_list(length=limit)
+
+async def indexed_top(limit: int) -> list:
+    db_manager._top_earners = None # Measure the query, not the in-process cache
+    return await db_manager.get_top_earners(limit)
+
+async def run(args) -> dict:
+    db_manager.connect()
+    if not args.skip_seed:
+        started = time.perf_counter()
+        await seed(args.users, args.withdrawals)
+        print(f"Seeded {args.users} users in {time.perf_counter() - started:.1f} s")
+    await db_manager.ensure_indexes()
+    await db_manager.rebuild_stats() # Counters start from the seeded data
+
+    results = {
+        "users": args.users,
+        "totals_scan": await time_calls(db_manager.rebuild_stats, args.repeat),
+        "totals_counters": await time_calls(lambda: db_manager.get_stats(7), args.repeat),
+        "top_scan": await time_calls(lambda: scan_top(args.top), args.repeat),
+        "top_index": await time_calls(lambda: indexed_top(args.top), args.repeat),
+    }
+    for name in ("totals_scan", "totals_counters", "top_scan", "top_index"):
+        print(f"{name:16} median {results[name]['median_ms']:10.2f} ms   max {results[name]['max_ms']:10.2f} ms")
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--withdrawals", type=float, default=0.1, help="withdrawal requests per user")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the data of a previous run")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    db_manager.close()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
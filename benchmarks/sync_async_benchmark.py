@@ -0,0 +1,183 @@
+"""Compares /getlink-style handler throughput on blocking pymongo calls and on the Motor data layer.
+
+Each simulated /getlink reads the user and inserts a link, the MongoDB
+work of get_link(). A burst of --calls of them, spread over --users users,
+runs with at most --concurrency in flight at once, as the Application's
+concurrent_updates allows. Two data layers are compared:
+
+  - sync: what the handlers did before the Motor layer, the same
+    find_one/insert_one made with pymongo directly inside the async
+    handler, so every round-trip blocks the event loop and the handlers
+    run one after another whatever the concurrency
+  - async: the bot's own database.MongoDB, awaiting get_user() and
+    add_link(), so round-trips overlap. Its user cache is turned off, so
+    both paths send MongoDB the same queries
+
+mongomock (default) has no network, so --db-latency adds a random delay
+before and after every call: time.sleep on the sync path, as a blocking
+round-trip would, and asyncio.sleep on the async path. mongomock answers a
+find_one, and checks the links' unique index on every insert, with a scan
+run on the calling thread, so keep --users and --calls small there or the
+scans, not the round-trips, decide the result. Against a mongod the
+latency is real and --db-latency can add more on top:
+
+    python benchmarks/sync_async_benchmark.py --calls 2000 --concurrency 1,8,64,256
+    python benchmarks/sync_async_benchmark.py --backend mongod --mongo-uri mongodb://localhost:27017/
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from load_test import FIRST_USER_ID, git_revision, percentiles  # noqa: E402
+
+LINK_URL = "https://gplinks.test/benchmark"
+
+class BlockingSlowCollection:
+    """SlowCollection for pymongo: the delays block the thread, like a synchronous round-trip."""
+
+    def __init__(self, collection, rng: random.Random, max_delay: float):
+        self._collection = collection
+        self._rng = rng
+        self._max_delay = max_delay
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(self._rng.random() * self._max_delay)
+            result = attr(*args, **kwargs)
+            time.sleep(self._rng.random() * self._max_delay)
+            return result
+        return call
+
+def user_doc(tg_id: int) -> dict:
+    return {"tg_id": tg_id, "balance": 0.0, "completed_links": 0, "total_links": 0, "total_earned": 0.0, "upi_id": None}
+
+def sync_collections(args, rng: random.Random):
+    from pymongo import DESCENDING
+
+    if args.backend == "mongomock":
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo_uri, maxPoolSize=args.pool_size)
+    client.drop_database(args.db_name)
+    db = client[args.db_name]
+    # The indexes ensure_indexes() gives these collections, so both paths maintain the same ones
+    db.users.create_index("tg_id", unique=True)
+    db.users.create_index([("total_earned", DESCENDING)])
+    db.links.create_index(
+        [("user_id", 1), ("link_seq", 1)], unique=True, partialFilterExpression={"link_seq": {"$exists": True}}
+    )
+    db.links.create_index("user_id")
+    db.links.create_index("user_id", name="uncredited", partialFilterExpression={"credited": False})
+    db.users.insert_many([user_doc(tg_id) for tg_id in range(FIRST_USER_ID, FIRST_USER_ID + args.users)])
+    users, links = db.users, db.links
+    if args.db_latency:
+        users, links = (BlockingSlowCollection(collection, rng, args.db_latency) for collection in (users, links))
+    return client, users, links
+
+async def async_db_manager(args, rng: random.Random):
+    """A fresh database.MongoDB on the scratch database, with its user cache turned off."""
+    import database
+    from fakes import SlowCollection
+
+    if args.backend == "mongomock":
+        from fakes import mongomock_client_class
+        database.AsyncIOMotorClient = mongomock_client_class()
+    manager = database.MongoDB()
+    manager.user_cache = database.UserCache(max_size=0, ttl=0)
+    await manager.client.drop_database(args.db_name)
+    await manager.ensure_indexes()
+    await manager.users_collection.insert_many([user_doc(tg_id) for tg_id in range(FIRST_USER_ID, FIRST_USER_ID + args.users)])
+    if args.db_latency:
+        manager.users_collection = SlowCollection(manager.users_collection, rng, args.db_latency)
+        manager.links_collection = SlowCollection(manager.links_collection, rng, args.db_latency)
+    return manager
+
+async def burst(getlink, calls: int, users: int, concurrency: int) -> dict:
+    """Runs the /getlink calls round-robin over the users, at most `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def handle(tg_id: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await getlink(tg_id)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handle(FIRST_USER_ID + call % users) for call in range(calls)))
+    seconds = time.perf_counter() - started
+    return {"seconds": seconds, "per_second": calls / seconds, "latency": percentiles(latencies)}
+
+async def run(args) -> dict:
+    from database import USER_PROJECTION
+
+    results = {"meta": {"revision": git_revision(), "args": vars(args)}, "runs": []}
+    for concurrency in args.concurrency:
+        for path in ("sync", "async"):
+            rng = random.Random(args.seed)
+            if path == "sync":
+                client, users, links = sync_collections(args, rng)
+
+                async def getlink(tg_id: int) -> None:
+                    users.find_one({"tg_id": tg_id}, USER_PROJECTION)
+                    links.insert_one({"user_id": tg_id, "url": LINK_URL, "status": "pending"})
+            else:
+                client = await async_db_manager(args, rng)
+
+                async def getlink(tg_id: int) -> None:
+                    await client.get_user(tg_id)
+                    await client.add_link(tg_id, LINK_URL)
+
+            try:
+                run = {"path": path, "concurrency": concurrency, **await burst(getlink, args.calls, args.users, concurrency)}
+            finally:
+                client.close()
+            results["runs"].append(run)
+            print(
+                f"{path:5}  concurrency {concurrency:4d}: {run['per_second']:8.0f} /getlink/s  "
+                f"p50 {run['latency']['p50_ms']:7.1f} ms  p99 {run['latency']['p99_ms']:7.1f} ms"
+            )
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000, help="/getlink calls in the burst")
+    parser.add_argument("--users", type=int, default=100, help="users the calls are spread over")
+    parser.add_argument(
+        "--concurrency", type=lambda value: [int(level) for level in value.split(",")], default=[1, 8, 64, 256],
+        help="comma-separated handler concurrency levels",
+    )
+    parser.add_argument(
+        "--db-latency", type=float, default=0.001,
+        help="max random delay added before and after every MongoDB call, seconds",
+    )
+    parser.add_argument("--pool-size", type=int, default=100, help="MongoDB connection pool size (mongod)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--backend", choices=("mongod", "mongomock"), default="mongomock")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--db-name", default="earning_bot_sync_async", help="scratch database, dropped before each run")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    # database reads its connection settings from config at import
+    os.environ.update(MONGO_URI=args.mongo_uri, MONGO_DB_NAME=args.db_name, MONGO_MAX_POOL_SIZE=str(args.pool_size))
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Replays a recorded stream of Telegram Update JSON against the bot's webhook endpoint.
+
+The bot runs as in BOT_MODE=webhook: the Updater's webhook server listens
+on a local port and the Application processes updates concurrently
+(CONCURRENT_UPDATES). Telegram's side is replaced by a fake Bot API
+request, GP Links by the local fake server, and MongoDB is a local mongod
+(default) or mongomock, as in load_test.py.
+
+The stream is one Update JSON object per line. --record writes a
+synthetic stream (/start, then --links rounds of /getlink, then /balance,
+/top and /withdraw for --users users) so it can be replayed unchanged on
+other commits; --updates replays an existing file. Each update is POSTed
+with the secret token header, at most --concurrency in flight until
+processed, and the latency of an update runs from the POST until the
+Application has finished its handlers.
+
+Reports updates/s and latency percentiles per command, and the time the
+webhook server took to accept the POSTs.
+
+    python benchmarks/webhook_replay.py --record updates.jsonl --users 2000
+    python benchmarks/webhook_replay.py --updates updates.jsonl --output results.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from load_test import configure_environment, free_port, git_revision, percentiles  # noqa: E402
+
+SECRET_TOKEN = "replay-secret"
+
+def record_stream(path: str, users: int, links: int) -> None:
+    from fakes import UpdateFactory
+
+    factory = UpdateFactory()
+    tg_ids = range(1_000_000, 1_000_000 + users)
+    commands = ["/start"] + ["/getlink"] * links + ["/balance", "/top"]
+    with open(path, "w") as f:
+        for command in commands:
+            for tg_id in tg_ids:
+                f.write(json.dumps(factory.command_json(tg_id, command)) + "\n")
+        for tg_id in tg_ids:
+            f.write(json.dumps(factory.command_json(tg_id, f"/withdraw user{tg_id}@upi")) + "\n")
+
+def command_of(data: dict) -> str:
+    text = data.get("message", {}).get("text")
+    if text:
+        return text.split(maxsplit=1)[0].lstrip("/")
+    return "callback" if "callback_query" in data else "other"
+
+async def replay(args, stream: list[dict]) -> dict:
+    import aiohttp
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    import main as bot
+    from database import db_manager
+    from fakes import FakeShortener, FakeTelegramRequest, mongomock_client_class
+
+    logging.getLogger().setLevel(args.log_level)
+    if args.backend == "mongomock":
+        import database
+        database.AsyncIOMotorClient = mongomock_client_class()
+    db_manager.connect()
+    await db_manager.client.drop_database(args.db_name)
+
+    sent: dict[int, float] = {}
+    finished: dict[int, asyncio.Future] = {}
+    latencies: dict[str, list[float]] = defaultdict(list)
+    accept_latencies: list[float] = []
+
+    async def mark_done(update: Update, context) -> None:
+        future = finished.get(update.update_id)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    shortener = FakeShortener(args.gplinks_latency, args.gplinks_jitter)
+    await shortener.start("127.0.0.1", args.gplinks_port)
+    application = bot.build_application(request=FakeTelegramRequest(args.telegram_latency))
+    # Runs after every other handler group, once the update is fully processed
+    application.add_handler(TypeHandler(Update, mark_done), group=1000)
+    url = f"http://127.0.0.1:{args.webhook_port}/replay"
+    semaphore = asyncio.Semaphore(args.concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def post(session, data: dict) -> None:
+        async with semaphore:
+            update_id = data["update_id"]
+            finished[update_id] = loop.create_future()
+            sent[update_id] = time.perf_counter()
+            async with session.post(
+                url, json=data, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET_TOKEN}
+            ) as response:
+                await response.read()
+                if response.status != 200:
+                    raise RuntimeError(f"Webhook answered {response.status}")
+            accept_latencies.append(time.perf_counter() - sent[update_id])
+            done_at = await finished[update_id]
+            del finished[update_id]
+            latencies[command_of(data)].append(done_at - sent[update_id])
+
+    try:
+        async with application:
+            await bot.post_init(application)
+            await application.updater.start_webhook(
+                listen="127.0.0.1",
+                port=args.webhook_port,
+                url_path="replay",
+                webhook_url=url,
+                secret_token=SECRET_TOKEN,
+                allowed_updates=bot.ALLOWED_UPDATES,
+            )
+            await application.start()
+            try:
+                connector = aiohttp.TCPConnector(limit=args.concurrency)
+                async with aiohttp.ClientSession(connector=connector) as session:
+                    started = time.perf_counter()
+                    await asyncio.gather(*(post(session, data) for data in stream))
+                    seconds = time.perf_counter() - started
+            finally:
+                await application.updater.stop()
+                await application.stop()
+                await bot.post_shutdown(application)
+    finally:
+        await shortener.close()
+
+    updates = sum(len(samples) for samples in latencies.values())
+    return {
+        "meta": {"revision": git_revision(), "args": {k: v for k, v in vars(args).items() if not k.endswith("_port")}},
+        "updates": updates,
+        "seconds": seconds,
+        "updates_per_second": updates / seconds,
+        "accept": percentiles(accept_latencies),
+        "commands": {name: percentiles(samples) for name, samples in sorted(latencies.items())},
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--updates", help="replay this JSONL file of Update objects")
+    source.add_argument("--record", help="write a synthetic stream to this file, then replay it")
+    parser.add_argument("--users", type=int, default=2000, help="users in a recorded stream")
+    parser.add_argument("--links", type=int, default=3, help="/getlink rounds in a recorded stream")
+    parser.add_argument("--concurrency", type=int, default=256, help="updates in flight")
+    parser.add_argument("--gplinks-latency", type=float, default=0.05)
+    parser.add_argument("--gplinks-jitter", type=float, default=0.02)
+    parser.add_argument("--telegram-latency", type=float, default=0.0)
+    parser.add_argument("--backend", choices=("mongod", "mongomock"), default="mongod")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--db-name", default="earning_bot_replay", help="scratch database, dropped first")
+    parser.add_argument("--production-limits", action="store_true", help="keep the configured rate limits")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    args.gplinks_port = free_port()
+    args.postback_port = free_port()
+    args.webhook_port = free_port()
+
+    configure_environment(args)
+    os.environ.update(BOT_MODE="webhook", WEBHOOK_SECRET_TOKEN=SECRET_TOKEN)
+    if args.record:
+        record_stream(args.record, args.users, args.links)
+    with open(args.updates or args.record) as f:
+        stream = [json.loads(line) for line in f if line.strip()]
+
+    results = asyncio.run(replay(args, stream))
+
+    print(f"{results['updates']} updates in {results['seconds']:.2f} s ({results['updates_per_second']:.0f}/s)")
+    print(f"{'command':16}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, stats in [("(accept)", results["accept"]), *results["commands"].items()]:
+        print(
+            f"{name:16}{stats['count']:8d}{stats['p50_ms']:10.2f}{stats['p90_ms']:10.2f}"
+            f"{stats['p99_ms']:10.2f}{stats['max_ms']:10.2f}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
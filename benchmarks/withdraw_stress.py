@@ -0,0 +1,178 @@
+"""Races credits against withdrawals and checks that no money is lost or paid out twice.
+
+Every user gets --credits credits of 1.0 (update_user_balance) while
+/withdraw taps for the same user keep arriving, each one a double tap, until
+the credits are done. Two withdrawal paths are compared:
+
+  - atomic: MongoDB.withdraw_balance(), one conditional find_one_and_update
+    claiming the balance plus the request insert, in one transaction when
+    the server supports them
+  - legacy: what /withdraw did before, a user read + balance check in Python,
+    then $set upi_id, insert request and $set balance 0: four round-trips
+
+Afterwards every user's balance plus their withdrawal requests must add up
+to what they were credited. Reports the money lost (or created), duplicate
+requests and withdrawal latency percentiles per path.
+
+Run it against a replica set so the transactional path is exercised; a
+single-member one is enough:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017 &
+    mongosh --eval 'rs.initiate()'
+    python benchmarks/withdraw_stress.py --mongo-uri "mongodb://localhost:27017/?replicaSet=rs0"
+
+The scratch database (MONGO_DB_NAME, default earning_bot_bench) is dropped
+before each path. --backend mongomock runs without transactions and with
+every call in-process, so give it --db-latency to let the calls overlap:
+
+    python benchmarks/withdraw_stress.py --backend mongomock --db-latency 0.002
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+os.environ.setdefault("MONGO_DB_NAME", "earning_bot_bench")
+
+from load_test import git_revision, percentiles  # noqa: E402
+
+MIN_BALANCE = 10
+
+async def legacy_withdraw(db_manager, tg_id: int, upi_id: str) -> float | None:
+    from database import new_withdrawal_request
+
+    user = await db_manager.users_collection.find_one({"tg_id": tg_id}, {"balance": 1})
+    if not user or user["balance"] < MIN_BALANCE:
+        return None
+    amount = user["balance"]
+    db_manager.user_cache.begin_write(tg_id)
+    try:
+        await db_manager.users_collection.update_one({"tg_id": tg_id}, {"$set": {"upi_id": upi_id}})
+        await db_manager.withdrawal_requests_collection.insert_one(new_withdrawal_request(tg_id, amount, upi_id))
+        await db_manager.users_collection.update_one(
+            {"tg_id": tg_id}, {"$set": {"balance": 0.0, "completed_links": 0}}
+        )
+    finally:
+        db_manager.user_cache.end_write(tg_id)
+    return amount
+
+async def run_path(path: str, args) -> dict:
+    from database import db_manager
+
+    db_manager.close() # Fresh collections, indexes and user cache for each path
+    db_manager.user_cache = type(db_manager.user_cache)(args.users, 300)
+    await db_manager.client.drop_database(db_manager.db.name)
+    await db_manager.ensure_indexes()
+    await db_manager.users_collection.insert_many([
+        {"tg_id": tg_id, "balance": 0.0, "completed_links": 0, "total_links": 0, "total_earned": 0.0, "upi_id": None}
+        for tg_id in range(1, args.users + 1)
+    ])
+    rng = random.Random(args.seed)
+    if args.db_latency:
+        from fakes import SlowCollection
+        for name in ("users_collection", "withdrawal_requests_collection"):
+            setattr(db_manager, name, SlowCollection(getattr(db_manager, name), rng, args.db_latency))
+    latencies: list[float] = []
+
+    async def withdraw(tg_id: int) -> None:
+        started = time.perf_counter()
+        if path == "atomic":
+            await db_manager.withdraw_balance(tg_id, f"user{tg_id}@upi", MIN_BALANCE)
+        else:
+            await legacy_withdraw(db_manager, tg_id, f"user{tg_id}@upi")
+        latencies.append(time.perf_counter() - started)
+
+    async def user_traffic(tg_id: int) -> None:
+        crediting = asyncio.create_task(credits(tg_id))
+        # Taps keep coming for as long as the credits do, then once more for the rest
+        while not crediting.done():
+            await asyncio.sleep(rng.random() * args.tap_interval)
+            await asyncio.gather(withdraw(tg_id), withdraw(tg_id))
+        await crediting
+        await asyncio.gather(withdraw(tg_id), withdraw(tg_id))
+
+    async def credits(tg_id: int) -> None:
+        for _ in range(args.credits):
+            await db_manager.update_user_balance(tg_id, 1.0)
+            await asyncio.sleep(rng.random() * args.credit_interval)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_traffic(tg_id) for tg_id in range(1, args.users + 1)))
+    seconds = time.perf_counter() - started
+
+    balances = {
+        user["tg_id"]: user["balance"]
+        async for user in db_manager.users_collection.find({}, {"tg_id": 1, "balance": 1})
+    }
+    withdrawn = dict.fromkeys(balances, 0.0)
+    requests = 0
+    async for req in db_manager.withdrawal_requests_collection.find({}, {"user_tg_id": 1, "amount": 1}):
+        withdrawn[req["user_tg_id"]] += req["amount"]
+        requests += 1
+    # Positive: credits that vanished; negative: money paid out that was never credited
+    discrepancies = {
+        tg_id: args.credits - balances[tg_id] - withdrawn[tg_id]
+        for tg_id in balances if balances[tg_id] + withdrawn[tg_id] != args.credits
+    }
+    return {
+        "transactions": db_manager.supports_transactions,
+        "seconds": seconds,
+        "withdraw_calls": len(latencies),
+        "requests_filed": requests,
+        "users_off": len(discrepancies),
+        "money_lost": sum(amount for amount in discrepancies.values() if amount > 0),
+        "money_created": -sum(amount for amount in discrepancies.values() if amount < 0),
+        "withdraw_latency": percentiles(latencies),
+    }
+
+async def run(args) -> dict:
+    from database import db_manager
+
+    if args.backend == "mongomock":
+        import database
+        from fakes import mongomock_client_class
+        database.AsyncIOMotorClient = mongomock_client_class()
+    results = {"meta": {"revision": git_revision(), "args": vars(args)}}
+    for path in args.paths:
+        results[path] = stats = await run_path(path, args)
+        latency = stats["withdraw_latency"]
+        print(
+            f"{path:7} transactions={stats['transactions']}  {stats['requests_filed']} requests from "
+            f"{stats['withdraw_calls']} taps  lost {stats['money_lost']:.2f}  created {stats['money_created']:.2f}  "
+            f"({stats['users_off']} users off)  withdraw p50 {latency['p50_ms']:.2f} ms  p99 {latency['p99_ms']:.2f} ms"
+        )
+    db_manager.close()
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--credits", type=int, default=100, help="credits of 1.0 per user")
+    parser.add_argument("--tap-interval", type=float, default=0.01, help="max random pause between taps, seconds")
+    parser.add_argument("--credit-interval", type=float, default=0.001, help="max random pause between credits, seconds")
+    parser.add_argument(
+        "--db-latency", type=float, default=0.0,
+        help="max random delay added before and after every users/requests call, seconds (for mongomock)",
+    )
+    parser.add_argument("--paths", type=lambda value: value.split(","), default=["legacy", "atomic"])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--backend", choices=("mongod", "mongomock"), default="mongod")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/?replicaSet=rs0")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+    os.environ["MONGO_URI"] = args.mongo_uri
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if any(results[path]["users_off"] for path in args.paths if path == "atomic"):
+        raise SystemExit("The atomic withdrawal lost or created money")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+
+import aiohttp
+from aiohttp import web
+from telegram import Bot, Update
+
+from config import (
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_API_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_URL,
+    WEBHOOK_SECRET_TOKEN,
+    POSTBACK_LISTEN,
+    POSTBACK_PORT,
+    POSTBACK_PATH,
+    CLUSTER_WORKERS,
+    CLUSTER_SOCKET_DIR,
+    GPLINKS_RATE_LIMIT,
+    GPLINKS_BURST,
+    TELEGRAM_BROADCAST_RATE,
+    METRICS_PORT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Route on the worker's Unix socket that accepts forwarded Telegram updates
+WORKER_UPDATE_PATH = "/telegram"
+# Seconds a worker gets to flush and exit before it is killed
+WORKER_STOP_TIMEOUT = 15.0
+# Seconds to wait for a freshly spawned worker to open its socket
+WORKER_START_TIMEOUT = 30.0
+
+def update_user_id(data: dict) -> int | None:
+    """Returns the id of the user who sent a raw Telegram update, if it has one."""
+    for key in ("message", "edited_message", "callback_query", "my_chat_member", "inline_query"):
+        item = data.get(key)
+        if item and "from" in item:
+            return item["from"].get("id")
+    return None
+
+def shard_for(tg_id: int, workers: int) -> int:
+    return tg_id % workers
+
+class ClusterFront:
+    """Front process of BOT_MODE=cluster: receives webhooks and postbacks, shards them by tg_id.
+
+    Every user is always served by the same worker process, so the per-user
+    state each worker keeps in memory (user cache, rate limiters, link pool,
+    buffered credits) is never split across processes. Workers are separate
+    interpreters running the normal Application; requests reach them over
+    Unix sockets and a worker that dies is restarted.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.socket_paths = [
+            os.path.join(CLUSTER_SOCKET_DIR, f"bot-{os.getpid()}-worker-{index}.sock") for index in range(workers)
+        ]
+        self.processes: list[asyncio.subprocess.Process | None] = [None] * workers
+        self.sessions: list[aiohttp.ClientSession] = []
+        self.runners: list[web.AppRunner] = []
+        self._monitors: list[asyncio.Task] = []
+        self._closing = False
+        self.forwarded = 0
+        self.failed = 0
+        self.restarts = 0
+
+    def worker_env(self, index: int) -> dict:
+        """Environment of a worker: its own metrics port, and a share of the global rate budgets."""
+        env = dict(os.environ)
+        env.update(
+            CLUSTER_WORKER_INDEX=str(index),
+            POSTBACK_SERVER_ENABLED="false",
+            METRICS_PORT=str(METRICS_PORT + 1 + index),
+            GPLINKS_RATE_LIMIT=str(GPLINKS_RATE_LIMIT / self.workers),
+            GPLINKS_BURST=str(max(1, GPLINKS_BURST // self.workers)),
+            TELEGRAM_BROADCAST_RATE=str(TELEGRAM_BROADCAST_RATE / self.workers),
+        )
+        return env
+
+    async def start(self):
+        for index in range(self.workers):
+            await self._spawn(index)
+        for index, path in enumerate(self.socket_paths):
+            await self._wait_for_socket(index, path)
+            self.sessions.append(aiohttp.ClientSession(
+                connector=aiohttp.UnixConnector(path=path),
+                timeout=aiohttp.ClientTimeout(total=30),
+            ))
+        self._monitors = [asyncio.create_task(self._monitor(index)) for index in range(self.workers)]
+
+        webhook_app = web.Application()
+        webhook_app.router.add_post(f"/{WEBHOOK_PATH.lstrip('/')}", self.handle_update)
+        postback_app = web.Application()
+        postback_app.router.add_get(POSTBACK_PATH, self.handle_postback)
+        postback_app.router.add_post(POSTBACK_PATH, self.handle_postback)
+        for app, host, port in ((webhook_app, WEBHOOK_LISTEN, WEBHOOK_PORT), (postback_app, POSTBACK_LISTEN, POSTBACK_PORT)):
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, host, port, backlog=1024).start()
+            self.runners.append(runner)
+        logger.info(
+            "Cluster front routing %s:%s/%s and %s:%s%s to %s workers.",
+            WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, POSTBACK_LISTEN, POSTBACK_PORT, POSTBACK_PATH, self.workers,
+        )
+
+    async def close(self):
+        self._closing = True
+        for runner in self.runners:
+            await runner.cleanup()
+        self.runners = []
+        for monitor in self._monitors:
+            monitor.cancel()
+        await asyncio.gather(*self._monitors, return_exceptions=True)
+        for process in self.processes:
+            if process is not None and process.returncode is None:
+                process.terminate()
+        for process in self.processes:
+            if process is None:
+                continue
+            try:
+                await asyncio.wait_for(process.wait(), timeout=WORKER_STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.error("Worker pid %s did not stop in time; killing it.", process.pid)
+                process.kill()
+                await process.wait()
+        for session in self.sessions:
+            await session.close()
+        self.sessions = []
+        for path in self.socket_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        logger.info("Cluster stopped: %s forwarded, %s failed, %s worker restarts.", self.forwarded, self.failed, self.restarts)
+
+    async def _spawn(self, index: int):
+        path = self.socket_paths[index]
+        if os.path.exists(path):
+            os.remove(path)
+        self.processes[index] = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), "worker", path, env=self.worker_env(index),
+        )
+        logger.info("Started worker %s (pid %s).", index, self.processes[index].pid)
+
+    async def _wait_for_socket(self, index: int, path: str):
+        deadline = asyncio.get_running_loop().time() + WORKER_START_TIMEOUT
+        while not os.path.exists(path):
+            if self.processes[index].returncode is not None:
+                raise RuntimeError(f"Worker {index} exited during startup.")
+            if asyncio.get_running_loop().time() > deadline:
+                raise RuntimeError(f"Worker {index} did not open {path} in time.")
+            await asyncio.sleep(0.1)
+
+    async def _monitor(self, index: int):
+        while True:
+            returncode = await self.processes[index].wait()
+            if self._closing:
+                return
+            self.restarts += 1
+            logger.error("Worker %s exited with code %s; restarting it.", index, returncode)
+            await asyncio.sleep(1)
+            await self._spawn(index)
+            try:
+                await self._wait_for_socket(index, self.socket_paths[index])
+            except RuntimeError as e:
+                logger.error("%s", e)
+
+    async def _forward(self, shard: int, request: web.Request, path: str) -> web.Response:
+        body = await request.read()
+        headers = {"Content-Type": request.headers["Content-Type"]} if "Content-Type" in request.headers else None
+        try:
+            async with self.sessions[shard].request(request.method, f"http://worker{path}", data=body, headers=headers) as response:
+                payload = await response.read()
+                self.forwarded += 1
+                return web.Response(status=response.status, body=payload, content_type=response.content_type)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Telegram and the postback sender both retry on errors
+            self.failed += 1
+            logger.warning("Worker %s unavailable: %s", shard, e)
+            return web.Response(status=503, text="try again")
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET_TOKEN and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET_TOKEN:
+            return web.Response(status=403)
+        try:
+            data = json.loads(await request.read())
+        except ValueError:
+            return web.Response(status=400)
+        key = update_user_id(data)
+        if key is None:
+            key = data.get("update_id", 0)
+        return await self._forward(shard_for(key, self.workers), request, WORKER_UPDATE_PATH)
+
+    async def handle_postback(self, request: web.Request) -> web.Response:
+        params = request.query if request.method == "GET" else await request.post()
+        try:
+            user_tg_id = int(params["user"])
+        except (KeyError, ValueError):
+            return web.Response(status=400, text="bad request")
+        return await self._forward(shard_for(user_tg_id, self.workers), request, request.path_qs)
+
+async def run_cluster(allowed_updates: list[str]) -> None:
+    """Runs the front process until SIGINT/SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    front = ClusterFront(CLUSTER_WORKERS)
+    try:
+        await front.start()
+        async with Bot(TELEGRAM_BOT_TOKEN, base_url=TELEGRAM_API_URL) as bot:
+            await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET_TOKEN, allowed_updates=allowed_updates)
+        await stop.wait()
+    finally:
+        await front.close()
+
+async def serve_worker(socket_path: str) -> None:
+    """Runs one worker: the normal Application, fed from the front process instead of an Updater."""
+    # Imported here so config is read with the environment set by the front process
+    import config
+    import main as bot
+    from postback_server import postback_server
+
+    config.validate()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    application = bot.build_application(updater=False)
+
+    async def handle_update(request: web.Request) -> web.Response:
+        await application.update_queue.put(Update.de_json(await request.json(), application.bot))
+        return web.Response()
+
+    app = postback_server.build_app()
+    app.router.add_post(WORKER_UPDATE_PATH, handle_update)
+    runner = web.AppRunner(app, access_log=None)
+
+    async with application:
+        await bot.post_init(application)
+        await application.start()
+        await runner.setup()
+        await web.UnixSite(runner, socket_path).start()
+        logger.info("Worker %s serving on %s.", os.getpid(), socket_path)
+        await stop.wait()
+        await runner.cleanup()
+        await application.stop()
+        await bot.post_shutdown(application)
+
+if __name__ == "__main__" and sys.argv[1:2] == ["worker"]:
+    asyncio.run(serve_worker(sys.argv[2]))
@@ -3,25 +3,147 @@ from dotenv import load_dotenv
 
 load_dotenv() # Load environment variables from .env file
 
+# Settings are only read here; validate() checks them when the bot starts, so
+# importing config (e.g. from tools or benchmarks) never raises.
+
 # Telegram Bot Token
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-if not TELEGRAM_BOT_TOKEN:
-    raise ValueError("TELEGRAM_BOT_TOKEN environment variable not set.")
+# Bot API endpoint the token is appended to, e.g. a self-hosted telegram-bot-api server
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+
+# How the bot receives updates: "polling" (default), "webhook", or "cluster"
+# (a front process receives the webhook and shards updates across CLUSTER_WORKERS processes)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") # Public HTTPS URL Telegram posts to, e.g. https://bot.example.com/telegram
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN") # Checked against X-Telegram-Bot-Api-Secret-Token
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", str(os.cpu_count() or 1)))
+CLUSTER_SOCKET_DIR = os.getenv("CLUSTER_SOCKET_DIR", "/tmp") # Where worker Unix sockets are created
+CLUSTER_WORKER_INDEX = int(os.getenv("CLUSTER_WORKER_INDEX", "-1")) # Set by the front process; -1 outside cluster workers
+# Updates processed concurrently by the Application (1 = strictly sequential)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
 
 # MongoDB Connection URI
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
-if not MONGO_URI:
-    raise ValueError("MONGO_URI environment variable not set.")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "earning_bot")
+
+# MongoDB connection pool bounds (shared by all concurrently running handlers)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+
+# In-memory user document cache
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "1000000")) # Max cached users (LRU eviction)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300")) # Seconds before a cached user is re-read
+
+# Write-behind crediting: balance increments and link inserts are buffered and flushed in bulk
+CREDIT_FLUSH_INTERVAL = float(os.getenv("CREDIT_FLUSH_INTERVAL", "0.5")) # Seconds between flushes
+CREDIT_BATCH_SIZE = int(os.getenv("CREDIT_BATCH_SIZE", "500")) # Buffered writes that trigger an early flush
 
 # GP Links API Key
 GPLINKS_API_KEY = os.getenv("GPLINKS_API_KEY")
-if not GPLINKS_API_KEY:
-    raise ValueError("GPLINKS_API_KEY environment variable not set.")
+
+GPLINKS_API_URL = os.getenv("GPLINKS_API_URL", "https://gplinks.in/api")
+
+# Optional failover shorteners, tried in order when GP Links is failing
+SECONDARY_SHORTENER_API_URL = os.getenv("SECONDARY_SHORTENER_API_URL") # Same ?api=<key>&url=<url> JSON API
+SECONDARY_SHORTENER_API_KEY = os.getenv("SECONDARY_SHORTENER_API_KEY")
+SHORTENER_RAW_FALLBACK = os.getenv("SHORTENER_RAW_FALLBACK", "false").lower() in ("1", "true", "yes") # Hand out the target URL itself
+
+# Retries and circuit breaking around shortener calls
+SHORTENER_DEADLINE = float(os.getenv("SHORTENER_DEADLINE", "10")) # Seconds for one link across all retries/providers
+SHORTENER_MAX_RETRIES = int(os.getenv("SHORTENER_MAX_RETRIES", "2")) # Retries per provider
+SHORTENER_RETRY_BASE_DELAY = float(os.getenv("SHORTENER_RETRY_BASE_DELAY", "0.2")) # Seconds, doubled per retry, jittered
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5")) # Consecutive failures that open the breaker
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5")) # Error rate over the window that opens the breaker
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20")) # Recent calls the error rate is computed over
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30")) # Seconds open before probing again
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "1")) # Concurrent probe calls when half-open
+
+# GP Links HTTP client tuning (seconds unless noted)
+GPLINKS_MAX_CONCURRENCY = int(os.getenv("GPLINKS_MAX_CONCURRENCY", "20")) # Max in-flight API requests
+GPLINKS_CONNECT_TIMEOUT = float(os.getenv("GPLINKS_CONNECT_TIMEOUT", "5"))
+GPLINKS_TOTAL_TIMEOUT = float(os.getenv("GPLINKS_TOTAL_TIMEOUT", "15"))
+GPLINKS_DNS_CACHE_TTL = int(os.getenv("GPLINKS_DNS_CACHE_TTL", "300"))
+GPLINKS_KEEPALIVE_TIMEOUT = float(os.getenv("GPLINKS_KEEPALIVE_TIMEOUT", "60"))
+GPLINKS_RATE_LIMIT = float(os.getenv("GPLINKS_RATE_LIMIT", "20")) # Global API calls/second budget
+GPLINKS_BURST = int(os.getenv("GPLINKS_BURST", "40"))
+# Share of GPLINKS_BURST that link pool refills leave untouched for live /getlink calls
+GPLINKS_REFILL_HEADROOM = float(os.getenv("GPLINKS_REFILL_HEADROOM", "0.25"))
+
+# Page every earning shortlink points to (user and link_seq are appended as query params)
+TARGET_BASE_URL = os.getenv("TARGET_BASE_URL", "https://yourwebsite.com/earn_page")
+
+# Completion postbacks: the target page calls back POSTBACK_PATH with user, link_seq and token
+POSTBACK_SECRET = os.getenv("POSTBACK_SECRET") # HMAC key for the token embedded in target URLs
+POSTBACK_LISTEN = os.getenv("POSTBACK_LISTEN", "0.0.0.0")
+POSTBACK_PORT = int(os.getenv("POSTBACK_PORT", "8080"))
+POSTBACK_PATH = os.getenv("POSTBACK_PATH", "/postback")
+LINK_REWARD = float(os.getenv("LINK_REWARD", "1.0")) # Amount credited per completed link
+# Cluster workers receive postbacks from the front process instead of listening themselves
+POSTBACK_SERVER_ENABLED = os.getenv("POSTBACK_SERVER_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Mongo-backed per-user leases guarding critical sections (e.g. withdrawals) across workers
+LEASE_TTL = float(os.getenv("LEASE_TTL", "30")) # Seconds before an unreleased lease expires
+LEASE_WAIT = float(os.getenv("LEASE_WAIT", "2")) # Seconds to keep retrying a held lease
+
+# Per-user command rate limits (rate = sustained requests/second, burst = requests allowed back to back)
+GETLINK_RATE = float(os.getenv("GETLINK_RATE", "0.2"))
+GETLINK_BURST = int(os.getenv("GETLINK_BURST", "3"))
+COMMAND_RATE = float(os.getenv("COMMAND_RATE", "1"))
+COMMAND_BURST = int(os.getenv("COMMAND_BURST", "5"))
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", "1000000")) # Tracked users before idle ones are swept
+
+# Shortlink pre-generation pool
+LINK_POOL_SIZE = int(os.getenv("LINK_POOL_SIZE", "5")) # Links kept ready per active user
+LINK_POOL_LOW_WATERMARK = int(os.getenv("LINK_POOL_LOW_WATERMARK", "2")) # Refill when this few remain
+LINK_POOL_MAX_USERS = int(os.getenv("LINK_POOL_MAX_USERS", "10000")) # Least recently active users are dropped
+# Max API calls per refill batch; capped at the part of GPLINKS_BURST refills may use
+LINK_POOL_REFILL_BATCH = int(os.getenv("LINK_POOL_REFILL_BATCH", "30"))
+LINK_POOL_REFILL_INTERVAL = float(os.getenv("LINK_POOL_REFILL_INTERVAL", "1.0")) # Seconds between refill batches
+
+# Pending withdrawal requests shown per /admin page
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", "10"))
+
+# /top leaderboard and /stats
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "10")) # Users shown by /top
+LEADERBOARD_CACHE_TTL = float(os.getenv("LEADERBOARD_CACHE_TTL", "30")) # Seconds a leaderboard read is reused
+STATS_DAYS = int(os.getenv("STATS_DAYS", "7")) # Daily rollups shown by /stats
+# Documents the stats counters are spread over, so concurrent transactions rarely write the same one
+STATS_SHARDS = int(os.getenv("STATS_SHARDS", "16"))
+
+# Outgoing notifications (admin alerts, withdrawal updates, /broadcast)
+TELEGRAM_BROADCAST_RATE = float(os.getenv("TELEGRAM_BROADCAST_RATE", "25")) # Messages/second overall (Telegram allows ~30)
+NOTIFY_PER_CHAT_RATE = float(os.getenv("NOTIFY_PER_CHAT_RATE", "1")) # Messages/second to a single chat
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "8"))
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "10000"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "3"))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "1000")) # Users fetched per cursor batch
+
+# Local Prometheus-style metrics endpoint
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5")) # Seconds between event loop lag samples
 
 # Admin User IDs (Telegram user IDs)
 # These should be integers, separated by commas if multiple. E.g., "123456789,987654321"
 ADMIN_IDS_STR = os.getenv("ADMIN_IDS", "")
 ADMIN_IDS = [int(x.strip()) for x in ADMIN_IDS_STR.split(',') if x.strip().isdigit()]
 
-if not ADMIN_IDS:
-    print("WARNING: No ADMIN_IDS found in environment variables. Admin commands will not work.")
+def validate() -> None:
+    """Raises ValueError for missing or invalid settings. Called once at startup."""
+    if not TELEGRAM_BOT_TOKEN:
+        raise ValueError("TELEGRAM_BOT_TOKEN environment variable not set.")
+    if BOT_MODE not in ("polling", "webhook", "cluster"):
+        raise ValueError("BOT_MODE must be 'polling', 'webhook' or 'cluster'.")
+    if BOT_MODE in ("webhook", "cluster") and not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL environment variable not set (required when BOT_MODE=webhook or cluster).")
+    if not MONGO_URI:
+        raise ValueError("MONGO_URI environment variable not set.")
+    if not GPLINKS_API_KEY:
+        raise ValueError("GPLINKS_API_KEY environment variable not set.")
+    if not POSTBACK_SECRET:
+        raise ValueError("POSTBACK_SECRET environment variable not set.")
+    if not ADMIN_IDS:
+        print("WARNING: No ADMIN_IDS found in environment variables. Admin commands will not work.")
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+
+from config import CREDIT_FLUSH_INTERVAL, CREDIT_BATCH_SIZE
+from database import MongoDB, db_manager
+
+logger = logging.getLogger(__name__)
+
+class CreditBatcher:
+    """Write-behind queue for link completions.
+
+    Balance increments are coalesced per tg_id and new link entries are
+    buffered, then both are flushed every CREDIT_FLUSH_INTERVAL seconds (or
+    as soon as CREDIT_BATCH_SIZE writes are buffered) as one users bulk_write
+    and one links insert_many. Writes that fail stay buffered for the next
+    flush.
+
+    Credits for completed links are recorded durably on the link
+    (credited: False until paid), so reconcile() re-queues any that a crash
+    or failed shutdown flush left unpaid. A flush pays a link only by
+    flipping that flag, so re-sending a link never pays it twice.
+    """
+
+    def __init__(self, db: MongoDB):
+        self.db = db
+        self._increments: dict[int, tuple[float, int]] = {}
+        self._links: list[dict] = []
+        # tg_id -> completed link_seqs to pay; their rewards are read from the links
+        self._completed: dict[int, list[int]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self.flushes = 0
+        self.credits_flushed = 0
+        self.links_flushed = 0
+        self.failed_flushes = 0
+
+    async def start(self):
+        """Starts the periodic flusher. Must run inside the bot's event loop."""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            logger.info("Credit batcher started.")
+
+    async def close(self):
+        """Stops the flusher and writes out everything still buffered."""
+        if self._task is not None:
+            # Cancelling a flush in progress would drop the buffers it took, so wait it out first
+            async with self._flush_lock:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if not await self.flush():
+            logger.error(
+                "Credit batcher stopped with %s unwritten credits and %s links; "
+                "completed links are credited by reconcile() at the next start.",
+                len(self._increments), len(self._links),
+            )
+        logger.info(
+            "Credit batcher stopped after %s flushes (%s credits, %s links).",
+            self.flushes, self.credits_flushed, self.links_flushed,
+        )
+
+    def credit(self, tg_id: int, amount: float = 1.0, links: int = 1, link_seq: int | None = None):
+        """Queues a balance increment for tg_id.
+
+        With link_seq, the credit is the reward complete_link() stored on that
+        link instead of amount, paid at most once.
+        """
+        if link_seq is not None:
+            self._completed.setdefault(tg_id, []).append(link_seq)
+        else:
+            self._add_increment(tg_id, amount, links)
+        self._maybe_wake()
+
+    async def reconcile(self, workers: int = 1, index: int = 0) -> int:
+        """Credits completed links whose credit never reached MongoDB. Run at startup, before postbacks arrive.
+
+        In cluster mode each worker reconciles only its own shard of users.
+        Returns the number of links credited.
+        """
+        count = 0
+        async for user_id, link_seq, reward in self.db.iter_uncredited_links(workers, index):
+            self.credit(user_id, reward, link_seq=link_seq)
+            count += 1
+            if count % CREDIT_BATCH_SIZE == 0:
+                await self.flush()
+        await self.flush()
+        if count:
+            logger.warning("Reconciled %s completed links that had not been credited.", count)
+        return count
+
+    def _add_increment(self, tg_id: int, amount: float, links: int):
+        pending_amount, pending_links = self._increments.get(tg_id, (0.0, 0))
+        self._increments[tg_id] = (pending_amount + amount, pending_links + links)
+
+    def add_link(self, user_id: int, url: str, link_seq: int, status: str = 'pending'):
+        """Queues a new shortlink entry."""
+        self._links.append({"user_id": user_id, "url": url, "link_seq": link_seq, "status": status})
+        self._maybe_wake()
+
+    def _maybe_wake(self):
+        if self._wakeup is not None and len(self._increments) + len(self._completed) + len(self._links) >= CREDIT_BATCH_SIZE:
+            self._wakeup.set()
+
+    async def flush(self) -> bool:
+        """Writes buffered increments and links to MongoDB.
+
+        Whatever is known not to be written is merged back into the buffers,
+        on top of anything queued meanwhile, and retried by the next flush.
+        Credits whose outcome is unknown are not (see apply_balance_increments).
+        Returns whether everything was written.
+        """
+        async with self._flush_lock:
+            increments, self._increments = self._increments, {}
+            completed, self._completed = self._completed, {}
+            links, self._links = self._links, []
+            if not increments and not completed and not links:
+                return True
+            (unapplied, retry_links), links_added = await asyncio.gather(
+                self.db.apply_balance_increments(increments, completed),
+                self.db.add_links(links),
+            )
+            for tg_id, (amount, count) in unapplied.items():
+                self._add_increment(tg_id, amount, count)
+            for tg_id, seqs in retry_links.items():
+                self._completed.setdefault(tg_id, []).extend(seqs)
+            if not links_added:
+                # Links already inserted are skipped on retry (unique user_id/link_seq)
+                self._links[:0] = links
+            self.flushes += 1
+            self.credits_flushed += (
+                len(increments) - len(unapplied)
+                + sum(map(len, completed.values())) - sum(map(len, retry_links.values()))
+            )
+            self.links_flushed += len(links) if links_added else 0
+            if unapplied or retry_links or not links_added:
+                self.failed_flushes += 1
+                logger.warning(
+                    "Credit flush incomplete; %s credits and %s links kept for retry.",
+                    len(unapplied) + sum(map(len, retry_links.values())), 0 if links_added else len(links),
+                )
+                return False
+            return True
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=CREDIT_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Credit batcher flush failed: %s", e)
+
+# Instantiate shared batcher
+credit_batcher = CreditBatcher(db_manager)
@@ -1,155 +1,951 @@
+import asyncio
 import logging
-from pymongo import MongoClient, errors
-from pymongo.results import InsertOneResult, UpdateResult
+import random
+import sys
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 
-from config import MONGO_URI
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne, errors
+from pymongo.results import InsertManyResult, InsertOneResult, UpdateResult
+
+from config import (
+    MONGO_URI,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    USER_CACHE_MAX_SIZE,
+    USER_CACHE_TTL,
+    ADMIN_PAGE_SIZE,
+    LEASE_TTL,
+    LEASE_WAIT,
+    MONGO_DB_NAME,
+    LEADERBOARD_CACHE_TTL,
+    STATS_SHARDS,
+)
+
+from metrics import DB_ERRORS, instrument_db
 
 logger = logging.getLogger(__name__)
 
+def _log_error(method: str, message: str, *args):
+    """Logs an error a MongoDB method handled itself and counts it against the method."""
+    DB_ERRORS.labels(method).inc()
+    logger.error(message, *args)
+
+# Fields of a user document that handlers read; also the find_one projection.
+USER_FIELDS = ("tg_id", "balance", "completed_links", "total_links", "total_earned", "upi_id")
+USER_PROJECTION = {"_id": 0, **{field: 1 for field in USER_FIELDS}}
+
+# Fields shown in the admin withdrawal queue
+WITHDRAWAL_PAGE_PROJECTION = {"user_tg_id": 1, "amount": 1, "upi_id": 1, "timestamp": 1}
+
+_EPOCH = datetime(1970, 1, 1)
+
+# _id of the all-time counters in the stats collection. They are spread over STATS_SHARDS
+# documents: shard 0 keeps this _id, shard n is "global:n" (daily rollups shard the same way)
+GLOBAL_STATS_ID = "global"
+# Matches every shard of the all-time counters, whatever STATS_SHARDS was when they were written
+_GLOBAL_STATS_FILTER = {"_id": {"$regex": f"^{GLOBAL_STATS_ID}(:[0-9]+)?$"}}
+# Attempts of a best-effort counter update that hit a transient error
+STATS_MAX_ATTEMPTS = 3
+
+def _stats_shard_id(key: str, shard: int) -> str:
+    return key if shard == 0 else f"{key}:{shard}"
+
+def _add_counters(into: dict, shard: dict):
+    for field, value in shard.items():
+        if field != "_id":
+            into[field] = into.get(field, 0) + value
+
+def _is_transient(error: Exception) -> bool:
+    """Whether retrying the write may succeed: a dropped connection, a write conflict, or
+    two upserts racing to create the same document."""
+    if isinstance(error, (errors.AutoReconnect, errors.DuplicateKeyError)):
+        return True
+    return isinstance(error, errors.PyMongoError) and error.has_error_label("TransientTransactionError")
+
+def _today() -> str:
+    """_id of today's daily_stats document."""
+    return datetime.now().strftime("%Y-%m-%d")
+
+def _processed_stats(status: str, count: int, amount: float) -> tuple[dict, dict]:
+    """Counter increments for moving count pending requests worth amount to status (approve/reject)."""
+    return (
+        {"pending_count": -count, "pending_amount": -amount, f"{status}d_count": count, f"{status}d_amount": amount},
+        {f"{status}d_count": count, f"{status}d_amount": amount},
+    )
+
+def new_withdrawal_request(tg_id: int, amount: float, upi_id: str) -> dict:
+    """A pending withdrawal request document as the admin queue expects it."""
+    return {
+        "user_tg_id": tg_id,
+        "amount": amount,
+        "upi_id": upi_id,
+        "status": "pending", # pending, approve, reject
+        "timestamp": datetime.now(),
+    }
+
+def _links_filter(links: dict[int, list[int]]) -> dict:
+    """Matches the links with the given link_seqs of each user_id."""
+    return {"$or": [{"user_id": user_id, "link_seq": {"$in": seqs}} for user_id, seqs in links.items()]}
+
+def encode_page_cursor(doc: dict) -> str:
+    """Encodes a withdrawal request's (timestamp, _id) sort key as a compact string."""
+    millis = (doc["timestamp"] - _EPOCH) // timedelta(milliseconds=1)
+    return f"{millis}:{doc['_id']}"
+
+def decode_page_cursor(cursor: str) -> tuple[datetime, ObjectId]:
+    millis, object_id = cursor.split(":", 1)
+    return _EPOCH + timedelta(milliseconds=int(millis)), ObjectId(object_id)
+
+class CachedUser:
+    """Compact in-memory copy of a user document."""
+    __slots__ = ("tg_id", "balance", "completed_links", "total_links", "total_earned", "upi_id", "expires_at")
+
+    def __init__(self, doc: dict, expires_at: float):
+        self.tg_id = doc["tg_id"]
+        self.balance = doc.get("balance", 0.0)
+        self.completed_links = doc.get("completed_links", 0)
+        # Never reset, so link sequence numbers stay unique across withdrawals
+        self.total_links = doc.get("total_links", self.completed_links)
+        self.total_earned = doc.get("total_earned", 0.0) # Lifetime credits; orders the leaderboard
+        self.upi_id = doc.get("upi_id")
+        self.expires_at = expires_at
+
+    def to_dict(self) -> dict:
+        return {
+            "tg_id": self.tg_id,
+            "balance": self.balance,
+            "completed_links": self.completed_links,
+            "total_links": self.total_links,
+            "total_earned": self.total_earned,
+            "upi_id": self.upi_id,
+        }
+
+class UserCache:
+    """Bounded LRU + TTL cache of user documents keyed by tg_id.
+
+    Reads and writes of a user are bracketed with begin_*/end_* calls. A read
+    only populates the cache if no write to the same user was in flight while
+    it ran, so a stale read can never overwrite a newer value. Balance
+    increments are applied to the cached record as deltas (they commute);
+    every other write invalidates the record.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[int, CachedUser] = OrderedDict()
+        # tg_id -> [reads in flight, writes in flight, read is stale]
+        self._inflight: dict[int, list] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tg_id: int) -> dict | None:
+        entry = self._entries.get(tg_id)
+        if entry is not None:
+            if entry.expires_at > time.monotonic():
+                self._entries.move_to_end(tg_id)
+                self.hits += 1
+                return entry.to_dict()
+            del self._entries[tg_id]
+        self.misses += 1
+        return None
+
+    def begin_read(self, tg_id: int):
+        state = self._inflight.setdefault(tg_id, [0, 0, False])
+        state[0] += 1
+        if state[1]:
+            state[2] = True
+
+    def end_read(self, tg_id: int, doc: dict | None):
+        state = self._inflight[tg_id]
+        state[0] -= 1
+        if doc is not None and not state[2] and tg_id not in self._entries:
+            self._entries[tg_id] = CachedUser(doc, time.monotonic() + self.ttl)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        self._release(tg_id, state)
+
+    def begin_write(self, tg_id: int):
+        state = self._inflight.setdefault(tg_id, [0, 0, False])
+        state[1] += 1
+        state[2] = True
+
+    def end_write(self, tg_id: int, balance_delta: float | None = None, links_delta: int = 0):
+        """Applies a committed increment to the cached record, or invalidates it."""
+        entry = self._entries.get(tg_id)
+        if entry is not None:
+            if balance_delta is None:
+                del self._entries[tg_id]
+            else:
+                entry.balance += balance_delta
+                entry.completed_links += links_delta
+                entry.total_links += links_delta
+                entry.total_earned += balance_delta
+        state = self._inflight[tg_id]
+        state[1] -= 1
+        state[2] = True
+        self._release(tg_id, state)
+
+    def _release(self, tg_id: int, state: list):
+        if not state[0] and not state[1]:
+            del self._inflight[tg_id]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        size = len(self._entries)
+        memory = sys.getsizeof(self._entries)
+        if size:
+            # Every record has the same layout, so one sample sizes them all
+            sample = next(iter(self._entries.values()))
+            per_entry = (
+                sys.getsizeof(sample)
+                + sys.getsizeof(sample.tg_id)
+                + sys.getsizeof(sample.balance)
+                + sys.getsizeof(sample.upi_id)
+            )
+            memory += size * per_entry
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "size": size,
+            "memory_bytes": memory,
+        }
+
 class MongoDB:
+    # Set by connect(), which runs on first use: importing this module never touches the network
+    _CONNECTION_ATTRS = frozenset({
+        "client", "db", "users_collection", "links_collection", "withdrawal_requests_collection", "locks_collection",
+        "stats_collection", "daily_stats_collection",
+    })
+
     def __init__(self):
-        self.client = None
-        self.db = None
-        self.users_collection = None
-        self.links_collection = None
-        self.withdrawal_requests_collection = None
-        self.connect()
+        self.user_cache = UserCache(USER_CACHE_MAX_SIZE, USER_CACHE_TTL)
+        self.supports_transactions = False # Set by ensure_indexes() on replica sets / sharded clusters
+        self._indexes_ready = False
+        self._top_earners: tuple[float, int, list] | None = None # (expires_at, limit, rows)
+
+    def __getattr__(self, name):
+        # Only reached while the connection attributes are not set
+        if name in self._CONNECTION_ATTRS:
+            self.connect()
+            return self.__dict__[name]
+        raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
 
     def connect(self):
+        """Creates the client if needed. Motor connects lazily; the pool is shared by every handler coroutine."""
+        if "client" in self.__dict__:
+            return
+        self.client = AsyncIOMotorClient(
+            MONGO_URI,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+        )
+        self.db = self.client[MONGO_DB_NAME]
+        self.users_collection = self.db.users
+        self.links_collection = self.db.links
+        self.withdrawal_requests_collection = self.db.withdrawal_requests
+        self.locks_collection = self.db.locks
+        # Incrementally maintained counters: one all-time document plus one document per day
+        self.stats_collection = self.db.stats
+        self.daily_stats_collection = self.db.daily_stats
+
+    @instrument_db("ensure_indexes")
+    async def ensure_indexes(self):
+        """Creates the indexes the bot relies on, once per connection. Must run inside the event loop."""
+        if self._indexes_ready:
+            return
         try:
-            self.client = MongoClient(MONGO_URI)
-            self.db = self.client.earning_bot # Database name
-            self.users_collection = self.db.users
-            self.links_collection = self.db.links
-            self.withdrawal_requests_collection = self.db.withdrawal_requests
             # Create unique index for tg_id if it doesn't exist
-            self.users_collection.create_index("tg_id", unique=True)
-            logger.info("Successfully connected to MongoDB.")
+            await self.users_collection.create_index("tg_id", unique=True)
+            # Serves the /top leaderboard as an index walk of K entries
+            await self.users_collection.create_index([("total_earned", DESCENDING)])
+            # One entry per issued link; older entries without link_seq are left out
+            await self.links_collection.create_index(
+                [("user_id", 1), ("link_seq", 1)],
+                unique=True,
+                partialFilterExpression={"link_seq": {"$exists": True}},
+            )
+            # The partial index above cannot serve lookups by user alone
+            await self.links_collection.create_index("user_id")
+            # Only completed links still waiting for their credit; scanned by startup reconciliation
+            await self.links_collection.create_index("user_id", name="uncredited", partialFilterExpression={"credited": False})
+            # Backs the admin queue's keyset pagination over pending requests
+            await self.withdrawal_requests_collection.create_index(
+                [("status", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)]
+            )
+            # Status lookups use the prefix of the index above; this one serves per-user history
+            await self.withdrawal_requests_collection.create_index([("user_tg_id", ASCENDING), ("timestamp", DESCENDING)])
+            await self.withdrawal_requests_collection.create_index("batch_id", sparse=True)
+            # Expired leases are also cleaned up by MongoDB itself
+            await self.locks_collection.create_index("expires_at", expireAfterSeconds=0)
+            # Multi-document transactions need a replica set or mongos
+            hello = await self.client.admin.command("hello")
+            self.supports_transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+            logger.info("Successfully connected to MongoDB (transactions: %s).", self.supports_transactions)
+            self._indexes_ready = True
         except errors.ConnectionFailure as e:
-            logger.error(f"Could not connect to MongoDB: {e}")
+            _log_error("ensure_indexes", "Could not connect to MongoDB: %s", e)
             raise
 
     def close(self):
-        if self.client:
-            self.client.close()
+        client = self.__dict__.get("client")
+        if client is not None:
+            client.close()
+            # The next use reconnects
+            for name in self._CONNECTION_ATTRS:
+                del self.__dict__[name]
+            self._indexes_ready = False
             logger.info("MongoDB connection closed.")
 
-    def add_user(self, tg_id: int) -> bool:
+    async def _run_atomic(self, operation):
+        """Runs operation(session) in a transaction when supported, else operation(None).
+
+        with_transaction retries the whole operation on transient errors (such as
+        a write conflict) and the commit on an unknown commit result, so operation
+        must not have side effects outside the session.
+        """
+        if not self.supports_transactions:
+            return await operation(None)
+        async with await self.client.start_session() as session:
+            return await session.with_transaction(operation)
+
+    @instrument_db("bump_stats")
+    async def _bump_stats(self, session, totals: dict, daily: dict | None = None):
+        """$inc's the all-time counters and today's rollup, each on one randomly picked shard.
+
+        With a session the increments commit (or abort) with the caller's
+        transaction; with_transaction retries a write conflict on a shard. Without
+        one they are best-effort: transient errors are retried, anything else is
+        logged and the counters drift until the next rebuild_stats().
+        """
+        shard = random.randrange(STATS_SHARDS)
+        writes = [(self.stats_collection, _stats_shard_id(GLOBAL_STATS_ID, shard), totals)]
+        if daily:
+            writes.append((self.daily_stats_collection, _stats_shard_id(_today(), shard), daily))
+        for collection, shard_id, increments in writes:
+            for attempt in range(1, STATS_MAX_ATTEMPTS + 1):
+                try:
+                    await collection.update_one({"_id": shard_id}, {"$inc": increments}, upsert=True, session=session)
+                    break
+                except Exception as e:
+                    if session is not None:
+                        raise
+                    if attempt < STATS_MAX_ATTEMPTS and _is_transient(e):
+                        continue
+                    _log_error("bump_stats", "Error updating stats counters %s: %s", increments, e)
+                    break
+
+    @instrument_db("acquire_lease")
+    async def acquire_lease(self, key: str, owner: str, ttl: float = LEASE_TTL) -> bool:
+        """Takes (or renews) the lease on key for owner unless another owner holds an unexpired one."""
+        now = datetime.now(timezone.utc)
+        try:
+            await self.locks_collection.find_one_and_update(
+                {"_id": key, "$or": [{"expires_at": {"$lt": now}}, {"owner": owner}]},
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl)}},
+                upsert=True,
+            )
+            return True
+        except errors.DuplicateKeyError:
+            return False # Held by someone else: the filter missed and the upsert collided on _id
+        except Exception as e:
+            _log_error("acquire_lease", "Error acquiring lease %s: %s", key, e)
+            return False
+
+    @instrument_db("release_lease")
+    async def release_lease(self, key: str, owner: str) -> bool:
+        try:
+            result = await self.locks_collection.delete_one({"_id": key, "owner": owner})
+            return result.deleted_count == 1
+        except Exception as e:
+            _log_error("release_lease", "Error releasing lease %s: %s", key, e)
+            return False
+
+    @asynccontextmanager
+    async def lease(self, key: str, ttl: float = LEASE_TTL, wait: float = LEASE_WAIT):
+        """Holds a cluster-wide lease on key for the duration of the block.
+
+        Yields whether the lease was acquired within `wait` seconds; the caller
+        must skip the critical section if it was not.
+        """
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + wait
+        acquired = await self.acquire_lease(key, owner, ttl)
+        while not acquired and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            acquired = await self.acquire_lease(key, owner, ttl)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                await self.release_lease(key, owner)
+
+    @instrument_db("get_stats")
+    async def get_stats(self, days: int = 1) -> tuple[dict, list]:
+        """Returns the all-time counters and the daily rollups of the last `days` days, newest first.
+
+        Both read STATS_SHARDS documents per counter set, whatever the number of users.
+        """
+        try:
+            totals = {}
+            async for shard in self.stats_collection.find(_GLOBAL_STATS_FILTER):
+                _add_counters(totals, shard)
+            first_day = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+            rollups: dict[str, dict] = {}
+            async for shard in self.daily_stats_collection.find({"_id": {"$gte": first_day}}):
+                day = shard["_id"].split(":", 1)[0]
+                _add_counters(rollups.setdefault(day, {"_id": day}), shard)
+            return totals, [rollups[day] for day in sorted(rollups, reverse=True)[:days]]
+        except Exception as e:
+            _log_error("get_stats", "Error reading stats counters: %s", e)
+            return {}, []
+
+    @instrument_db("rebuild_stats")
+    async def rebuild_stats(self) -> dict:
+        """Recomputes the all-time counters with full scans of users and withdrawal_requests.
+
+        For deployments that predate the counters, or after counters drifted
+        without transactions. Writes racing the scans can leave small errors.
+        """
+        totals = {
+            "users": 0, "links_completed": 0, "total_earned": 0.0, "balance_outstanding": 0.0,
+            "pending_count": 0, "pending_amount": 0.0, "approved_count": 0, "approved_amount": 0.0,
+            "rejected_count": 0, "rejected_amount": 0.0,
+        }
+        users = self.users_collection.aggregate([
+            {"$group": {
+                "_id": None,
+                "users": {"$sum": 1},
+                "links_completed": {"$sum": {"$ifNull": ["$total_links", "$completed_links"]}},
+                "total_earned": {"$sum": "$total_earned"},
+                "balance_outstanding": {"$sum": "$balance"},
+            }},
+        ])
+        async for row in users:
+            totals.update({key: value for key, value in row.items() if key != "_id"})
+        withdrawals = self.withdrawal_requests_collection.aggregate([
+            {"$group": {"_id": "$status", "count": {"$sum": 1}, "amount": {"$sum": "$amount"}}},
+        ])
+        async for row in withdrawals:
+            prefix = {"pending": "pending", "approve": "approved", "reject": "rejected"}.get(row["_id"])
+            if prefix:
+                totals[f"{prefix}_count"] = row["count"]
+                totals[f"{prefix}_amount"] = row["amount"]
+        # The rebuilt totals go to shard 0; the other shards start over from zero
+        await self.stats_collection.replace_one({"_id": GLOBAL_STATS_ID}, totals, upsert=True)
+        await self.stats_collection.delete_many({"_id": {"$regex": f"^{GLOBAL_STATS_ID}:"}})
+        return totals
+
+    @instrument_db("get_top_earners")
+    async def get_top_earners(self, limit: int) -> list:
+        """Returns the `limit` users with the highest lifetime earnings, walking the total_earned index.
+
+        Results are shared for LEADERBOARD_CACHE_TTL seconds.
+        """
+        cached = self._top_earners
+        if cached is not None and cached[0] > time.monotonic() and cached[1] == limit:
+            return cached[2]
+        try:
+            cursor = (
+                self.users_collection.find({"total_earned": {"$gt": 0}}, {"_id": 0, "tg_id": 1, "total_earned": 1})
+                .sort("total_earned", DESCENDING)
+                .limit(limit)
+            )
+            rows = await cursor.to_list(length=limit)
+        except Exception as e:
+            _log_error("get_top_earners", "Error reading the leaderboard: %s", e)
+            return []
+        self._top_earners = (time.monotonic() + LEADERBOARD_CACHE_TTL, limit, rows)
+        return rows
+
+    @instrument_db("add_user")
+    async def add_user(self, tg_id: int) -> bool:
         """Adds a new user to the database if they don't exist."""
         try:
-            result: InsertOneResult = self.users_collection.insert_one(
+            result: InsertOneResult = await self.users_collection.insert_one(
                 {
                     "tg_id": tg_id,
                     "balance": 0.0,
                     "completed_links": 0,
+                    "total_links": 0,
+                    "total_earned": 0.0,
                     "upi_id": None,
                 }
             )
+            await self._bump_stats(None, {"users": 1}, {"new_users": 1})
             return result.acknowledged
         except errors.DuplicateKeyError:
-            logger.info(f"User with tg_id {tg_id} already exists.")
+            logger.info("User with tg_id %s already exists.", tg_id)
             return False
         except Exception as e:
-            logger.error(f"Error adding user {tg_id}: {e}")
+            _log_error("add_user", "Error adding user %s: %s", tg_id, e)
             return False
 
-    def get_user(self, tg_id: int) -> dict | None:
-        """Retrieves user data by Telegram ID."""
+    async def get_user(self, tg_id: int) -> dict | None:
+        """Retrieves user data by Telegram ID, serving repeat reads from the user cache."""
+        user = self.user_cache.get(tg_id)
+        if user is not None:
+            return user
+        return await self._load_user(tg_id)
+
+    # Cache hits are counted by the user cache, so this only times MongoDB round-trips
+    @instrument_db("get_user")
+    async def _load_user(self, tg_id: int) -> dict | None:
+        user = None
+        self.user_cache.begin_read(tg_id)
         try:
-            return self.users_collection.find_one({"tg_id": tg_id})
+            user = await self.users_collection.find_one({"tg_id": tg_id}, USER_PROJECTION)
+            return user
         except Exception as e:
-            logger.error(f"Error getting user {tg_id}: {e}")
+            _log_error("get_user", "Error getting user %s: %s", tg_id, e)
             return None
+        finally:
+            self.user_cache.end_read(tg_id, user)
 
-    def update_user_balance(self, tg_id: int, amount: float = 1.0) -> bool:
-        """Updates user's balance and increments completed links."""
+    async def iter_user_ids(self, batch_size: int = 1000):
+        """Streams every user's tg_id through a cursor, batch_size documents per round-trip."""
         try:
-            result: UpdateResult = self.users_collection.update_one(
+            cursor = self.users_collection.find({}, {"_id": 0, "tg_id": 1}).batch_size(batch_size)
+            async for user in cursor:
+                yield user["tg_id"]
+        except Exception as e:
+            _log_error("iter_user_ids", "Error streaming user IDs: %s", e)
+
+    @instrument_db("update_user_balance")
+    async def update_user_balance(self, tg_id: int, amount: float = 1.0) -> bool:
+        """Updates user's balance and increments completed links."""
+        async def credit(session) -> UpdateResult:
+            result = await self.users_collection.update_one(
                 {"tg_id": tg_id},
-                {"$inc": {"balance": amount, "completed_links": 1}}
+                {"$inc": {"balance": amount, "completed_links": 1, "total_links": 1, "total_earned": amount}},
+                session=session,
             )
+            if result.modified_count:
+                await self._bump_stats(
+                    session,
+                    {"links_completed": 1, "total_earned": amount, "balance_outstanding": amount},
+                    {"links_completed": 1, "earned": amount},
+                )
+            return result
+
+        self.user_cache.begin_write(tg_id)
+        try:
+            result: UpdateResult = await self._run_atomic(credit)
+            self.user_cache.end_write(tg_id, amount, 1)
             return result.acknowledged
         except Exception as e:
-            logger.error(f"Error updating balance for user {tg_id}: {e}")
+            self.user_cache.end_write(tg_id)
+            _log_error("update_user_balance", "Error updating balance for user %s: %s", tg_id, e)
             return False
 
-    def add_link(self, user_id: int, url: str, status: str = 'pending') -> bool:
-        """Adds a new shortlink entry."""
+    @instrument_db("apply_balance_increments")
+    async def apply_balance_increments(
+        self, increments: dict[int, tuple[float, int]], completed_links: dict[int, list[int]] | None = None
+    ) -> tuple[dict[int, tuple[float, int]], dict[int, list[int]]]:
+        """Credits plain (amount, links) increments and the rewards of completed links in one bulk write.
+
+        completed_links maps a tg_id to link_seqs completed by complete_link().
+        A link pays its stored reward only if this call flips it from
+        credited: False to True, so a retried link is never paid twice. Returns
+        the increments and the completed links known not to be applied, for
+        the caller to retry.
+
+        Without transactions, an error other than a BulkWriteError (e.g. a
+        connection dropped after the server ran the bulk $inc) leaves the
+        outcome unknown. Nothing is returned for retry then, since a retry could
+        pay the same users again; the links stay claimed under the logged
+        credit_batch.
+        """
+        completed_links = completed_links or {}
+        if not increments and not completed_links:
+            return {}, {}
+        batch_id = ObjectId()
+
+        async def claim(session) -> tuple[dict[int, list[tuple[int, float]]], dict[int, list[int]]]:
+            """Flips the completed links to credited; returns the flipped (link_seq, reward)s and the links to retry."""
+            claim_failed = False
+            try:
+                await self.links_collection.update_many(
+                    {**_links_filter(completed_links), "credited": False},
+                    {"$set": {"credited": True, "credit_batch": batch_id}},
+                    session=session,
+                )
+            except Exception as e:
+                if session is not None:
+                    raise
+                # Links flipped before the error are found below; the others are safe to retry
+                claim_failed = True
+                _log_error("apply_balance_increments", "Error claiming links of %s users: %s", len(completed_links), e)
+            flipped: dict[int, list[tuple[int, float]]] = {}
+            try:
+                cursor = self.links_collection.find(
+                    {**_links_filter(completed_links), "credit_batch": batch_id},
+                    {"_id": 0, "user_id": 1, "link_seq": 1, "reward": 1},
+                    session=session,
+                )
+                async for link in cursor:
+                    flipped.setdefault(link["user_id"], []).append((link["link_seq"], link["reward"]))
+            except Exception as e:
+                if session is not None:
+                    raise
+                # Whatever this batch flipped stays unpaid; retrying the rest cannot pay twice
+                _log_error(
+                    "apply_balance_increments", "Error reading links claimed under credit_batch %s: %s", batch_id, e
+                )
+                return {}, completed_links
+            if not claim_failed:
+                return flipped, {} # Links that did not flip were already credited
+            retry = {}
+            for tg_id, seqs in completed_links.items():
+                claimed = {seq for seq, _ in flipped.get(tg_id, ())}
+                if unclaimed := [seq for seq in seqs if seq not in claimed]:
+                    retry[tg_id] = unclaimed
+            return flipped, retry
+
+        async def release(tg_ids: list[int]) -> dict[int, list[int]]:
+            """Gives back the claims of users whose increment is known not to be applied, for a retry."""
+            try:
+                await self.links_collection.update_many(
+                    {"user_id": {"$in": tg_ids}, "credit_batch": batch_id},
+                    {"$set": {"credited": False}, "$unset": {"credit_batch": ""}},
+                )
+            except Exception as e:
+                _log_error(
+                    "apply_balance_increments",
+                    "Links of users %s left claimed but unpaid under credit_batch %s: %s", tg_ids, batch_id, e,
+                )
+                return {}
+            return {tg_id: completed_links[tg_id] for tg_id in tg_ids if tg_id in completed_links}
+
+        async def credit(session) -> tuple[dict, dict, dict]:
+            flipped, retry_links = await claim(session) if completed_links else ({}, {})
+            totals = dict(increments)
+            for tg_id, links in flipped.items():
+                amount, count = totals.get(tg_id, (0.0, 0))
+                totals[tg_id] = (amount + sum(reward for _, reward in links), count + len(links))
+            if not totals:
+                return {}, {}, retry_links
+            items = list(totals.items())
+            operations = [
+                UpdateOne(
+                    {"tg_id": tg_id},
+                    {"$inc": {"balance": amount, "completed_links": links, "total_links": links, "total_earned": amount}},
+                )
+                for tg_id, (amount, links) in items
+            ]
+            try:
+                await self.users_collection.bulk_write(operations, ordered=False, session=session)
+                failed = set()
+            except errors.BulkWriteError as e:
+                if session is not None:
+                    raise # The transaction is aborted, so none of the batch was applied
+                # Unordered: every operation without a write error went through
+                failed = {error["index"] for error in e.details.get("writeErrors", [])}
+                _log_error("apply_balance_increments", "%s of %s balance increments failed: %s", len(failed), len(items), e)
+            except Exception as e:
+                if session is not None:
+                    raise
+                _log_error(
+                    "apply_balance_increments",
+                    "Outcome of %s balance increments unknown, not retried (links claimed under credit_batch %s): %s",
+                    len(items), batch_id, e,
+                )
+                return None, {}, retry_links
+            applied = {tg_id: increment for index, (tg_id, increment) in enumerate(items) if index not in failed}
+            unapplied = {tg_id: increments[tg_id] for tg_id in totals if tg_id not in applied and tg_id in increments}
+            if failed_claims := [tg_id for tg_id in flipped if tg_id not in applied]:
+                for tg_id, seqs in (await release(failed_claims)).items():
+                    retry_links.setdefault(tg_id, []).extend(seqs)
+            # The whole batch moves the counters by one $inc each
+            total_amount = sum(amount for amount, _ in applied.values())
+            total_links = sum(links for _, links in applied.values())
+            if applied:
+                await self._bump_stats(
+                    session,
+                    {"links_completed": total_links, "total_earned": total_amount, "balance_outstanding": total_amount},
+                    {"links_completed": total_links, "earned": total_amount},
+                )
+            return applied, unapplied, retry_links
+
+        tg_ids = set(increments) | set(completed_links)
+        for tg_id in tg_ids:
+            self.user_cache.begin_write(tg_id)
+        applied = None
         try:
-            result: InsertOneResult = self.links_collection.insert_one(
-                {"user_id": user_id, "url": url, "status": status}
-            )
+            applied, unapplied, retry_links = await self._run_atomic(credit)
+        except Exception as e:
+            # The transaction was aborted, so everything can be retried; the links in any case,
+            # since a committed claim makes their retry a no-op
+            unapplied, retry_links = dict(increments), completed_links
+            if isinstance(e, errors.PyMongoError) and e.has_error_label("UnknownTransactionCommitResult"):
+                unapplied = {}
+            _log_error("apply_balance_increments", "Error applying %s balance increments: %s", len(tg_ids), e)
+        finally:
+            for tg_id in tg_ids:
+                if applied and tg_id in applied:
+                    self.user_cache.end_write(tg_id, *applied[tg_id])
+                else:
+                    self.user_cache.end_write(tg_id)
+        return unapplied, retry_links
+
+    async def iter_uncredited_links(self, workers: int = 1, index: int = 0, batch_size: int = 1000):
+        """Streams (user_id, link_seq, reward) of completed links whose credit was never applied.
+
+        With workers > 1 only the users of shard `index` (user_id % workers) are returned.
+        """
+        query = {"status": "completed", "credited": False}
+        if workers > 1:
+            query["user_id"] = {"$mod": [workers, index]}
+        try:
+            cursor = self.links_collection.find(query, {"_id": 0, "user_id": 1, "link_seq": 1, "reward": 1})
+            async for link in cursor.batch_size(batch_size):
+                yield link["user_id"], link["link_seq"], link["reward"]
+        except Exception as e:
+            _log_error("iter_uncredited_links", "Error streaming uncredited links: %s", e)
+
+    @instrument_db("add_links")
+    async def add_links(self, links: list[dict]) -> bool:
+        """Inserts many shortlink entries in one round-trip."""
+        if not links:
+            return True
+        try:
+            result: InsertManyResult = await self.links_collection.insert_many(links, ordered=False)
             return result.acknowledged
+        except errors.BulkWriteError as e:
+            # Re-sent links (same user_id/link_seq) are expected; anything else is an error
+            failures = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            if failures:
+                _log_error("add_links", "Error adding %s links: %s", len(links), failures)
+                return False
+            return True
         except Exception as e:
-            logger.error(f"Error adding link for user {user_id}: {e}")
+            _log_error("add_links", "Error adding %s links: %s", len(links), e)
             return False
 
-    def update_user_upi_id(self, tg_id: int, upi_id: str) -> bool:
-        """Updates the user's UPI ID."""
+    @instrument_db("complete_link")
+    async def complete_link(self, user_id: int, link_seq: int, reward: float) -> bool:
+        """Marks a link completed. Returns True only the first time, so callers credit once.
+
+        The link is left credited: False until the reward reaches the user's
+        balance, so a credit lost before then is found by iter_uncredited_links().
+        """
         try:
-            result: UpdateResult = self.users_collection.update_one(
-                {"tg_id": tg_id},
-                {"$set": {"upi_id": upi_id}}
+            # Upserting covers a postback that beats the buffered link insert; if the link
+            # is already completed the filter misses and the upsert hits the unique index.
+            result: UpdateResult = await self.links_collection.update_one(
+                {"user_id": user_id, "link_seq": link_seq, "status": {"$ne": "completed"}},
+                {"$set": {"status": "completed", "completed_at": datetime.now(), "reward": reward, "credited": False}},
+                upsert=True,
             )
-            return result.acknowledged
-        except Exception as e:
-            logger.error(f"Error updating UPI ID for user {tg_id}: {e}")
+            return result.modified_count == 1 or result.upserted_id is not None
+        except errors.DuplicateKeyError:
             return False
+        except Exception as e:
+            _log_error("complete_link", "Error completing link %s for user %s: %s", link_seq, user_id, e)
+            raise
 
-    def add_withdrawal_request(self, user_tg_id: int, amount: float, upi_id: str) -> bool:
-        """Adds a new withdrawal request."""
+    @instrument_db("add_link")
+    async def add_link(self, user_id: int, url: str, status: str = 'pending') -> bool:
+        """Adds a new shortlink entry."""
         try:
-            result: InsertOneResult = self.withdrawal_requests_collection.insert_one(
-                {
-                    "user_tg_id": user_tg_id,
-                    "amount": amount,
-                    "upi_id": upi_id,
-                    "status": "pending", # pending, approved, rejected
-                    "timestamp": datetime.now()
-                }
+            result: InsertOneResult = await self.links_collection.insert_one(
+                {"user_id": user_id, "url": url, "status": status}
             )
             return result.acknowledged
         except Exception as e:
-            logger.error(f"Error adding withdrawal request for user {user_tg_id}: {e}")
+            _log_error("add_link", "Error adding link for user %s: %s", user_id, e)
             return False
 
-    def get_pending_withdrawal_requests(self) -> list:
-        """Retrieves all pending withdrawal requests."""
+    @instrument_db("withdraw_balance")
+    async def withdraw_balance(self, tg_id: int, upi_id: str, min_balance: float) -> float | None:
+        """Atomically claims the user's whole balance and files a withdrawal request for it.
+
+        The balance is zeroed by one conditional find_one_and_update, so credits
+        landing concurrently are either part of the claimed amount or stay on the
+        balance, and a repeated request finds nothing left to claim. With
+        transaction support the claim and the request insert commit together;
+        otherwise a failed insert gives the claimed balance back.
+        Returns the amount withdrawn, or None if the balance was below min_balance
+        or the operation failed.
+        """
+        claim_filter = {"tg_id": tg_id, "balance": {"$gte": min_balance}}
+        claim_update = {"$set": {"balance": 0.0, "completed_links": 0, "upi_id": upi_id}}
+        projection = {"_id": 0, "balance": 1, "completed_links": 1}
+
+        async def claim_and_file(session) -> float | None:
+            user = await self.users_collection.find_one_and_update(
+                claim_filter, claim_update, projection=projection,
+                return_document=ReturnDocument.BEFORE, session=session,
+            )
+            if user is None:
+                return None
+            amount = user["balance"]
+            try:
+                await self.withdrawal_requests_collection.insert_one(
+                    new_withdrawal_request(tg_id, amount, upi_id), session=session
+                )
+            except Exception:
+                if session is None:
+                    await self.users_collection.update_one(
+                        {"tg_id": tg_id},
+                        {"$inc": {"balance": amount, "completed_links": user.get("completed_links", 0)}},
+                    )
+                raise
+            await self._bump_stats(
+                session,
+                {"pending_count": 1, "pending_amount": amount, "balance_outstanding": -amount},
+                {"withdrawals_requested": 1, "withdrawn_amount": amount},
+            )
+            return amount
+
+        self.user_cache.begin_write(tg_id)
         try:
-            return list(self.withdrawal_requests_collection.find({"status": "pending"}))
+            return await self._run_atomic(claim_and_file)
         except Exception as e:
-            logger.error(f"Error getting pending withdrawal requests: {e}")
-            return []
+            _log_error("withdraw_balance", "Error processing withdrawal for user %s: %s", tg_id, e)
+            return None
+        finally:
+            self.user_cache.end_write(tg_id)
 
-    def update_withdrawal_request_status(self, request_id: str, status: str) -> bool:
-        """Updates the status of a withdrawal request."""
+    @instrument_db("get_pending_withdrawal_requests_page")
+    async def get_pending_withdrawal_requests_page(
+        self, after: str | None = None, before: str | None = None, limit: int = ADMIN_PAGE_SIZE
+    ) -> tuple[list, bool]:
+        """Retrieves one page of pending withdrawal requests, oldest first.
+
+        Pages are addressed by the encode_page_cursor() of the last row of the
+        previous page (after) or the first row of the next page (before).
+        Returns the rows and whether more rows exist past them in the paging direction.
+        """
+        query = {"status": "pending"}
+        direction = ASCENDING
         try:
-            from bson.objectid import ObjectId # Import here to avoid circular dependency if not needed elsewhere
-            result: UpdateResult = self.withdrawal_requests_collection.update_one(
-                {"_id": ObjectId(request_id)},
-                {"$set": {"status": status, "processed_at": datetime.now()}}
+            if after or before:
+                timestamp, object_id = decode_page_cursor(after or before)
+                op = "$gt" if after else "$lt"
+                query["$or"] = [
+                    {"timestamp": {op: timestamp}},
+                    {"timestamp": timestamp, "_id": {op: object_id}},
+                ]
+                if before:
+                    direction = DESCENDING
+            cursor = (
+                self.withdrawal_requests_collection.find(query, WITHDRAWAL_PAGE_PROJECTION)
+                .sort([("timestamp", direction), ("_id", direction)])
+                .limit(limit + 1)
             )
-            return result.acknowledged
-        except errors.InvalidId:
-            logger.error(f"Invalid request_id format: {request_id}")
-            return False
+            requests = await cursor.to_list(length=limit + 1)
+        except (ValueError, InvalidId) as e:
+            _log_error(
+                "get_pending_withdrawal_requests_page", "Invalid withdrawal page cursor %s: %s", after or before, e
+            )
+            return [], False
         except Exception as e:
-            logger.error(f"Error updating withdrawal request {request_id} status to {status}: {e}")
-            return False
+            _log_error("get_pending_withdrawal_requests_page", "Error getting pending withdrawal requests: %s", e)
+            return [], False
+
+        has_more = len(requests) > limit
+        requests = requests[:limit]
+        if direction == DESCENDING:
+            requests.reverse()
+        return requests, has_more
+
+    @instrument_db("process_withdrawal_request")
+    async def process_withdrawal_request(self, request_id: str, status: str) -> dict | None:
+        """Moves a pending withdrawal request to status; returns it, or None if it was not pending."""
+        async def process(session) -> dict | None:
+            req = await self.withdrawal_requests_collection.find_one_and_update(
+                {"_id": ObjectId(request_id), "status": "pending"},
+                {"$set": {"status": status, "processed_at": datetime.now()}},
+                projection={"user_tg_id": 1, "amount": 1},
+                return_document=ReturnDocument.AFTER,
+                session=session,
+            )
+            if req is not None:
+                await self._bump_stats(session, *_processed_stats(status, 1, req["amount"]))
+            return req
 
-    def reset_user_balance_and_links(self, tg_id: int) -> bool:
-        """Resets a user's balance and completed links after a withdrawal."""
         try:
-            result: UpdateResult = self.users_collection.update_one(
-                {"tg_id": tg_id},
-                {"$set": {"balance": 0.0, "completed_links": 0}}
+            return await self._run_atomic(process)
+        except InvalidId:
+            _log_error("process_withdrawal_request", "Invalid request_id format: %s", request_id)
+            return None
+        except Exception as e:
+            _log_error(
+                "process_withdrawal_request",
+                "Error updating withdrawal request %s status to %s: %s", request_id, status, e,
             )
-            return result.acknowledged
+            return None
+
+    @instrument_db("bulk_process_withdrawal_requests")
+    async def bulk_process_withdrawal_requests(
+        self,
+        status: str,
+        request_ids: list[str] | None = None,
+        before: datetime | None = None,
+        max_amount: float | None = None,
+    ) -> tuple[ObjectId | None, int, float]:
+        """Moves every pending request matching all given filters to status in one update_many.
+
+        Returns the batch_id stamped on the processed requests, their count and
+        total amount, so only requests this call changed are reported; the
+        requests themselves are streamed with iter_batch_requests(). batch_id is
+        None if nothing was processed.
+        """
+        query = {"status": "pending"}
+        if request_ids is not None:
+            query["_id"] = {"$in": [ObjectId(request_id) for request_id in request_ids]}
+        if before is not None:
+            query["timestamp"] = {"$lt": before}
+        if max_amount is not None:
+            query["amount"] = {"$lte": max_amount}
+
+        batch_id = ObjectId()
+
+        async def process(session) -> tuple[ObjectId | None, int, float]:
+            result: UpdateResult = await self.withdrawal_requests_collection.update_many(
+                query,
+                {"$set": {"status": status, "processed_at": datetime.now(), "batch_id": batch_id}},
+                session=session,
+            )
+            if not result.modified_count:
+                return None, 0, 0.0
+            # Summed on the server: a bulk action may cover more requests than fit in memory
+            cursor = self.withdrawal_requests_collection.aggregate([
+                {"$match": {"batch_id": batch_id}},
+                {"$group": {"_id": None, "count": {"$sum": 1}, "amount": {"$sum": "$amount"}}},
+            ], session=session)
+            totals = (await cursor.to_list(length=1))[0]
+            await self._bump_stats(session, *_processed_stats(status, totals["count"], totals["amount"]))
+            return batch_id, totals["count"], totals["amount"]
+
+        try:
+            return await self._run_atomic(process)
         except Exception as e:
-            logger.error(f"Error resetting balance for user {tg_id}: {e}")
-            return False
+            _log_error(
+                "bulk_process_withdrawal_requests",
+                "Error bulk updating withdrawal requests %s to %s: %s", query, status, e,
+            )
+            return None, 0, 0.0
+
+    async def iter_batch_requests(self, batch_id: ObjectId, batch_size: int = 1000):
+        """Streams the requests processed under batch_id (user_tg_id and amount) through a cursor."""
+        try:
+            cursor = self.withdrawal_requests_collection.find(
+                {"batch_id": batch_id}, {"_id": 0, "user_tg_id": 1, "amount": 1}
+            ).batch_size(batch_size)
+            async for req in cursor:
+                yield req
+        except Exception as e:
+            _log_error("iter_batch_requests", "Error streaming withdrawal requests of batch %s: %s", batch_id, e)
 
 # Instantiate DB manager
 db_manager = MongoDB()
-
-from datetime import datetime # Import here to avoid circular import with db_manager instantiation
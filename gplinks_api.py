@@ -1,42 +1,348 @@
+import asyncio
 import logging
+import random
+import time
+from collections import deque
 import aiohttp
 from urllib.parse import quote_plus
 
-from config import GPLINKS_API_KEY
+from config import (
+    GPLINKS_API_KEY,
+    GPLINKS_API_URL,
+    GPLINKS_MAX_CONCURRENCY,
+    GPLINKS_CONNECT_TIMEOUT,
+    GPLINKS_TOTAL_TIMEOUT,
+    GPLINKS_DNS_CACHE_TTL,
+    GPLINKS_KEEPALIVE_TIMEOUT,
+    GPLINKS_RATE_LIMIT,
+    GPLINKS_BURST,
+    GPLINKS_REFILL_HEADROOM,
+    SECONDARY_SHORTENER_API_URL,
+    SECONDARY_SHORTENER_API_KEY,
+    SHORTENER_RAW_FALLBACK,
+    SHORTENER_DEADLINE,
+    SHORTENER_MAX_RETRIES,
+    SHORTENER_RETRY_BASE_DELAY,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_ERROR_RATE,
+    BREAKER_WINDOW,
+    BREAKER_RESET_TIMEOUT,
+    BREAKER_HALF_OPEN_PROBES,
+)
+from metrics import SHORTENER_LATENCY, SHORTENER_REQUESTS
+from rate_limit import TokenBucket
 
 logger = logging.getLogger(__name__)
 
-async def generate_gplink(long_url: str) -> str | None:
-    """Generates a shortlink using the GP Links API."""
-    if not GPLINKS_API_KEY:
-        logger.error("GP Links API Key not set in config.")
-        return None
+class ShortenerError(Exception):
+    """A shortener call failed. `retryable` marks failures worth another attempt."""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+class ShortenerProvider:
+    """A URL shortening backend. Subclasses implement shorten()."""
+    name = "provider"
+    # Whether its links may be generated ahead of time and handed out later
+    poolable = True
+
+    async def shorten(self, session: aiohttp.ClientSession, long_url: str) -> str:
+        """Returns the short URL or raises ShortenerError."""
+        raise NotImplementedError
+
+class APIShortenerProvider(ShortenerProvider):
+    """Shortener with the common `<api_url>?api=<key>&url=<url>` JSON API (GP Links and its clones)."""
+
+    def __init__(self, name: str, api_url: str, api_key: str):
+        self.name = name
+        self.api_url = api_url
+        self.api_key = api_key
+
+    async def shorten(self, session: aiohttp.ClientSession, long_url: str) -> str:
+        # Some shorteners also allow custom aliases, etc., check the provider's API docs.
+        request_url = f"{self.api_url}?api={self.api_key}&url={quote_plus(long_url)}"
+        try:
+            async with session.get(request_url) as response:
+                if response.status == 429 or response.status >= 500:
+                    raise ShortenerError(f"HTTP {response.status}")
+                response.raise_for_status() # Other 4xx errors won't improve on retry
+                data = await response.json(content_type=None)
+        except asyncio.TimeoutError:
+            raise ShortenerError("request timed out")
+        except aiohttp.ClientResponseError as e:
+            raise ShortenerError(f"HTTP {e.status}", retryable=False)
+        except aiohttp.ClientError as e:
+            raise ShortenerError(f"client error: {e}")
+
+        # Assuming the API returns a JSON like {'status': 'success', 'shortenedUrl': 'https://gplinks.in/xyz'}
+        # or {'status': 'error', 'message': '...'}. Adjust based on actual API response.
+        if data.get("status") == "success" and data.get("shortenedUrl"):
+            return data["shortenedUrl"]
+        if data.get("error") or data.get("message"):
+            raise ShortenerError(f"API error: {data.get('error') or data.get('message')}", retryable=False)
+        raise ShortenerError(f"unexpected response: {data}", retryable=False)
+
+class RawURLProvider(ShortenerProvider):
+    """Last resort: hands out the target URL itself.
+
+    The bot earns nothing from a visit to such a link, but the target page
+    still carries a valid token, so completing it pays the user the full
+    link reward. Raw links are therefore only served live while the real
+    shorteners are down, never pooled for later.
+    """
+    name = "raw"
+    poolable = False
+
+    async def shorten(self, session: aiohttp.ClientSession, long_url: str) -> str:
+        return long_url
+
+class CircuitBreaker:
+    """Stops calls to a failing provider and probes it again after a cool-down.
+
+    Opens after BREAKER_FAILURE_THRESHOLD consecutive failures, or when the
+    error rate over the last BREAKER_WINDOW calls reaches BREAKER_ERROR_RATE.
+    After BREAKER_RESET_TIMEOUT seconds it lets BREAKER_HALF_OPEN_PROBES calls
+    through (half-open); one success closes it, a failure opens it again.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self):
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self.probes_in_flight = 0
+        self.outcomes: deque[bool] = deque(maxlen=BREAKER_WINDOW) # True = failure
+        self.times_opened = 0
+
+    def allow_request(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < BREAKER_RESET_TIMEOUT:
+                return False
+            self.state = self.HALF_OPEN
+            self.probes_in_flight = 0
+        if self.state == self.HALF_OPEN:
+            if self.probes_in_flight >= BREAKER_HALF_OPEN_PROBES:
+                return False
+            self.probes_in_flight += 1
+        return True
+
+    def error_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def record_success(self):
+        self.outcomes.append(False)
+        self.consecutive_failures = 0
+        if self.state == self.HALF_OPEN:
+            logger.info("Circuit breaker closed after a successful probe.")
+            self.state = self.CLOSED
+            self.outcomes.clear()
+
+    def record_cancelled(self):
+        """Releases a half-open probe slot whose call was cancelled before it finished."""
+        if self.state == self.HALF_OPEN and self.probes_in_flight:
+            self.probes_in_flight -= 1
+
+    def record_failure(self):
+        self.outcomes.append(True)
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN:
+            self._open()
+        elif self.state == self.CLOSED and (
+            self.consecutive_failures >= BREAKER_FAILURE_THRESHOLD
+            or (len(self.outcomes) == self.outcomes.maxlen and self.error_rate() >= BREAKER_ERROR_RATE)
+        ):
+            self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.probes_in_flight = 0
+        self.times_opened += 1
 
-    # Replace with the actual GP Links API endpoint if it differs
-    # This is a common pattern for URL shorteners, adjust if GP Links has a specific API path.
-    api_url = f"https://gplinks.in/api?api={GPLINKS_API_KEY}&url={quote_plus(long_url)}"
-    # Some shorteners also allow custom aliases, etc., check GP Links API docs.
-
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(api_url) as response:
-                response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-                data = await response.json()
-                
-                # Assuming GP Links API returns a JSON like {'status': 'success', 'shortenedUrl': 'https://gplinks.in/xyz'}
-                # or {'status': 'error', 'message': '...'}. Adjust based on actual API response.
-                if data.get("status") == "success" and data.get("shortenedUrl"):
-                    logger.info(f"Successfully generated GP Link: {data['shortenedUrl']}")
-                    return data["shortenedUrl"]
-                elif data.get("error"):
-                    logger.error(f"GP Links API error: {data.get('error')}")
+class ShortenerClient:
+    """Long-lived shortener client: one pooled aiohttp session, failover across providers.
+
+    Providers are tried in order, each behind its own circuit breaker. A
+    retryable failure is retried with jittered exponential backoff while the
+    SHORTENER_DEADLINE for the whole call allows it.
+    """
+
+    def __init__(self, providers: list[ShortenerProvider]):
+        self.providers = providers
+        self.breakers = {provider.name: CircuitBreaker() for provider in providers}
+        self.session: aiohttp.ClientSession | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        # Global outbound budget shared by live calls and pool refills
+        self.budget = TokenBucket(GPLINKS_RATE_LIMIT, GPLINKS_BURST)
+        self.budget_rejected = 0
+        self.calls = {provider.name: 0 for provider in providers}
+        self.failures = {provider.name: 0 for provider in providers}
+        self.latency_total = {provider.name: 0.0 for provider in providers}
+        self.unavailable = 0
+
+    async def start(self):
+        """Creates the shared session. Must run inside the bot's event loop."""
+        if self.session and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=GPLINKS_MAX_CONCURRENCY,
+            ttl_dns_cache=GPLINKS_DNS_CACHE_TTL,
+            keepalive_timeout=GPLINKS_KEEPALIVE_TIMEOUT,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=GPLINKS_TOTAL_TIMEOUT,
+            sock_connect=GPLINKS_CONNECT_TIMEOUT,
+        )
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        self._semaphore = asyncio.Semaphore(GPLINKS_MAX_CONCURRENCY)
+        logger.info("Shortener client started with providers: %s", [provider.name for provider in self.providers])
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+            logger.info("Shortener client session closed.")
+        self.session = None
+
+    def stats(self) -> dict:
+        return {
+            provider.name: {
+                "state": self.breakers[provider.name].state,
+                "calls": self.calls[provider.name],
+                "failures": self.failures[provider.name],
+                "error_rate": self.breakers[provider.name].error_rate(),
+                "times_opened": self.breakers[provider.name].times_opened,
+                "avg_latency": (
+                    self.latency_total[provider.name] / self.calls[provider.name]
+                    if self.calls[provider.name] else 0.0
+                ),
+            }
+            for provider in self.providers
+        }
+
+    async def generate(
+        self, long_url: str, background: bool = False
+    ) -> tuple[str | None, ShortenerProvider | None]:
+        """Shortens long_url with the first available provider.
+
+        Returns the short link and the provider that served it, or (None, None).
+        A live call fails fast when the API budget is spent. A background call
+        (pool refills) waits for budget instead, but leaves GPLINKS_REFILL_HEADROOM
+        of the burst to live calls.
+        """
+        if background:
+            # Never more than the bucket can hold besides the token taken, or refills would starve
+            await self.budget.acquire(keep=min(self.budget.capacity - 1, self.budget.capacity * GPLINKS_REFILL_HEADROOM))
+        elif not self.budget.try_acquire():
+            self.budget_rejected += 1
+            logger.warning("Shortener API budget exhausted; not calling the API.")
+            return None, None
+
+        if self.session is None or self.session.closed:
+            await self.start()
+
+        deadline = time.monotonic() + SHORTENER_DEADLINE
+        for provider in self.providers:
+            short_link = await self._try_provider(provider, long_url, deadline)
+            if short_link:
+                return short_link, provider
+            if time.monotonic() >= deadline:
+                break
+
+        self.unavailable += 1
+        logger.error("No shortener provider could shorten %s", long_url)
+        return None, None
+
+    async def _acquire_slot(self, deadline: float) -> bool:
+        """Waits for one of the GPLINKS_MAX_CONCURRENCY request slots, but not past the deadline."""
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=max(0.0, deadline - time.monotonic()))
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _try_provider(self, provider: ShortenerProvider, long_url: str, deadline: float) -> str | None:
+        breaker = self.breakers[provider.name]
+        latency = SHORTENER_LATENCY.labels(provider.name)
+        for attempt in range(SHORTENER_MAX_RETRIES + 1):
+            if deadline <= time.monotonic() or not breaker.allow_request():
+                return None
+            # Queueing for a slot spends the deadline but is not the provider's fault
+            if not await self._acquire_slot(deadline):
+                breaker.record_cancelled()
+                return None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._semaphore.release()
+                breaker.record_cancelled()
+                return None
+
+            started = time.monotonic()
+            self.calls[provider.name] += 1
+            try:
+                try:
+                    short_link = await asyncio.wait_for(provider.shorten(self.session, long_url), timeout=remaining)
+                finally:
+                    self._semaphore.release() # Not held through the retry backoff
+            except (ShortenerError, asyncio.TimeoutError) as e:
+                elapsed = time.monotonic() - started
+                self.latency_total[provider.name] += elapsed
+                latency.observe(elapsed)
+                SHORTENER_REQUESTS.labels(provider.name, "timeout" if isinstance(e, asyncio.TimeoutError) else "error").inc()
+                self.failures[provider.name] += 1
+                breaker.record_failure()
+                logger.warning("Shortener %s failed (attempt %s): %s", provider.name, attempt + 1, e)
+                if isinstance(e, ShortenerError) and not e.retryable:
                     return None
-                else:
-                    logger.error(f"GP Links API returned unexpected response: {data}")
+                # Full jitter: a random delay up to the exponential backoff step
+                delay = random.uniform(0, SHORTENER_RETRY_BASE_DELAY * 2 ** attempt)
+                if time.monotonic() + delay >= deadline:
                     return None
-    except aiohttp.ClientError as e:
-        logger.error(f"GP Links API request failed due to client error: {e}")
-        return None
-    except Exception as e:
-        logger.error(f"An unexpected error occurred during GP Links API call: {e}")
+                await asyncio.sleep(delay)
+                continue
+            except asyncio.CancelledError:
+                breaker.record_cancelled()
+                raise
+            except Exception as e:
+                elapsed = time.monotonic() - started
+                self.latency_total[provider.name] += elapsed
+                latency.observe(elapsed)
+                SHORTENER_REQUESTS.labels(provider.name, "error").inc()
+                self.failures[provider.name] += 1
+                breaker.record_failure()
+                logger.error("An unexpected error occurred during %s shortener call: %s", provider.name, e)
+                return None
+
+            elapsed = time.monotonic() - started
+            self.latency_total[provider.name] += elapsed
+            latency.observe(elapsed)
+            SHORTENER_REQUESTS.labels(provider.name, "success").inc()
+            breaker.record_success()
+            logger.info("Successfully generated %s link: %s", provider.name, short_link)
+            return short_link
         return None
+
+    async def generate_many(
+        self, long_urls: list[str], background: bool = False
+    ) -> list[tuple[str | None, ShortenerProvider | None]]:
+        """Shortens many URLs concurrently; results are generate()'s, in the input order."""
+        return await asyncio.gather(*(self.generate(url, background) for url in long_urls))
+
+def build_providers() -> list[ShortenerProvider]:
+    """Providers in failover order, as configured."""
+    providers = [APIShortenerProvider("gplinks", GPLINKS_API_URL, GPLINKS_API_KEY)]
+    if SECONDARY_SHORTENER_API_URL and SECONDARY_SHORTENER_API_KEY:
+        providers.append(APIShortenerProvider("secondary", SECONDARY_SHORTENER_API_URL, SECONDARY_SHORTENER_API_KEY))
+    if SHORTENER_RAW_FALLBACK:
+        providers.append(RawURLProvider())
+    return providers
+
+# Instantiate shared client
+shortener_client = ShortenerClient(build_providers())
+
+async def generate_gplink(long_url: str) -> str | None:
+    """Generates a shortlink using the shared shortener client."""
+    short_link, _ = await shortener_client.generate(long_url)
+    return short_link
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+from config import (
+    GPLINKS_BURST,
+    GPLINKS_REFILL_HEADROOM,
+    LINK_POOL_SIZE,
+    LINK_POOL_LOW_WATERMARK,
+    LINK_POOL_MAX_USERS,
+    LINK_POOL_REFILL_BATCH,
+    LINK_POOL_REFILL_INTERVAL,
+)
+from gplinks_api import ShortenerClient, shortener_client
+from tracking import build_target_url
+
+logger = logging.getLogger(__name__)
+
+# A refill batch never needs more API calls than the budget lets refills make back to back
+REFILL_BATCH = max(1, min(LINK_POOL_REFILL_BATCH, int(GPLINKS_BURST * (1 - GPLINKS_REFILL_HEADROOM))))
+
+class LinkPool:
+    """Keeps the next few shortlinks of each active user generated ahead of time.
+
+    /getlink is served from the pool; the GP Links API is only called on the
+    request path when the pool has no link for the requested sequence number.
+    Refills run in a background task in batches, at most one batch per
+    LINK_POOL_REFILL_INTERVAL seconds. They wait for the GP Links budget
+    rather than fail on it, and leave part of it to live calls.
+    """
+
+    def __init__(self, client: ShortenerClient):
+        self.client = client
+        # tg_id -> {link_seq: short_url}, least recently active user first
+        self._pools: OrderedDict[int, dict[int, str]] = OrderedDict()
+        self._queued: set[int] = set()
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.generated = 0
+        self.unpooled = 0
+        self.failures = 0
+
+    async def start(self):
+        """Starts the refill worker. Must run inside the bot's event loop."""
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=LINK_POOL_MAX_USERS)
+            self._worker = asyncio.create_task(self._refill_loop())
+            logger.info("Link pool refill worker started.")
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+            logger.info("Link pool stopped: %s", self.stats())
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "refills": self.refills,
+            "generated": self.generated,
+            "unpooled": self.unpooled,
+            "failures": self.failures,
+            "users": len(self._pools),
+            "links": sum(len(links) for links in self._pools.values()),
+        }
+
+    async def get(self, user_tg_id: int, link_seq: int) -> str | None:
+        """Returns the shortlink for (user, link_seq), generating it live on a pool miss."""
+        links = self._user_links(user_tg_id)
+        for seq in [seq for seq in links if seq < link_seq]:
+            del links[seq] # Already used sequence numbers
+
+        short_link = links.get(link_seq)
+        if short_link:
+            self.hits += 1
+        else:
+            self.misses += 1
+            short_link, provider = await self.client.generate(build_target_url(user_tg_id, link_seq))
+            if short_link and provider.poolable:
+                links[link_seq] = short_link
+
+        self._schedule_refill(user_tg_id, link_seq)
+        return short_link
+
+    def _user_links(self, user_tg_id: int) -> dict[int, str]:
+        links = self._pools.get(user_tg_id)
+        if links is None:
+            links = self._pools[user_tg_id] = {}
+            if len(self._pools) > LINK_POOL_MAX_USERS:
+                evicted, _ = self._pools.popitem(last=False)
+                self._queued.discard(evicted)
+        else:
+            self._pools.move_to_end(user_tg_id)
+        return links
+
+    def _schedule_refill(self, user_tg_id: int, link_seq: int):
+        if self._queue is None or user_tg_id in self._queued:
+            return
+        links = self._pools.get(user_tg_id, {})
+        ready = sum(1 for seq in links if seq > link_seq)
+        if ready > LINK_POOL_LOW_WATERMARK:
+            return
+        try:
+            self._queue.put_nowait((user_tg_id, link_seq))
+            self._queued.add(user_tg_id)
+        except asyncio.QueueFull:
+            pass # Refill backlog is saturated; the next request will retry
+
+    def _missing(self, user_tg_id: int, link_seq: int) -> list[int]:
+        links = self._pools.get(user_tg_id)
+        if links is None: # Evicted while queued
+            return []
+        return [seq for seq in range(link_seq + 1, link_seq + 1 + LINK_POOL_SIZE) if seq not in links]
+
+    async def _refill_loop(self):
+        while True:
+            user_tg_id, link_seq = await self._queue.get()
+            wanted = [(user_tg_id, seq) for seq in self._missing(user_tg_id, link_seq)]
+            refilled = [user_tg_id]
+            # Fold in other queued users until the batch is full
+            while len(wanted) < REFILL_BATCH and not self._queue.empty():
+                user_tg_id, link_seq = self._queue.get_nowait()
+                wanted.extend((user_tg_id, seq) for seq in self._missing(user_tg_id, link_seq))
+                refilled.append(user_tg_id)
+
+            try:
+                if wanted:
+                    wanted = wanted[:REFILL_BATCH] # The rest is scheduled again on the user's next /getlink
+                    urls = [build_target_url(user, seq) for user, seq in wanted]
+                    results = await self.client.generate_many(urls, background=True)
+                    for (user, seq), (short_link, provider) in zip(wanted, results):
+                        links = self._pools.get(user)
+                        if short_link is None:
+                            self.failures += 1
+                        elif not provider.poolable:
+                            self.unpooled += 1 # Served live when asked for instead
+                        elif links is not None:
+                            links[seq] = short_link
+                            self.generated += 1
+                    self.refills += 1
+            except Exception as e:
+                logger.error("Link pool refill failed: %s", e)
+            finally:
+                self._queued.difference_update(refilled)
+
+            await asyncio.sleep(LINK_POOL_REFILL_INTERVAL)
+
+# Instantiate shared pool
+link_pool = LinkPool(shortener_client)
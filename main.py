@@ -1,10 +1,29 @@
+import asyncio
 import logging
-from telegram import Update
-from telegram.ext import Application, CommandHandler, ContextTypes
+import time
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.constants import ParseMode
+from telegram.ext import (
+    Application,
+    ApplicationHandlerStop,
+    CallbackQueryHandler,
+    CommandHandler,
+    ContextTypes,
+    TypeHandler,
+)
+from telegram.request import BaseRequest
 
 import config
-from database import db_manager
-from gplinks_api import generate_gplink
+from crediting import credit_batcher
+from database import db_manager, encode_page_cursor
+from gplinks_api import shortener_client
+from link_pool import link_pool
+from metrics import Gauge, instrument_handler, metrics_server, register_collector
+from notifications import notification_dispatcher
+from postback_server import postback_server
+from rate_limit import KeyedRateLimiter
 
 # Enable logging
 logging.basicConfig(
@@ -14,15 +33,68 @@ logging.basicConfig(
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+# Per-user limits, checked before any handler runs. /getlink has its own, stricter
+# limiter because every call may cost a GP Links API request and Mongo writes.
+getlink_limiter = KeyedRateLimiter(config.GETLINK_RATE, config.GETLINK_BURST, config.RATE_LIMIT_MAX_USERS)
+command_limiter = KeyedRateLimiter(config.COMMAND_RATE, config.COMMAND_BURST, config.RATE_LIMIT_MAX_USERS)
+# At most one "slow down" reply per user every 30 seconds
+warning_limiter = KeyedRateLimiter(1 / 30, 1, config.RATE_LIMIT_MAX_USERS)
+
+# Point-in-time stats of the bot's components, refreshed on every /metrics scrape
+COMPONENT_STATS = Gauge("bot_component_stat", "Internal component statistics.", ("component", "stat"))
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+def collect_component_stats() -> None:
+    for component, stats in (
+        ("link_pool", link_pool.stats()),
+        ("user_cache", db_manager.user_cache.stats()),
+        ("notifications", notification_dispatcher.stats()),
+    ):
+        for stat, value in stats.items():
+            COMPONENT_STATS.labels(component, stat).set(value)
+    for name, stats in shortener_client.stats().items():
+        COMPONENT_STATS.labels(f"shortener_{name}", "breaker_state").set(BREAKER_STATES[stats["state"]])
+        COMPONENT_STATS.labels(f"shortener_{name}", "error_rate").set(stats["error_rate"])
+    COMPONENT_STATS.labels("credit_batcher", "flushes").set(credit_batcher.flushes)
+    COMPONENT_STATS.labels("credit_batcher", "failed_flushes").set(credit_batcher.failed_flushes)
+    COMPONENT_STATS.labels("rate_limit", "getlink_rejected").set(getlink_limiter.rejected)
+    COMPONENT_STATS.labels("rate_limit", "command_rejected").set(command_limiter.rejected)
+
+register_collector(collect_component_stats)
+
+async def enforce_rate_limits(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Drops updates from users over their rate limit before they reach Mongo or the API."""
+    user = update.effective_user
+    if user is None or user.id in config.ADMIN_IDS:
+        return # Admins work through the withdrawal queue in bursts of button presses
+
+    message = update.message
+    if message and message.text and message.text.split(maxsplit=1)[0].split("@")[0].lower() == "/getlink":
+        limiter = getlink_limiter
+    else:
+        limiter = command_limiter
+
+    if limiter.allow(user.id):
+        return
+
+    warn = warning_limiter.allow(user.id)
+    if update.callback_query:
+        # Always answered, or the client keeps the button spinning
+        await update.callback_query.answer("⏳ Too many requests. Please slow down." if warn else None)
+    elif message and warn:
+        await message.reply_text("⏳ Too many requests. Please wait a moment and try again.")
+    raise ApplicationHandlerStop
+
+@instrument_handler("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends a welcome message and tutorial, and adds the user to the database."""
     user_tg_id = update.effective_user.id
     username = update.effective_user.username or update.effective_user.first_name
 
-    if db_manager.add_user(user_tg_id):
-        logger.info(f"New user added: {username} (ID: {user_tg_id})")
+    if await db_manager.add_user(user_tg_id):
+        logger.info("New user added: %s (ID: %s)", username, user_tg_id)
     else:
-        logger.info(f"User {username} (ID: {user_tg_id}) already exists.")
+        logger.info("User %s (ID: %s) already exists.", username, user_tg_id)
 
     welcome_message = (
         "👋 Welcome to Earn Bot! You can earn ₹1 per completed link. "
@@ -37,55 +109,40 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
     await update.message.reply_markdown(welcome_message + tutorial_message)
 
+@instrument_handler("getlink")
 async def get_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Generates a unique GP Links shortlink and sends it to the user."""
     user_tg_id = update.effective_user.id
-    user = db_manager.get_user(user_tg_id)
+    user = await db_manager.get_user(user_tg_id)
 
     if not user:
         await update.message.reply_text("Please /start the bot first!")
         return
 
-    # In a real scenario, the 'original_url' would point to your content
-    # or a unique page that tracks the user's completion.
-    # For demonstration, we'll use a placeholder and simulate completion.
-    base_target_url = "https://yourwebsite.com/earn_page" # Replace with your actual target URL
-    # Appending user_tg_id and a unique identifier (like link count)
-    # helps you track which user completed which link, if you had a tracking system.
-    original_url = f"{base_target_url}?user={user_tg_id}&link_seq={user.get('completed_links', 0) + 1}"
-
-    short_link = await generate_gplink(original_url)
+    # The shortlink points at TARGET_BASE_URL tagged with the user, link sequence and an
+    # HMAC token (see tracking.build_target_url); the pool usually has it generated already.
+    # Until the link is completed (postback_server), /getlink keeps returning the same link.
+    link_seq = user.get('total_links', user.get('completed_links', 0)) + 1
+    short_link = await link_pool.get(user_tg_id, link_seq)
 
     if short_link:
-        db_manager.add_link(user_tg_id, short_link, status='pending')
+        credit_batcher.add_link(user_tg_id, short_link, link_seq, status='pending')
         await update.message.reply_text(
             f"🔗 Here is your unique earning link:\n`{short_link}`\n\n"
-            "Complete this link to earn ₹1!"
+            f"Complete this link to earn ₹{config.LINK_REWARD:.0f}!"
         )
-        logger.info(f"User {user_tg_id} generated link: {short_link}")
-
-        # --- SIMULATE LINK COMPLETION FOR DEMO PURPOSES ---
-        # In a real system, you would have a webhook or a manual verification
-        # process to confirm link completion and then call db_manager.update_user_balance.
-        # For this demo, we'll auto-complete it after generation.
-        if db_manager.update_user_balance(user_tg_id, amount=1.0):
-            await update.message.reply_text("✅ Link completion simulated! ₹1 has been added to your balance.")
-            logger.info(f"Simulated link completion for user {user_tg_id}. Balance updated.")
-        else:
-            await update.message.reply_text("❌ Failed to update your balance after link generation (simulation error).")
-            logger.error(f"Failed to simulate balance update for user {user_tg_id}.")
-        # --- END SIMULATION ---
-
+        logger.info("User %s generated link: %s", user_tg_id, short_link)
     else:
         await update.message.reply_text(
             "😞 Sorry, I couldn't generate an earning link at the moment. Please try again later."
         )
-        logger.error(f"Failed to generate GP Link for user {user_tg_id}.")
+        logger.error("Failed to generate GP Link for user %s.", user_tg_id)
 
+@instrument_handler("balance")
 async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Shows the user's current balance and completed links."""
     user_tg_id = update.effective_user.id
-    user = db_manager.get_user(user_tg_id)
+    user = await db_manager.get_user(user_tg_id)
 
     if user:
         balance_amount = user.get("balance", 0.0)
@@ -94,14 +151,15 @@ async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             f"💰 Your current balance: ₹{balance_amount:.2f}\n"
             f"🔗 Completed links: {completed_links}"
         )
-        logger.info(f"User {user_tg_id} checked balance: ₹{balance_amount:.2f}, {completed_links} links.")
+        logger.info("User %s checked balance: ₹%.2f, %s links.", user_tg_id, balance_amount, completed_links)
     else:
         await update.message.reply_text("You haven't started yet! Use /start to begin.")
 
+@instrument_handler("withdraw")
 async def withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles user withdrawal requests."""
     user_tg_id = update.effective_user.id
-    user = db_manager.get_user(user_tg_id)
+    user = await db_manager.get_user(user_tg_id)
 
     if not user:
         await update.message.reply_text("Please /start the bot first!")
@@ -127,108 +185,426 @@ async def withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text("Invalid UPI ID provided.")
         return
 
-    if db_manager.update_user_upi_id(user_tg_id, upi_id) and \
-       db_manager.add_withdrawal_request(user_tg_id, current_balance, upi_id) and \
-       db_manager.reset_user_balance_and_links(user_tg_id):
-        
+    # withdraw_balance is atomic on its own; in cluster mode the lease also keeps a second worker
+    # (e.g. one restarted mid-request) from racing this one
+    if config.BOT_MODE == "cluster":
+        withdrawal_lease = db_manager.lease(f"withdraw:{user_tg_id}")
+    else:
+        withdrawal_lease = nullcontext(True)
+    async with withdrawal_lease as acquired:
+        if not acquired:
+            await update.message.reply_text("⏳ Your previous withdrawal is still being processed. Please check /balance.")
+            return
+        # Claims the balance as of the write, which may include credits that landed since the read
+        withdrawn = await db_manager.withdraw_balance(user_tg_id, upi_id, min_balance=10)
+    if withdrawn is not None:
+        current_balance = withdrawn
         await update.message.reply_text(
             f"✅ Withdrawal request for ₹{current_balance:.2f} to UPI ID `{upi_id}` has been submitted.\n"
             "It will be reviewed by an admin shortly. Your balance has been reset."
         )
-        logger.info(f"Withdrawal request from user {user_tg_id} for ₹{current_balance:.2f} to {upi_id}.")
+        logger.info("Withdrawal request from user %s for ₹%.2f to %s.", user_tg_id, current_balance, upi_id)
 
         # Notify admins
         for admin_id in config.ADMIN_IDS:
-            try:
-                await context.bot.send_message(
-                    chat_id=admin_id,
-                    text=f"🚨 *New Withdrawal Request!* 🚨\n\n"
-                         f"User ID: `{user_tg_id}` (`{update.effective_user.username}`)\n"
-                         f"Amount: ₹{current_balance:.2f}\n"
-                         f"UPI ID: `{upi_id}`\n"
-                         f"Status: *Pending*\n\n"
-                         f"Use `/admin` to see all requests. To approve/reject, you'll need the request's `_id` from the /admin list."
-                )
-            except Exception as e:
-                logger.error(f"Failed to notify admin {admin_id}: {e}")
+            notification_dispatcher.enqueue(
+                admin_id,
+                f"🚨 *New Withdrawal Request!* 🚨\n\n"
+                f"User ID: `{user_tg_id}` (`{update.effective_user.username}`)\n"
+                f"Amount: ₹{current_balance:.2f}\n"
+                f"UPI ID: `{upi_id}`\n"
+                f"Status: *Pending*\n\n"
+                f"Use `/admin` to see all requests. To approve/reject, you'll need the request's `_id` from the /admin list."
+            )
     else:
-        await update.message.reply_text("❌ An error occurred while processing your withdrawal. Please try again.")
-        logger.error(f"Failed to process withdrawal for user {user_tg_id}.")
+        await update.message.reply_text(
+            "❌ Your withdrawal could not be processed. If you already requested it, check /balance; otherwise please try again."
+        )
+        logger.error("Failed to process withdrawal for user %s.", user_tg_id)
+
+def render_withdrawal_page(requests: list, has_prev: bool, has_next: bool) -> tuple[str, InlineKeyboardMarkup]:
+    """Builds the text and approve/reject/paging keyboard for one page of the admin queue."""
+    lines = ["🗓️ *Pending Withdrawal Requests:*\n"]
+    keyboard = []
+    for number, req in enumerate(requests, 1):
+        lines.append(
+            f"*{number}.* *Request ID:* `{req['_id']}`\n"
+            f"  *User TG ID:* `{req['user_tg_id']}`\n"
+            f"  *Amount:* ₹{req['amount']:.2f}\n"
+            f"  *UPI ID:* `{req['upi_id']}`\n"
+            f"  *Requested On:* `{req['timestamp'].strftime('%Y-%m-%d %H:%M')}`\n"
+        )
+        keyboard.append([
+            InlineKeyboardButton(f"✅ Approve {number}", callback_data=f"wd:approve:{req['_id']}"),
+            InlineKeyboardButton(f"❌ Reject {number}", callback_data=f"wd:reject:{req['_id']}"),
+        ])
+
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"wd:prev:{encode_page_cursor(requests[0])}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Next ➡️", callback_data=f"wd:next:{encode_page_cursor(requests[-1])}"))
+    if navigation:
+        keyboard.append(navigation)
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+def withdrawal_status_text(req: dict, action: str) -> str:
+    return f"📢 Your withdrawal request for ₹{req['amount']:.2f} has been *{action}d* by an admin."
+
+def notify_withdrawal_status(req: dict, action: str) -> bool:
+    """Queues a message telling the requesting user that an admin processed their withdrawal."""
+    return notification_dispatcher.enqueue(req['user_tg_id'], withdrawal_status_text(req, action))
+
+def parse_until(value: str) -> datetime | None:
+    """Parses `YYYY-MM-DD` or `YYYY-MM-DDTHH:MM` into an exclusive upper bound (end of that day/minute)."""
+    for fmt, step in (("%Y-%m-%d", timedelta(days=1)), ("%Y-%m-%dT%H:%M", timedelta(minutes=1))):
+        try:
+            return datetime.strptime(value, fmt) + step
+        except ValueError:
+            continue
+    return None
+
+async def bulk_process_withdrawals(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str, **filters) -> None:
+    """Approves/rejects all matching pending requests at once, then notifies their users."""
+    started = time.monotonic()
+    batch_id, count, total = await db_manager.bulk_process_withdrawal_requests(action, **filters)
+    elapsed_ms = (time.monotonic() - started) * 1000
+    if batch_id is None:
+        await update.message.reply_text("No matching pending withdrawal requests.")
+        return
+
+    admin_tg_id = update.effective_user.id
 
+    async def notify_users() -> None:
+        notified = 0
+        # Requests are streamed from a cursor; put() waits while the queue is full
+        async for req in db_manager.iter_batch_requests(batch_id, config.BROADCAST_BATCH_SIZE):
+            await notification_dispatcher.put(req['user_tg_id'], withdrawal_status_text(req, action))
+            notified += 1
+        await notification_dispatcher.put(admin_tg_id, f"📢 {notified} users notified of their {action}d withdrawals.")
+
+    context.application.create_task(notify_users(), update=update)
+    await update.message.reply_text(
+        f"✅ {count} withdrawal requests (₹{total:.2f}) {action}d in {elapsed_ms:.0f} ms. "
+        f"Their users are being notified."
+    )
+    logger.info("Admin %s bulk %sd %s withdrawal requests (%s).", admin_tg_id, action, count, filters)
+
+@instrument_handler("admin")
 async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Admin command to list and manage withdrawal requests."""
     user_tg_id = update.effective_user.id
 
     if user_tg_id not in config.ADMIN_IDS:
         await update.message.reply_text("🚫 You are not authorized to use this command.")
-        logger.warning(f"Unauthorized admin access attempt by user {user_tg_id}.")
+        logger.warning("Unauthorized admin access attempt by user %s.", user_tg_id)
         return
 
     args = context.args
     if not args:
-        requests = db_manager.get_pending_withdrawal_requests()
+        requests, has_next = await db_manager.get_pending_withdrawal_requests_page()
         if not requests:
             await update.message.reply_text("No pending withdrawal requests.")
             return
 
-        message = "🗓️ *Pending Withdrawal Requests:*\n\n"
-        for req in requests:
-            message += (
-                f"• *Request ID:* `{req['_id']}`\n"
-                f"  *User TG ID:* `{req['user_tg_id']}`\n"
-                f"  *Amount:* ₹{req['amount']:.2f}\n"
-                f"  *UPI ID:* `{req['upi_id']}`\n"
-                f"  *Requested On:* `{req['timestamp'].strftime('%Y-%m-%d %H:%M')}`\n\n"
-            )
-        message += "To approve/reject: `/admin approve <request_id>` or `/admin reject <request_id>`"
-        await update.message.reply_markdown(message)
-        logger.info(f"Admin {user_tg_id} viewed pending withdrawal requests.")
+        message, keyboard = render_withdrawal_page(requests, has_prev=False, has_next=has_next)
+        await update.message.reply_markdown(message, reply_markup=keyboard)
+        logger.info("Admin %s viewed pending withdrawal requests.", user_tg_id)
     else:
         action = args[0].lower()
         if action in ["approve", "reject"]:
             if len(args) < 2:
-                await update.message.reply_text(f"Please provide a request ID: `/admin {action} <request_id>`")
+                await update.message.reply_text(f"Please provide a request ID: `/admin {action} <request_id> [<request_id> ...]`")
                 return
             
-            request_id = args[1] # MongoDB _id is a string
+            request_ids = args[1:] # MongoDB _id is a string
             
             # Basic validation to check if it looks like an ObjectId
             from bson.objectid import ObjectId
-            if not ObjectId.is_valid(request_id):
+            if not all(ObjectId.is_valid(request_id) for request_id in request_ids):
                 await update.message.reply_text("Invalid request ID format. Please provide a valid MongoDB ObjectId.")
                 return
 
-            # Retrieve the request to ensure it's pending and to get user info
-            req = db_manager.withdrawal_requests_collection.find_one({"_id": ObjectId(request_id), "status": "pending"})
+            if len(request_ids) > 1:
+                await bulk_process_withdrawals(update, context, action, request_ids=request_ids)
+                return
+            request_id = request_ids[0]
+
+            # Only a pending request is updated; the updated request carries the user info
+            req = await db_manager.process_withdrawal_request(request_id, action)
 
             if not req:
                 await update.message.reply_text(f"Request ID `{request_id}` not found or not pending.")
                 return
 
-            if db_manager.update_withdrawal_request_status(request_id, action):
-                await update.message.reply_text(f"Withdrawal request `{request_id}` {action}d.")
-                logger.info(f"Admin {user_tg_id} {action}d withdrawal request {request_id}.")
-
-                # Notify the user about the status
-                requested_tg_id = req['user_tg_id']
-                amount = req['amount']
-                try:
-                    await context.bot.send_message(
-                        chat_id=requested_tg_id,
-                        text=f"📢 Your withdrawal request for ₹{amount:.2f} has been *{action}d* by an admin."
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to notify user {requested_tg_id} about withdrawal status: {e}")
-            else:
-                await update.message.reply_text(f"❌ Failed to {action} request `{request_id}`.")
-                logger.error(f"Admin {user_tg_id} failed to {action} request {request_id}.")
+            await update.message.reply_text(f"Withdrawal request `{request_id}` {action}d.")
+            logger.info("Admin %s %sd withdrawal request %s.", user_tg_id, action, request_id)
+            notify_withdrawal_status(req, action)
+        elif action in ["approveall", "rejectall"]:
+            # Everything pending up to (and including) the given day or minute; the date is
+            # required so a bare command can never clear the whole queue
+            before = parse_until(args[1]) if len(args) > 1 else None
+            if before is None:
+                await update.message.reply_text(f"Please provide a date: `/admin {action} YYYY-MM-DD[THH:MM]`")
+                return
+            await bulk_process_withdrawals(update, context, action[:-3], before=before)
+        elif action in ["approvebelow", "rejectbelow"]:
+            try:
+                max_amount = float(args[1])
+            except (IndexError, ValueError):
+                await update.message.reply_text(f"Please provide an amount: `/admin {action} <max_amount>`")
+                return
+            await bulk_process_withdrawals(update, context, action[:-5], max_amount=max_amount)
+        elif action == "notify":
+            stats = notification_dispatcher.stats()
+            await update.message.reply_text(
+                "📬 Notifications:\n"
+                f"Queued: {stats['queued']}, waiting on a chat limit: {stats['held']}\n"
+                f"Sent: {stats['sent']}, failed: {stats['failed']}, blocked: {stats['blocked']}, retries: {stats['retries']}"
+            )
+        elif action == "pool":
+            stats = link_pool.stats()
+            await update.message.reply_text(
+                "🔗 Link pool:\n"
+                f"Hits: {stats['hits']} / Misses: {stats['misses']} (hit ratio {stats['hit_ratio']:.1%})\n"
+                f"Refill batches: {stats['refills']}, links generated: {stats['generated']}, failures: {stats['failures']}, "
+                f"raw fallbacks not pooled: {stats['unpooled']}\n"
+                f"Users pooled: {stats['users']}, links ready: {stats['links']}\n"
+                f"API calls refused by budget: {shortener_client.budget_rejected}"
+            )
+        elif action == "shortener":
+            lines = ["✂️ Shorteners:"]
+            for name, stats in shortener_client.stats().items():
+                lines.append(
+                    f"{name}: {stats['state']}, {stats['calls']} calls, {stats['failures']} failures, "
+                    f"error rate {stats['error_rate']:.0%}, opened {stats['times_opened']}x, "
+                    f"avg {stats['avg_latency'] * 1000:.0f} ms"
+                )
+            lines.append(f"Links no provider could serve: {shortener_client.unavailable}")
+            await update.message.reply_text("\n".join(lines))
+        elif action == "limits":
+            await update.message.reply_text(
+                "⏳ Rate limits:\n"
+                f"/getlink: {getlink_limiter.allowed} allowed, {getlink_limiter.rejected} rejected, {len(getlink_limiter)} users tracked\n"
+                f"Other: {command_limiter.allowed} allowed, {command_limiter.rejected} rejected, {len(command_limiter)} users tracked"
+            )
+        elif action == "cache":
+            stats = db_manager.user_cache.stats()
+            await update.message.reply_text(
+                "🗄️ User cache:\n"
+                f"Hits: {stats['hits']} / Misses: {stats['misses']} (hit ratio {stats['hit_ratio']:.1%})\n"
+                f"Cached users: {stats['size']}, approx. memory: {stats['memory_bytes'] / 1024 / 1024:.1f} MiB"
+            )
         else:
-            await update.message.reply_text("Unknown admin action. Use `/admin approve <request_id>` or `/admin reject <request_id>`.")
+            await update.message.reply_text(
+                "Unknown admin action. Use:\n"
+                "`/admin approve <request_id> [<request_id> ...]` / `/admin reject ...`\n"
+                "`/admin approveall YYYY-MM-DD[THH:MM]` / `/admin rejectall ...`\n"
+                "`/admin approvebelow <max_amount>` / `/admin rejectbelow ...`\n"
+                "`/admin pool`, `/admin cache`, `/admin notify`, `/admin limits` or `/admin shortener`.",
+                parse_mode=ParseMode.MARKDOWN,
+            )
 
+def mask_user_id(tg_id: int) -> str:
+    """Shows only the ends of a Telegram ID on the public leaderboard."""
+    text = str(tg_id)
+    return text[:2] + "•" * max(len(text) - 4, 1) + text[-2:]
 
-def main() -> None:
-    """Starts the bot."""
-    application = Application.builder().token(config.TELEGRAM_BOT_TOKEN).build()
+@instrument_handler("top")
+async def top(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Shows the top earners and the caller's own lifetime earnings."""
+    user_tg_id = update.effective_user.id
+    leaders = await db_manager.get_top_earners(config.LEADERBOARD_SIZE)
+    if not leaders:
+        await update.message.reply_text("🏆 No earnings yet. Use /getlink to be the first on the leaderboard!")
+        return
+
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    lines = ["🏆 *Top Earners:*\n"]
+    for rank, leader in enumerate(leaders, 1):
+        name = "You" if leader["tg_id"] == user_tg_id else f"`{mask_user_id(leader['tg_id'])}`"
+        lines.append(f"{medals.get(rank, f'{rank}.')} {name} – ₹{leader['total_earned']:.2f}")
+    user = await db_manager.get_user(user_tg_id)
+    if user:
+        lines.append(f"\nYou have earned ₹{user.get('total_earned', 0.0):.2f} in total.")
+    await update.message.reply_markdown("\n".join(lines))
+
+@instrument_handler("stats")
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin command showing all-time totals and recent daily rollups."""
+    user_tg_id = update.effective_user.id
+
+    if user_tg_id not in config.ADMIN_IDS:
+        await update.message.reply_text("🚫 You are not authorized to use this command.")
+        logger.warning("Unauthorized stats access attempt by user %s.", user_tg_id)
+        return
+
+    if context.args and context.args[0].lower() == "rebuild":
+        # Full scans; only needed once for data that predates the counters
+        started = time.monotonic()
+        await db_manager.rebuild_stats()
+        await update.message.reply_text(f"♻️ Stats counters rebuilt in {time.monotonic() - started:.1f} s.")
+        logger.info("Admin %s rebuilt the stats counters.", user_tg_id)
+
+    totals, days = await db_manager.get_stats(config.STATS_DAYS)
+    lines = [
+        "📊 *Bot Stats:*\n",
+        f"Users: {totals.get('users', 0)}",
+        f"Links completed: {totals.get('links_completed', 0)}",
+        f"Total earned: ₹{totals.get('total_earned', 0.0):.2f}",
+        f"Unwithdrawn balances: ₹{totals.get('balance_outstanding', 0.0):.2f}",
+        f"Pending payouts: {totals.get('pending_count', 0)} (₹{totals.get('pending_amount', 0.0):.2f})",
+        f"Approved: {totals.get('approved_count', 0)} (₹{totals.get('approved_amount', 0.0):.2f}), "
+        f"rejected: {totals.get('rejected_count', 0)} (₹{totals.get('rejected_amount', 0.0):.2f})",
+    ]
+    if days:
+        lines.append("\n*Daily:*")
+        for day in days:
+            lines.append(
+                f"`{day['_id']}`: {day.get('new_users', 0)} new users, {day.get('links_completed', 0)} links, "
+                f"₹{day.get('earned', 0.0):.2f} earned, {day.get('withdrawals_requested', 0)} withdrawals "
+                f"(₹{day.get('withdrawn_amount', 0.0):.2f}), ₹{day.get('approved_amount', 0.0):.2f} approved"
+            )
+    await update.message.reply_markdown("\n".join(lines))
+
+@instrument_handler("broadcast")
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin command to send a message to every user."""
+    user_tg_id = update.effective_user.id
+
+    if user_tg_id not in config.ADMIN_IDS:
+        await update.message.reply_text("🚫 You are not authorized to use this command.")
+        logger.warning("Unauthorized broadcast attempt by user %s.", user_tg_id)
+        return
+
+    text = " ".join(context.args).strip()
+    if not text:
+        await update.message.reply_text("Please provide the message: `/broadcast <text>`")
+        return
+
+    async def stream_to_users() -> None:
+        started = time.monotonic()
+        recipients = 0
+        # Users are streamed from a cursor; put() waits while the queue is full
+        async for tg_id in db_manager.iter_user_ids(config.BROADCAST_BATCH_SIZE):
+            await notification_dispatcher.put(tg_id, text)
+            recipients += 1
+        notification_dispatcher.enqueue(
+            user_tg_id,
+            f"📣 Broadcast queued for {recipients} users in {time.monotonic() - started:.1f} s."
+        )
+        logger.info("Admin %s broadcast queued for %s users.", user_tg_id, recipients)
+
+    context.application.create_task(stream_to_users(), update=update)
+    await update.message.reply_text("📣 Broadcast started. You'll get a summary once every user is queued.")
+
+@instrument_handler("admin_callback")
+async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handles the paging and approve/reject buttons of the /admin withdrawal queue."""
+    query = update.callback_query
+    user_tg_id = query.from_user.id
+
+    if user_tg_id not in config.ADMIN_IDS:
+        await query.answer("🚫 You are not authorized to use this command.", show_alert=True)
+        logger.warning("Unauthorized admin callback by user %s.", user_tg_id)
+        return
+
+    _, action, value = query.data.split(":", 2)
+    if action in ["next", "prev"]:
+        if action == "next":
+            requests, has_more = await db_manager.get_pending_withdrawal_requests_page(after=value)
+            has_prev, has_next = True, has_more
+        else:
+            requests, has_more = await db_manager.get_pending_withdrawal_requests_page(before=value)
+            has_prev, has_next = has_more, True
+        if not requests:
+            # Everything on that side was processed meanwhile; start over
+            requests, has_next = await db_manager.get_pending_withdrawal_requests_page()
+            has_prev = False
+        if not requests:
+            await query.answer()
+            await query.edit_message_text("No pending withdrawal requests.")
+            return
+
+        message, keyboard = render_withdrawal_page(requests, has_prev, has_next)
+        await query.answer()
+        await query.edit_message_text(message, parse_mode=ParseMode.MARKDOWN, reply_markup=keyboard)
+    elif action in ["approve", "reject"]:
+        req = await db_manager.process_withdrawal_request(value, action)
+        if not req:
+            await query.answer(f"Request {value} not found or not pending.", show_alert=True)
+        else:
+            await query.answer(f"Withdrawal request {action}d.")
+            logger.info("Admin %s %sd withdrawal request %s.", user_tg_id, action, value)
+            notify_withdrawal_status(req, action)
+
+        # Drop the buttons of the processed request, keep the rest of the page
+        processed = {f"wd:approve:{value}", f"wd:reject:{value}"}
+        keyboard = [
+            row for row in query.message.reply_markup.inline_keyboard
+            if not any(button.callback_data in processed for button in row)
+        ]
+        await query.edit_message_reply_markup(InlineKeyboardMarkup(keyboard))
+    else:
+        await query.answer()
+
+
+async def post_init(application: Application) -> None:
+    """Runs inside the bot's event loop before polling starts."""
+    db_manager.connect()
+    await db_manager.ensure_indexes()
+    await shortener_client.start()
+    await link_pool.start()
+    await credit_batcher.start()
+    # Pays completions a previous run recorded but never credited; cluster workers take their own shard
+    if config.CLUSTER_WORKER_INDEX >= 0:
+        await credit_batcher.reconcile(config.CLUSTER_WORKERS, config.CLUSTER_WORKER_INDEX)
+    else:
+        await credit_batcher.reconcile()
+    if config.POSTBACK_SERVER_ENABLED:
+        await postback_server.start()
+    await notification_dispatcher.start(application.bot)
+    await metrics_server.start()
+
+
+async def post_shutdown(application: Application) -> None:
+    """Releases resources bound to the bot's event loop."""
+    await metrics_server.close()
+    await postback_server.close()
+    await notification_dispatcher.close()
+    await link_pool.close()
+    await shortener_client.close()
+    # Flush buffered credits and links before the connection goes away
+    await credit_batcher.close()
+    db_manager.close()
+
+
+# Only the update types the registered handlers consume
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+
+def build_application(updater: bool = True, request: BaseRequest | None = None) -> Application:
+    """Builds the Application with all handlers registered.
+
+    Cluster workers pass updater=False and feed application.update_queue themselves;
+    the benchmarks also pass a request that answers Bot API calls locally.
+    """
+    builder = (
+        Application.builder()
+        .token(config.TELEGRAM_BOT_TOKEN)
+        .base_url(config.TELEGRAM_API_URL)
+        .concurrent_updates(config.CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if not updater:
+        builder = builder.updater(None)
+    if request is not None:
+        builder = builder.request(request)
+    application = builder.build()
+
+    # Rate limiting runs in an earlier group, in front of every handler
+    application.add_handler(TypeHandler(Update, enforce_rate_limits), group=-1)
 
     # Register command handlers
     application.add_handler(CommandHandler("start", start))
@@ -236,14 +612,42 @@ def main() -> None:
     application.add_handler(CommandHandler("balance", balance))
     application.add_handler(CommandHandler("withdraw", withdraw))
     application.add_handler(CommandHandler("admin", admin))
+    application.add_handler(CommandHandler("broadcast", broadcast))
+    application.add_handler(CommandHandler("top", top))
+    application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(CallbackQueryHandler(admin_callback, pattern=r"^wd:"))
+    return application
+
+
+def main() -> None:
+    """Starts the bot."""
+    config.validate()
+    if config.BOT_MODE == "cluster":
+        # This process only routes updates; every worker runs its own Application
+        from cluster import run_cluster
+        asyncio.run(run_cluster(ALLOWED_UPDATES))
+        return
 
-    logger.info("Bot started polling...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    application = build_application()
+
+    if config.BOT_MODE == "webhook":
+        logger.info("Bot started webhook on %s:%s/%s...", config.WEBHOOK_LISTEN, config.WEBHOOK_PORT, config.WEBHOOK_PATH)
+        application.run_webhook(
+            listen=config.WEBHOOK_LISTEN,
+            port=config.WEBHOOK_PORT,
+            url_path=config.WEBHOOK_PATH,
+            webhook_url=config.WEBHOOK_URL,
+            secret_token=config.WEBHOOK_SECRET_TOKEN,
+            allowed_updates=ALLOWED_UPDATES,
+        )
+    else:
+        logger.info("Bot started polling...")
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == "__main__":
     try:
         main()
     except Exception as e:
-        logger.critical(f"Bot failed to start: {e}")
+        logger.critical("Bot failed to start: %s", e)
     finally:
         db_manager.close() # Ensure MongoDB connection is closed on exit
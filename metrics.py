@@ -0,0 +1,212 @@
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+
+from aiohttp import web
+
+from config import METRICS_LISTEN, METRICS_PORT, LOOP_LAG_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Seconds; suits everything from cache hits to slow API calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: list = []
+_collectors: list = []
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._children: dict[tuple, object] = {}
+        _registry.append(self)
+
+    def labels(self, *values):
+        """Returns the child for these label values. Cache it on hot paths."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            labels = _format_labels(self.labelnames, values, 'le="%s"' % le)
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, values)} {child.sum}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, values)} {child.count}")
+        return lines
+
+def register_collector(collector):
+    """Registers a callable run before each scrape, e.g. to copy component stats into gauges."""
+    _collectors.append(collector)
+
+def render() -> str:
+    for collector in _collectors:
+        try:
+            collector()
+        except Exception as e:
+            logger.error("Metrics collector %s failed: %s", collector, e)
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# Metrics shared across modules
+HANDLER_LATENCY = Histogram("bot_handler_latency_seconds", "Time spent in update handlers.", ("command",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Update handlers that raised.", ("command",))
+DB_CALLS = Counter("mongodb_calls_total", "MongoDB data-access method calls.", ("method",))
+DB_ERRORS = Counter("mongodb_errors_total", "MongoDB data-access method errors.", ("method",))
+DB_LATENCY = Histogram("mongodb_call_latency_seconds", "MongoDB data-access method latency.", ("method",))
+SHORTENER_REQUESTS = Counter("shortener_requests_total", "Shortener API calls by outcome.", ("provider", "outcome"))
+SHORTENER_LATENCY = Histogram("shortener_latency_seconds", "Shortener API call latency.", ("provider",))
+LOOP_LAG = Histogram("event_loop_lag_seconds", "Delay of event loop wake-ups past their schedule.")
+
+def instrument(latency, errors=None):
+    """Decorates a coroutine function to observe its latency (and count raised errors)."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+def instrument_handler(command: str):
+    """Decorates a Telegram handler with per-command latency and error metrics."""
+    return instrument(HANDLER_LATENCY.labels(command), HANDLER_ERRORS.labels(command))
+
+def instrument_db(method: str):
+    """Decorates a MongoDB method with call count and latency metrics."""
+    calls = DB_CALLS.labels(method)
+    latency = DB_LATENCY.labels(method)
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            calls.inc()
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                latency.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+class MetricsServer:
+    """Serves /metrics in Prometheus text format and samples event loop lag."""
+
+    def __init__(self):
+        self.runner: web.AppRunner | None = None
+        self._lag_task: asyncio.Task | None = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        if self.runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, METRICS_LISTEN, METRICS_PORT).start()
+        self._lag_task = asyncio.create_task(self._sample_loop_lag())
+        logger.info("Metrics server listening on %s:%s/metrics", METRICS_LISTEN, METRICS_PORT)
+
+    async def close(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            await asyncio.gather(self._lag_task, return_exceptions=True)
+            self._lag_task = None
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+            logger.info("Metrics server stopped.")
+
+    async def _sample_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            LOOP_LAG.observe(max(0.0, loop.time() - expected))
+
+# Instantiate shared server
+metrics_server = MetricsServer()
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from telegram import Bot
+from telegram.error import Forbidden, NetworkError, RetryAfter, TimedOut
+
+from config import (
+    TELEGRAM_BROADCAST_RATE,
+    NOTIFY_PER_CHAT_RATE,
+    NOTIFY_WORKERS,
+    NOTIFY_QUEUE_SIZE,
+    NOTIFY_MAX_RETRIES,
+)
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Idle per-chat buckets are pruned once this many are tracked
+MAX_CHAT_BUCKETS = 10000
+
+class NotificationDispatcher:
+    """Queue + worker pool that sends bot messages within Telegram's rate limits.
+
+    Every send takes a token from the global bucket (TELEGRAM_BROADCAST_RATE
+    messages/second) and from the destination chat's bucket
+    (NOTIFY_PER_CHAT_RATE messages/second). A message whose chat has no token
+    left waits in its own task, so the workers move on to other chats. A
+    RetryAfter from Telegram pauses all workers for the requested time before
+    the message is retried.
+    """
+
+    def __init__(self):
+        self.bot: Bot | None = None
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._held: set[asyncio.Task] = set() # Messages waiting on their chat's bucket
+        self._global_bucket = TokenBucket(TELEGRAM_BROADCAST_RATE)
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.retries = 0
+
+    async def start(self, bot: Bot):
+        """Starts the workers. Must run inside the bot's event loop."""
+        if self._workers:
+            return
+        self.bot = bot
+        self._queue = asyncio.Queue(maxsize=NOTIFY_QUEUE_SIZE)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(NOTIFY_WORKERS)]
+        logger.info("Notification dispatcher started with %s workers.", NOTIFY_WORKERS)
+
+    async def close(self, drain_timeout: float = 10.0):
+        """Gives queued messages up to drain_timeout seconds to go out, then stops the workers."""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %s undelivered notifications on shutdown.", self._queue.qsize())
+        tasks = self._workers + list(self._held)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        logger.info("Notification dispatcher stopped: %s", self.stats())
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "held": len(self._held),
+            "sent": self.sent,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "retries": self.retries,
+        }
+
+    def enqueue(self, chat_id: int, text: str, parse_mode: str | None = None) -> bool:
+        """Queues a message without waiting. Returns False if the queue is full."""
+        if self._queue is None:
+            logger.error("Notification dispatcher not started; dropping message to %s.", chat_id)
+            return False
+        try:
+            self._queue.put_nowait((chat_id, text, parse_mode))
+            return True
+        except asyncio.QueueFull:
+            logger.error("Notification queue full; dropping message to %s.", chat_id)
+            return False
+
+    async def put(self, chat_id: int, text: str, parse_mode: str | None = None):
+        """Queues a message, waiting for room. Used by producers that may outrun the workers."""
+        if self._queue is None:
+            logger.error("Notification dispatcher not started; dropping message to %s.", chat_id)
+            return
+        await self._queue.put((chat_id, text, parse_mode))
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                # A full bucket carries no state, so it can be recreated later
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.is_full()
+                }
+            bucket = self._chat_buckets[chat_id] = TokenBucket(NOTIFY_PER_CHAT_RATE, 1)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            delay = self._chat_bucket(item[0]).reserve()
+            if delay and len(self._held) < NOTIFY_QUEUE_SIZE:
+                # Sleeping here would stall every other chat queued behind this one
+                task = asyncio.create_task(self._deliver(item, delay))
+                self._held.add(task)
+                task.add_done_callback(self._held.discard)
+            else:
+                await self._deliver(item, delay)
+
+    async def _deliver(self, item: tuple, delay: float):
+        """Sends a message whose chat token is already reserved, delay seconds from now."""
+        chat_id, text, parse_mode = item
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            await self._send(chat_id, text, parse_mode)
+        except Exception as e:
+            self.failed += 1
+            logger.error("Unexpected error sending notification to %s: %s", chat_id, e)
+        finally:
+            self._queue.task_done()
+
+    async def _send(self, chat_id: int, text: str, parse_mode: str | None):
+        for attempt in range(NOTIFY_MAX_RETRIES + 1):
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            if attempt:
+                await self._chat_bucket(chat_id).acquire() # The first token was reserved by the worker
+            await self._global_bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                self.sent += 1
+                return
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                self.retries += 1
+                logger.warning("Telegram flood control: pausing notifications for %ss.", retry_after)
+            except Forbidden:
+                self.blocked += 1 # User blocked the bot or left the chat
+                return
+            except (TimedOut, NetworkError) as e:
+                self.retries += 1
+                logger.warning("Transient error notifying %s (attempt %s): %s", chat_id, attempt + 1, e)
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                self.failed += 1
+                logger.error("Failed to notify %s: %s", chat_id, e)
+                return
+        self.failed += 1
+        logger.error("Giving up notifying %s after %s attempts.", chat_id, NOTIFY_MAX_RETRIES + 1)
+
+# Instantiate shared dispatcher
+notification_dispatcher = NotificationDispatcher()
@@ -0,0 +1,67 @@
+import logging
+from aiohttp import web
+
+from config import POSTBACK_LISTEN, POSTBACK_PORT, POSTBACK_PATH, LINK_REWARD
+from crediting import credit_batcher
+from database import db_manager
+from tracking import verify_link_token
+
+logger = logging.getLogger(__name__)
+
+async def handle_postback(request: web.Request) -> web.Response:
+    """Verifies a link completion postback and credits the user once."""
+    params = request.query if request.method == "GET" else await request.post()
+    try:
+        user_tg_id = int(params["user"])
+        link_seq = int(params["link_seq"])
+        token = params["token"]
+    except (KeyError, ValueError):
+        return web.Response(status=400, text="bad request")
+
+    if not verify_link_token(user_tg_id, link_seq, token):
+        logger.warning("Rejected postback with invalid token for user %s, link %s.", user_tg_id, link_seq)
+        return web.Response(status=403, text="invalid token")
+
+    try:
+        completed = await db_manager.complete_link(user_tg_id, link_seq, LINK_REWARD)
+    except Exception:
+        # Let the caller retry; complete_link is idempotent
+        return web.Response(status=503, text="try again")
+
+    if not completed:
+        return web.Response(text="duplicate")
+
+    # The completion is durable from here: if this buffered credit is lost, reconcile() pays it
+    credit_batcher.credit(user_tg_id, amount=LINK_REWARD, link_seq=link_seq)
+    logger.info("Link %s completed by user %s. Credit of ₹%.2f queued.", link_seq, user_tg_id, LINK_REWARD)
+    return web.Response(text="ok")
+
+class PostbackServer:
+    """aiohttp server for completion postbacks, sharing the bot's event loop."""
+
+    def __init__(self):
+        self.runner: web.AppRunner | None = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(POSTBACK_PATH, handle_postback)
+        app.router.add_post(POSTBACK_PATH, handle_postback)
+        return app
+
+    async def start(self):
+        if self.runner is not None:
+            return
+        self.runner = web.AppRunner(self.build_app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, POSTBACK_LISTEN, POSTBACK_PORT, backlog=1024)
+        await site.start()
+        logger.info("Postback server listening on %s:%s%s", POSTBACK_LISTEN, POSTBACK_PORT, POSTBACK_PATH)
+
+    async def close(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+            logger.info("Postback server stopped.")
+
+# Instantiate shared server
+postback_server = PostbackServer()
@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+class TokenBucket:
+    """Token bucket refilling `rate` tokens per second up to `capacity`."""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Takes tokens if available right now; never waits."""
+        self._refill(time.monotonic())
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """Takes tokens now, into debt if need be; returns the seconds until they are covered."""
+        self._refill(time.monotonic())
+        self.tokens -= tokens
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    async def acquire(self, tokens: float = 1.0, keep: float | None = None):
+        """Takes tokens, waiting until the bucket has refilled enough.
+
+        The tokens are reserved before sleeping (the balance may go negative),
+        so concurrent waiters are served in order without overshooting the rate.
+        With `keep` the caller is a background consumer: it never goes into
+        debt and only takes tokens while at least `keep` stay in the bucket for
+        try_acquire() callers.
+        """
+        if keep is None:
+            delay = self.reserve(tokens)
+            if delay:
+                await asyncio.sleep(delay)
+            return
+        while True:
+            self._refill(time.monotonic())
+            if self.tokens - tokens >= keep:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep((keep + tokens - self.tokens) / self.rate)
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+class KeyedRateLimiter:
+    """Per-key rate limiter (GCRA) that stores a single float per tracked key.
+
+    Each key maps to its "theoretical arrival time": the moment its bucket would
+    be full again. A request is allowed if that moment is no more than `burst`
+    intervals ahead. Keys whose time has passed hold no state and are swept
+    once more than max_keys are tracked.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int):
+        self.interval = 1.0 / rate
+        self.tolerance = burst * self.interval
+        self.max_keys = max_keys
+        self._tat: dict[int, float] = {}
+        self.allowed = 0
+        self.rejected = 0
+
+    def allow(self, key: int) -> bool:
+        now = time.monotonic()
+        tat = self._tat.get(key, now)
+        if tat < now:
+            tat = now
+        tat += self.interval
+        if tat - now > self.tolerance:
+            self.rejected += 1
+            return False
+        self._tat[key] = tat
+        self.allowed += 1
+        if len(self._tat) > self.max_keys:
+            self._sweep(now)
+        return True
+
+    def _sweep(self, now: float):
+        self._tat = {key: tat for key, tat in self._tat.items() if tat > now}
+        excess = len(self._tat) - self.max_keys // 2
+        if excess > 0:
+            # Still crowded: forget the oldest entries (they may burst once more)
+            for key in list(self._tat)[:excess]:
+                del self._tat[key]
+
+    def __len__(self) -> int:
+        return len(self._tat)
@@ -0,0 +1,54 @@
+import asyncio
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks")) # The fakes are shared with the benchmarks
+
+# config is read at import; the tests never reach a real service
+os.environ.update(
+    TELEGRAM_BOT_TOKEN="123456:TEST",
+    GPLINKS_API_KEY="test",
+    POSTBACK_SECRET="test",
+    MONGO_DB_NAME="earning_bot_test",
+    ADMIN_IDS="1",
+)
+
+import pytest  # noqa: E402
+
+@pytest.fixture
+def db(monkeypatch):
+    """A fresh MongoDB manager backed by mongomock."""
+    import database
+    from fakes import mongomock_client_class
+
+    monkeypatch.setattr(database, "AsyncIOMotorClient", mongomock_client_class())
+    manager = database.MongoDB()
+    manager.connect()
+    yield manager
+    manager.close()
+
+@pytest.fixture
+def run_bot(db, monkeypatch):
+    """Runs scenario(application, telegram, updates) against main's handlers, the fake Bot API and db.
+
+    Only the Application is started; the servers and background components of
+    post_init are left to the tests that need them.
+    """
+    import main
+    from fakes import FakeTelegramRequest, UpdateFactory
+
+    monkeypatch.setattr(main, "db_manager", db)
+
+    def run(scenario):
+        telegram = FakeTelegramRequest()
+
+        async def run_application():
+            await db.ensure_indexes()
+            application = main.build_application(updater=False, request=telegram)
+            async with application:
+                await scenario(application, telegram, UpdateFactory(application.bot))
+
+        asyncio.run(run_application())
+    return run
@@ -0,0 +1,89 @@
+import asyncio
+from datetime import datetime
+
+ADMIN_ID = 1 # ADMIN_IDS in conftest
+
+async def seed_requests(db, count: int) -> None:
+    await db.withdrawal_requests_collection.insert_many([
+        {"user_tg_id": 100 + index, "amount": 10.0, "upi_id": "user@upi", "status": "pending", "timestamp": datetime.now()}
+        for index in range(count)
+    ])
+
+def test_approveall_requires_a_date(db, run_bot):
+    async def scenario(application, telegram, updates):
+        await seed_requests(db, 2)
+        await application.process_update(updates.command(ADMIN_ID, "/admin approveall"))
+        assert "Please provide a date" in telegram.last_message[ADMIN_ID]["text"]
+        assert await db.withdrawal_requests_collection.count_documents({"status": "pending"}) == 2
+
+        await application.process_update(updates.command(ADMIN_ID, f"/admin approveall {datetime.now():%Y-%m-%d}"))
+        assert "2 withdrawal requests" in telegram.last_message[ADMIN_ID]["text"]
+        assert await db.withdrawal_requests_collection.count_documents({"status": "approve"}) == 2
+
+    run_bot(scenario)
+
+def test_unknown_action_lists_bulk_actions(run_bot):
+    async def scenario(application, telegram, updates):
+        await application.process_update(updates.command(ADMIN_ID, "/admin help"))
+        text = telegram.last_message[ADMIN_ID]["text"]
+        for action in ("approveall", "rejectall", "approvebelow", "rejectbelow"):
+            assert action in text
+
+    run_bot(scenario)
+
+def test_admin_button_presses_are_not_rate_limited(db, run_bot, monkeypatch):
+    import main
+    from rate_limit import KeyedRateLimiter
+
+    monkeypatch.setattr(main, "command_limiter", KeyedRateLimiter(1, 5, 100))
+
+    async def scenario(application, telegram, updates):
+        await seed_requests(db, 8)
+        await application.process_update(updates.command(ADMIN_ID, "/admin"))
+        async for req in db.withdrawal_requests_collection.find({}, {"_id": 1}):
+            message = telegram.last_message[ADMIN_ID]
+            await application.process_update(updates.callback(ADMIN_ID, f"wd:approve:{req['_id']}", message))
+        assert await db.withdrawal_requests_collection.count_documents({"status": "approve"}) == 8
+
+    run_bot(scenario)
+
+def test_throttled_button_presses_are_answered(run_bot, monkeypatch):
+    import main
+    from rate_limit import KeyedRateLimiter
+
+    monkeypatch.setattr(main, "command_limiter", KeyedRateLimiter(1, 5, 100))
+    monkeypatch.setattr(main, "warning_limiter", KeyedRateLimiter(1 / 30, 1, 100))
+
+    async def scenario(application, telegram, updates):
+        await application.process_update(updates.command(ADMIN_ID, "/admin"))
+        message = telegram.last_message[ADMIN_ID]
+        for _ in range(10):
+            await application.process_update(updates.callback(2, "wd:next:x", message))
+        # Five reach admin_callback, five are throttled, one of those with a warning
+        assert telegram.calls["answerCallbackQuery"] == 10
+
+    run_bot(scenario)
+
+def test_bulk_approval_notifies_every_user_past_the_queue_bound(db, run_bot, monkeypatch):
+    import main
+    import notifications
+
+    monkeypatch.setattr(notifications, "NOTIFY_QUEUE_SIZE", 2)
+    dispatcher = notifications.NotificationDispatcher()
+    monkeypatch.setattr(main, "notification_dispatcher", dispatcher)
+
+    async def scenario(application, telegram, updates):
+        await dispatcher.start(application.bot)
+        await seed_requests(db, 10)
+        await application.process_update(updates.command(ADMIN_ID, f"/admin approveall {datetime.now():%Y-%m-%d}"))
+        assert "10 withdrawal requests" in telegram.last_message[ADMIN_ID]["text"]
+        for _ in range(100):
+            if "10 users notified" in telegram.last_message[ADMIN_ID]["text"]:
+                break
+            await asyncio.sleep(0.05)
+        await dispatcher.close()
+        for index in range(10):
+            assert "*approved*" in telegram.last_message[100 + index]["text"]
+        assert "10 users notified" in telegram.last_message[ADMIN_ID]["text"]
+
+    run_bot(scenario)
@@ -0,0 +1,177 @@
+import asyncio
+
+from pymongo import errors
+
+from crediting import CreditBatcher
+
+class FailingBulkWrites:
+    """Forwards to a collection; the first `failures` bulk writes fail.
+
+    By default every operation fails with a write error and nothing is
+    written. With after_write the server applies the batch and the
+    connection drops before the reply arrives.
+    """
+
+    def __init__(self, collection, failures: int, after_write: bool = False):
+        self._collection = collection
+        self.failures = failures
+        self.after_write = after_write
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def bulk_write(self, operations, *args, **kwargs):
+        if not self.failures:
+            return await self._collection.bulk_write(operations, *args, **kwargs)
+        self.failures -= 1
+        if self.after_write:
+            await self._collection.bulk_write(operations, *args, **kwargs)
+            raise errors.AutoReconnect("connection reset")
+        raise errors.BulkWriteError({
+            "writeErrors": [{"index": index, "code": 1, "errmsg": "failed"} for index in range(len(operations))],
+        })
+
+def test_failed_flush_keeps_credits_for_the_next_flush(db):
+    async def scenario():
+        await db.ensure_indexes()
+        for tg_id in (1, 2):
+            await db.add_user(tg_id)
+        db.users_collection = FailingBulkWrites(db.users_collection, failures=1)
+        batcher = CreditBatcher(db)
+
+        batcher.credit(1, 1.0)
+        batcher.credit(2, 2.0)
+        batcher.add_link(1, "https://short.test/1", 1)
+        assert not await batcher.flush()
+        # Queued while the failed batch was out; merged with it, not overwritten
+        batcher.credit(1, 1.0)
+        assert batcher._increments == {1: (2.0, 2), 2: (2.0, 1)}
+        assert await db.links_collection.count_documents({}) == 1 # add_links succeeded
+
+        assert await batcher.flush()
+        assert batcher._increments == {} and batcher._links == []
+        assert (await db.get_user(1))["balance"] == 2.0
+        assert (await db.get_user(2))["balance"] == 2.0
+        assert batcher.failed_flushes == 1
+
+    asyncio.run(scenario())
+
+def test_failed_link_insert_is_retried(db):
+    async def scenario():
+        await db.ensure_indexes()
+        batcher = CreditBatcher(db)
+
+        async def failing_add_links(links):
+            return False
+        add_links, db.add_links = db.add_links, failing_add_links
+        batcher.add_link(1, "https://short.test/1", 1)
+        assert not await batcher.flush()
+        assert len(batcher._links) == 1
+
+        db.add_links = add_links
+        assert await batcher.flush()
+        assert await db.links_collection.count_documents({"user_id": 1, "link_seq": 1}) == 1
+
+    asyncio.run(scenario())
+
+class FailingUpdateMany:
+    """Forwards to a collection; the first update_many raises a connection error, before or after writing."""
+
+    def __init__(self, collection, after_write: bool = False):
+        self._collection = collection
+        self.after_write = after_write
+        self.failed = False
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def update_many(self, *args, **kwargs):
+        if self.failed:
+            return await self._collection.update_many(*args, **kwargs)
+        self.failed = True
+        if self.after_write:
+            await self._collection.update_many(*args, **kwargs)
+        raise errors.AutoReconnect("connection reset")
+
+def test_failed_link_claim_is_retried_without_paying_twice(db):
+    async def scenario():
+        await db.ensure_indexes()
+        await db.add_user(1)
+        for link_seq in (1, 2):
+            await db.complete_link(1, link_seq, 1.0)
+        links = db.links_collection
+        for link_seq, after_write in ((1, False), (2, True)):
+            db.links_collection = FailingUpdateMany(links, after_write)
+            batcher = CreditBatcher(db)
+
+            batcher.credit(1, 1.0, link_seq=link_seq)
+            flushed = await batcher.flush()
+            if after_write:
+                # The claim went through; the read-back finds it and the link is paid now
+                assert flushed and batcher._completed == {}
+            else:
+                assert not flushed and batcher._completed == {1: [1]}
+                assert await batcher.flush()
+            assert (await db.get_user(1))["balance"] == link_seq
+        db.links_collection = links
+        assert await CreditBatcher(db).reconcile() == 0
+
+    asyncio.run(scenario())
+
+def test_credits_applied_before_a_dropped_connection_are_not_paid_again(db):
+    """Standalone mongod: the bulk $inc ran, but the reply was lost, so the outcome is unknown."""
+    async def scenario():
+        await db.ensure_indexes()
+        for tg_id in (1, 2):
+            await db.add_user(tg_id)
+        await db.complete_link(1, 1, 1.0)
+        users = db.users_collection
+        db.users_collection = FailingBulkWrites(users, failures=1, after_write=True)
+        batcher = CreditBatcher(db)
+
+        batcher.credit(1, 1.0, link_seq=1)
+        batcher.credit(2, 2.0)
+        await batcher.flush()
+        assert batcher._increments == {} and batcher._completed == {} # Nothing re-queued
+        batcher.credit(1, 1.0, link_seq=1) # A duplicate of the same completion pays nothing
+        assert await batcher.flush()
+        assert await CreditBatcher(db).reconcile() == 0
+
+        db.users_collection = users
+        assert (await db.get_user(1))["balance"] == 1.0
+        assert (await db.get_user(2))["balance"] == 2.0
+
+    asyncio.run(scenario())
+
+class PausedBulkWrites:
+    """Forwards to a collection; bulk_write sets `entered`, then waits for `gate` before writing."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.entered = asyncio.Event()
+        self.gate = asyncio.Event()
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def bulk_write(self, *args, **kwargs):
+        self.entered.set()
+        await self.gate.wait()
+        return await self._collection.bulk_write(*args, **kwargs)
+
+def test_close_waits_for_the_flush_in_progress(db):
+    async def scenario():
+        await db.ensure_indexes()
+        await db.add_user(1)
+        db.users_collection = paused = PausedBulkWrites(db.users_collection)
+        batcher = CreditBatcher(db)
+        await batcher.start()
+        batcher.credit(1, 1.0)
+        await asyncio.wait_for(paused.entered.wait(), 5) # The periodic flush took the credit
+        closing = asyncio.create_task(batcher.close())
+        await asyncio.sleep(0.01)
+        paused.gate.set()
+        await closing
+        assert (await db.get_user(1))["balance"] == 1.0
+
+    asyncio.run(scenario())
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import time
+from collections import defaultdict
+
+from telegram import Bot
+
+import notifications
+from fakes import FakeTelegramRequest
+from notifications import NotificationDispatcher
+from rate_limit import TokenBucket
+
+GLOBAL_RATE = 50.0
+PER_CHAT_RATE = 5.0
+# Slack for the time between a worker taking its tokens and the fake Bot API seeing the call
+TIMING_SLACK = 0.01
+
+class RecordingRequest(FakeTelegramRequest):
+    """Fake Bot API that records when each sendMessage reached it; answers 429 once per chat in `flood`."""
+
+    def __init__(self, flood: dict[int, int] | None = None):
+        super().__init__()
+        self.sent: list[tuple[float, int]] = []
+        self.flood = dict(flood or {})
+        self.flooded_at: float | None = None
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        if url.endswith("/sendMessage"):
+            chat_id = int(request_data.parameters["chat_id"])
+            retry_after = self.flood.pop(chat_id, None)
+            if retry_after is not None:
+                self.flooded_at = time.monotonic()
+                return 429, json.dumps({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                }).encode()
+            self.sent.append((time.monotonic(), chat_id))
+        return await super().do_request(url, method, request_data, **kwargs)
+
+def max_excess(times: list[float], rate: float, capacity: float) -> float:
+    """Largest number of sends in any window beyond what a (rate, capacity) bucket allows."""
+    times = sorted(times)
+    return max(
+        (j - i + 1) - (capacity + rate * (times[j] - times[i] + TIMING_SLACK))
+        for i in range(len(times))
+        for j in range(i, len(times))
+    )
+
+def make_dispatcher(monkeypatch) -> NotificationDispatcher:
+    monkeypatch.setattr(notifications, "NOTIFY_PER_CHAT_RATE", PER_CHAT_RATE)
+    dispatcher = NotificationDispatcher()
+    dispatcher._global_bucket = TokenBucket(GLOBAL_RATE)
+    return dispatcher
+
+async def run_dispatcher(dispatcher: NotificationDispatcher, request: RecordingRequest, messages) -> float:
+    """Sends messages through the dispatcher with a fake bot; returns the seconds until all went out."""
+    async with Bot("123456:TEST", request=request, get_updates_request=FakeTelegramRequest()) as bot:
+        await dispatcher.start(bot)
+        started = time.monotonic()
+        for chat_id, text in messages:
+            assert dispatcher.enqueue(chat_id, text)
+        await dispatcher.close(drain_timeout=30)
+        return time.monotonic() - started
+
+def test_dispatcher_stays_within_global_and_per_chat_limits(monkeypatch):
+    dispatcher = make_dispatcher(monkeypatch)
+    request = RecordingRequest()
+    # 30 chats with 5 messages each, queued chat by chat as a burst of status updates would be
+    messages = [(chat_id, f"message {index}") for chat_id in range(1, 31) for index in range(5)]
+
+    seconds = asyncio.run(run_dispatcher(dispatcher, request, messages))
+
+    assert dispatcher.stats() == {"queued": 0, "held": 0, "sent": 150, "failed": 0, "blocked": 0, "retries": 0}
+    times = [sent_at for sent_at, _ in request.sent]
+    assert max_excess(times, GLOBAL_RATE, GLOBAL_RATE) <= 0
+    by_chat = defaultdict(list)
+    for sent_at, chat_id in request.sent:
+        by_chat[chat_id].append(sent_at)
+    assert len(by_chat) == 30
+    for chat_times in by_chat.values():
+        assert max_excess(chat_times, PER_CHAT_RATE, 1) <= 0
+    # Past the initial burst the global budget is the only limit: messages waiting on
+    # their chat's bucket do not hold up the other chats
+    messages_per_second = (len(messages) - GLOBAL_RATE) / seconds
+    assert 0.8 * GLOBAL_RATE <= messages_per_second <= GLOBAL_RATE * 1.05
+
+def test_retry_after_pauses_every_worker(monkeypatch):
+    monkeypatch.setattr(notifications, "NOTIFY_WORKERS", 2)
+    dispatcher = make_dispatcher(monkeypatch)
+    request = RecordingRequest(flood={1: 1})
+    messages = [(chat_id, "hello") for chat_id in range(1, 11)]
+
+    asyncio.run(run_dispatcher(dispatcher, request, messages))
+
+    assert dispatcher.stats()["sent"] == 10 and dispatcher.retries == 1
+    assert sorted(chat_id for _, chat_id in request.sent) == list(range(1, 11))
+    # Only a send already past its pause check when chat 1 hit flood control may go out
+    # during the pause; everything else, chat 1's retry included, waits the second out
+    in_pause = [chat_id for sent_at, chat_id in request.sent if sent_at < request.flooded_at + 1 - TIMING_SLACK]
+    assert len(in_pause) <= 1 and 1 not in in_pause
@@ -0,0 +1,63 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import postback_server
+from config import LINK_REWARD, POSTBACK_PATH
+from crediting import CreditBatcher
+from tracking import link_token
+
+def run_with_client(db, monkeypatch, scenario):
+    """Runs scenario(client, batcher) against the postback app, wired to db and a fresh batcher."""
+    batcher = CreditBatcher(db)
+    monkeypatch.setattr(postback_server, "db_manager", db)
+    monkeypatch.setattr(postback_server, "credit_batcher", batcher)
+
+    async def run():
+        await db.ensure_indexes()
+        await db.add_user(7)
+        async with TestClient(TestServer(postback_server.postback_server.build_app())) as client:
+            await scenario(client, batcher)
+
+    asyncio.run(run())
+
+async def postback(client, user: int, link_seq: int, token: str | None = None) -> tuple[int, str]:
+    params = {"user": user, "link_seq": link_seq, "token": token or link_token(user, link_seq)}
+    async with client.get(POSTBACK_PATH, params=params) as response:
+        return response.status, await response.text()
+
+def test_postback_credits_each_link_once(db, monkeypatch):
+    async def scenario(client, batcher):
+        assert await postback(client, 7, 1) == (200, "ok")
+        assert await postback(client, 7, 1) == (200, "duplicate")
+        assert await postback(client, 7, 2) == (200, "ok")
+        assert await batcher.flush()
+        user = await db.get_user(7)
+        assert user["balance"] == 2 * LINK_REWARD and user["completed_links"] == 2
+        assert await db.links_collection.count_documents({"credited": True}) == 2
+
+    run_with_client(db, monkeypatch, scenario)
+
+def test_postback_rejects_bad_requests(db, monkeypatch):
+    async def scenario(client, batcher):
+        assert (await postback(client, 7, 1, token="0" * 32))[0] == 403
+        assert (await postback(client, 7, 1, token="é" * 32))[0] == 403
+        async with client.get(POSTBACK_PATH, params={"user": "x"}) as response:
+            assert response.status == 400
+        assert batcher._increments == {} and batcher._completed == {}
+
+    run_with_client(db, monkeypatch, scenario)
+
+def test_credit_lost_before_flush_is_reconciled(db, monkeypatch):
+    async def scenario(client, batcher):
+        assert await postback(client, 7, 1) == (200, "ok")
+        assert await postback(client, 7, 2) == (200, "ok")
+        # The process dies with the credits still buffered
+        restarted = CreditBatcher(db)
+        assert await restarted.reconcile() == 2
+        assert await restarted.reconcile() == 0
+        assert (await db.get_user(7))["balance"] == 2 * LINK_REWARD
+        # A retried postback still finds the link completed
+        assert await postback(client, 7, 1) == (200, "duplicate")
+
+    run_with_client(db, monkeypatch, scenario)
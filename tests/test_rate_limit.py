@@ -0,0 +1,23 @@
+import asyncio
+import time
+
+from rate_limit import TokenBucket
+
+def test_background_acquire_leaves_headroom_for_live_calls():
+    async def scenario():
+        bucket = TokenBucket(rate=100, capacity=10)
+        background = [asyncio.create_task(bucket.acquire(keep=4)) for _ in range(10)]
+        await asyncio.sleep(0)
+        # Six tokens went to the background at once; the other four wait for the refill
+        assert sum(task.done() for task in background) == 6
+        assert bucket.tokens >= 4
+        for _ in range(4):
+            assert bucket.try_acquire() # Live calls still find the headroom
+
+        started = time.monotonic()
+        await asyncio.gather(*background)
+        # The background waited for the refill rather than going into debt
+        assert time.monotonic() - started >= 0.07
+        assert bucket.tokens >= 4
+
+    asyncio.run(scenario())
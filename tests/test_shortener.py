@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import pytest
+
+import gplinks_api
+from fakes import FakeShortener
+from gplinks_api import APIShortenerProvider, CircuitBreaker, RawURLProvider, ShortenerClient
+from link_pool import LinkPool
+from load_test import free_port
+
+TARGET = "https://earn.test/page?user=1&link_seq=1&token=t"
+
+@pytest.fixture
+def shortener(monkeypatch):
+    """Runs scenario(fake, client) against a local FakeShortener; the client falls back to raw links."""
+    monkeypatch.setattr(gplinks_api, "SHORTENER_RETRY_BASE_DELAY", 0.01)
+
+    def run(scenario, providers=("gplinks", "raw"), **fake_options):
+        async def run_fake():
+            port = free_port()
+            fake = FakeShortener(**{"latency": 0.0, **fake_options})
+            await fake.start("127.0.0.1", port)
+            available = {
+                "gplinks": APIShortenerProvider("gplinks", f"http://127.0.0.1:{port}/api", "key"),
+                "raw": RawURLProvider(),
+            }
+            client = ShortenerClient([available[name] for name in providers])
+            try:
+                await scenario(fake, client)
+            finally:
+                await client.close()
+                await fake.close()
+
+        asyncio.run(run_fake())
+    return run
+
+def test_generate_reports_the_serving_provider(shortener):
+    async def scenario(fake, client):
+        short_link, provider = await client.generate(TARGET)
+        assert provider.name == "gplinks" and fake.targets[short_link] == TARGET
+
+        fake.error_rate = 1.0
+        short_link, provider = await client.generate(TARGET)
+        assert (short_link, provider.name) == (TARGET, "raw")
+        assert client.stats()["gplinks"]["failures"] == gplinks_api.SHORTENER_MAX_RETRIES + 1
+
+    shortener(scenario)
+
+def test_breaker_opens_then_recovers_through_a_probe(shortener, monkeypatch):
+    monkeypatch.setattr(gplinks_api, "BREAKER_RESET_TIMEOUT", 0.2)
+
+    async def scenario(fake, client):
+        fake.error_rate = 1.0
+        breaker = client.breakers["gplinks"]
+        while breaker.state != CircuitBreaker.OPEN:
+            await client.generate(TARGET)
+        requests = fake.requests
+        _, provider = await client.generate(TARGET)
+        assert provider.name == "raw" and fake.requests == requests # Open: gplinks is not called
+
+        fake.error_rate = 0.0
+        await asyncio.sleep(0.2)
+        _, provider = await client.generate(TARGET)
+        assert provider.name == "gplinks" and breaker.state == CircuitBreaker.CLOSED
+
+    shortener(scenario)
+
+def test_raw_fallback_links_are_not_pooled(shortener):
+    async def scenario(fake, client):
+        pool = LinkPool(client)
+        fake.error_rate = 1.0
+        assert await pool.get(1, 1) is not None # The user still gets a link, served live
+        assert pool.stats()["links"] == 0
+
+        fake.error_rate = 0.0
+        short_link = await pool.get(1, 2)
+        assert short_link in fake.targets and pool.stats()["links"] == 1
+
+    shortener(scenario)
+
+def test_deadline_covers_waiting_for_a_request_slot(shortener, monkeypatch):
+    monkeypatch.setattr(gplinks_api, "GPLINKS_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(gplinks_api, "SHORTENER_DEADLINE", 0.3)
+
+    async def scenario(fake, client):
+        started = time.monotonic()
+        results = await asyncio.gather(*(client.generate(f"{TARGET}&n={n}") for n in range(4)))
+        elapsed = time.monotonic() - started
+
+        # One request at a time, 0.2 s each: the first gets through, the rest run out of
+        # deadline in the queue instead of waiting their turn and then 0.3 s more
+        assert elapsed < 0.3 + 0.1
+        assert [provider.name if provider else None for _, provider in results].count("gplinks") == 1
+        # The second request gets the slot with 0.1 s left and is cut off; the last two never
+        # get one, and queueing is not counted against the provider
+        assert client.stats()["gplinks"]["calls"] == 2
+        assert client.breakers["gplinks"].state == CircuitBreaker.CLOSED
+
+    shortener(scenario, providers=("gplinks",), latency=0.2)
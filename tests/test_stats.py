@@ -0,0 +1,64 @@
+import asyncio
+
+from pymongo import errors
+
+import database
+
+COUNTERS = ("users", "links_completed", "total_earned", "balance_outstanding", "pending_count", "pending_amount",
+            "approved_count", "approved_amount")
+
+class FlakyUpdates:
+    """Forwards to a collection; the first `failures` update_one calls raise a connection error."""
+
+    def __init__(self, collection, failures: int):
+        self._collection = collection
+        self.failures = failures
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def update_one(self, *args, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise errors.AutoReconnect("connection reset")
+        return await self._collection.update_one(*args, **kwargs)
+
+def test_sharded_counters_add_up_to_a_rebuild(db, monkeypatch):
+    monkeypatch.setattr(database, "STATS_SHARDS", 4)
+
+    async def scenario():
+        await db.ensure_indexes()
+        for tg_id in range(1, 21):
+            await db.add_user(tg_id)
+            for _ in range(tg_id):
+                await db.update_user_balance(tg_id, 1.0)
+        await db.apply_balance_increments({tg_id: (2.0, 2) for tg_id in range(1, 11)})
+        for tg_id in range(5, 21):
+            await db.withdraw_balance(tg_id, "user@upi", 10)
+        await db.bulk_process_withdrawal_requests("approve", max_amount=15)
+
+        assert await db.stats_collection.count_documents({}) > 1 # The writes were spread out
+        totals, days = await db.get_stats(7)
+        rebuilt = await db.rebuild_stats()
+        assert {name: totals[name] for name in COUNTERS} == {name: rebuilt[name] for name in COUNTERS}
+        assert len(days) == 1 and days[0]["_id"] == database._today()
+        assert days[0]["new_users"] == 20 and days[0]["links_completed"] == rebuilt["links_completed"]
+
+        # The rebuild leaves one shard, and the counters read the same
+        assert await db.stats_collection.count_documents({}) == 1
+        assert {name: (await db.get_stats(1))[0][name] for name in COUNTERS} == {name: rebuilt[name] for name in COUNTERS}
+
+    asyncio.run(scenario())
+
+def test_best_effort_counters_retry_transient_errors(db):
+    async def scenario():
+        await db.ensure_indexes()
+        db.stats_collection = FlakyUpdates(db.stats_collection, failures=database.STATS_MAX_ATTEMPTS - 1)
+        await db.add_user(1)
+        assert (await db.get_stats(1))[0]["users"] == 1
+
+        db.stats_collection.failures = database.STATS_MAX_ATTEMPTS
+        await db.add_user(2) # Counted as lost, not raised
+        assert (await db.get_stats(1))[0]["users"] == 1
+
+    asyncio.run(scenario())
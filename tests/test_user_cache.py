@@ -0,0 +1,141 @@
+import asyncio
+import random
+
+from database import USER_PROJECTION, UserCache
+from fakes import SlowCollection
+
+class PausedReads:
+    """Forwards to a collection; find_one fetches its document, then waits for `gate` before returning it."""
+
+    def __init__(self, collection, gate: asyncio.Event):
+        self._collection = collection
+        self._gate = gate
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def find_one(self, *args, **kwargs):
+        doc = await self._collection.find_one(*args, **kwargs)
+        await self._gate.wait()
+        return doc
+
+async def stored_user(db, tg_id: int) -> dict:
+    return await db.users_collection.find_one({"tg_id": tg_id}, USER_PROJECTION)
+
+def test_read_overlapping_a_write_is_not_cached():
+    cache = UserCache(max_size=10, ttl=60)
+    cache.begin_read(1)
+    cache.begin_write(1)
+    cache.end_write(1, 1.0, 1)
+    cache.end_read(1, {"tg_id": 1, "balance": 0.0})
+    assert cache.get(1) is None
+
+def test_read_starting_during_a_write_is_not_cached():
+    cache = UserCache(max_size=10, ttl=60)
+    cache.begin_write(1)
+    cache.begin_read(1)
+    cache.end_read(1, {"tg_id": 1, "balance": 0.0})
+    cache.end_write(1, 1.0, 1)
+    assert cache.get(1) is None
+
+def test_increments_apply_to_cached_record_and_other_writes_invalidate():
+    cache = UserCache(max_size=10, ttl=60)
+    cache.begin_read(1)
+    cache.end_read(1, {"tg_id": 1, "balance": 2.0, "completed_links": 2, "total_links": 2, "total_earned": 2.0})
+    cache.begin_write(1)
+    cache.end_write(1, 1.5, 1)
+    assert cache.get(1) == {
+        "tg_id": 1, "balance": 3.5, "completed_links": 3, "total_links": 3, "total_earned": 3.5, "upi_id": None,
+    }
+    cache.begin_write(1)
+    cache.end_write(1)
+    assert cache.get(1) is None
+
+def test_lru_and_ttl_eviction():
+    cache = UserCache(max_size=2, ttl=60)
+    for tg_id in (1, 2):
+        cache.begin_read(tg_id)
+        cache.end_read(tg_id, {"tg_id": tg_id})
+    assert cache.get(1) is not None # 2 is now the least recently used
+    cache.begin_read(3)
+    cache.end_read(3, {"tg_id": 3})
+    assert cache.get(2) is None
+    assert cache.get(1) is not None and cache.get(3) is not None
+
+    expiring = UserCache(max_size=2, ttl=0)
+    expiring.begin_read(1)
+    expiring.end_read(1, {"tg_id": 1})
+    assert expiring.get(1) is None
+
+def test_stale_read_racing_a_credit_is_not_cached(db):
+    async def scenario():
+        await db.ensure_indexes()
+        await db.add_user(1)
+        gate = asyncio.Event()
+        db.users_collection = PausedReads(db.users_collection, gate)
+        read = asyncio.create_task(db.get_user(1))
+        for _ in range(3):
+            await asyncio.sleep(0) # The read fetches balance 0 and waits at the gate
+        assert await db.update_user_balance(1, 1.0)
+        gate.set()
+        assert (await read)["balance"] == 0.0 # This caller may see the old value...
+        assert db.user_cache.get(1) is None # ...but it is never cached
+        assert (await db.get_user(1))["balance"] == 1.0
+        assert db.user_cache.get(1)["balance"] == 1.0
+
+    asyncio.run(scenario())
+
+def test_cached_balances_match_database_after_mixed_concurrent_updates(db):
+    rng = random.Random(7)
+    users = list(range(1, 21))
+
+    async def operation():
+        tg_id = rng.choice(users)
+        kind = rng.random()
+        if kind < 0.4:
+            await db.get_user(tg_id)
+        elif kind < 0.65:
+            await db.update_user_balance(tg_id, float(rng.randint(1, 3)))
+        elif kind < 0.9:
+            others = rng.sample(users, 3)
+            await db.apply_balance_increments({other: (float(rng.randint(1, 3)), 1) for other in others})
+        else:
+            await db.withdraw_balance(tg_id, f"user{tg_id}@upi", 1.0)
+
+    async def scenario():
+        await db.ensure_indexes()
+        for tg_id in users:
+            await db.add_user(tg_id)
+        db.users_collection = SlowCollection(db.users_collection, rng)
+        for _ in range(5):
+            # Cached records then take the round's increments as deltas
+            for tg_id in users:
+                await db.get_user(tg_id)
+            await asyncio.gather(*(operation() for _ in range(300)))
+            # Once the writes have settled every cached record must equal the stored document
+            cached = 0
+            for tg_id in users:
+                entry = db.user_cache.get(tg_id)
+                if entry is not None:
+                    cached += 1
+                    assert entry == await stored_user(db, tg_id)
+            assert cached # Otherwise the cache was never exercised
+            assert not db.user_cache._inflight
+
+    asyncio.run(scenario())
+
+def test_cache_hits_stay_out_of_the_get_user_metrics(db):
+    from metrics import DB_CALLS, DB_LATENCY
+
+    async def scenario():
+        await db.add_user(1)
+        calls, latency = DB_CALLS.labels("get_user"), DB_LATENCY.labels("get_user")
+        calls_before, observed_before = calls.value, latency.count
+        for _ in range(5):
+            await db.get_user(1)
+        # One MongoDB read; the other four are cache hits
+        assert calls.value - calls_before == 1
+        assert latency.count - observed_before == 1
+        assert db.user_cache.hits >= 4
+
+    asyncio.run(scenario())
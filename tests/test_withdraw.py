@@ -0,0 +1,65 @@
+import asyncio
+import random
+
+from fakes import SlowCollection
+
+MIN_BALANCE = 10
+
+async def withdrawn_amounts(db, tg_id: int) -> list[float]:
+    cursor = db.withdrawal_requests_collection.find({"user_tg_id": tg_id})
+    return [req["amount"] for req in await cursor.to_list(length=None)]
+
+def test_double_tap_files_one_request(db):
+    async def scenario():
+        await db.ensure_indexes()
+        await db.add_user(1)
+        await db.users_collection.update_one({"tg_id": 1}, {"$set": {"balance": 12.0, "completed_links": 12}})
+        db.users_collection = SlowCollection(db.users_collection, random.Random(1))
+
+        results = await asyncio.gather(*(db.withdraw_balance(1, "user@upi", MIN_BALANCE) for _ in range(3)))
+
+        assert sorted(results, key=str) == [12.0, None, None]
+        assert await withdrawn_amounts(db, 1) == [12.0]
+        user = await db.users_collection.find_one({"tg_id": 1})
+        assert user["balance"] == 0 and user["completed_links"] == 0 and user["upi_id"] == "user@upi"
+
+    asyncio.run(scenario())
+
+def test_parallel_credits_and_withdrawals_lose_no_money(db):
+    """Credits racing withdrawals: every rupee credited is either still on the balance or withdrawn once."""
+    rng = random.Random(7)
+    users, credits = 5, 60
+
+    async def user_traffic(tg_id: int):
+        async def credit():
+            for _ in range(credits):
+                assert await db.update_user_balance(tg_id, 1.0)
+                await asyncio.sleep(rng.random() * 0.001)
+
+        async def withdraw():
+            for _ in range(credits // 5):
+                # Double taps included
+                await asyncio.gather(*(db.withdraw_balance(tg_id, "user@upi", MIN_BALANCE) for _ in range(2)))
+                await asyncio.sleep(rng.random() * 0.003)
+
+        await asyncio.gather(credit(), withdraw())
+
+    async def scenario():
+        await db.ensure_indexes()
+        for tg_id in range(1, users + 1):
+            await db.add_user(tg_id)
+        db.users_collection = SlowCollection(db.users_collection, rng)
+        db.withdrawal_requests_collection = SlowCollection(db.withdrawal_requests_collection, rng)
+
+        await asyncio.gather(*(user_traffic(tg_id) for tg_id in range(1, users + 1)))
+
+        withdrawals = 0
+        for tg_id in range(1, users + 1):
+            amounts = await withdrawn_amounts(db, tg_id)
+            user = await db.users_collection.find_one({"tg_id": tg_id})
+            assert user["balance"] + sum(amounts) == credits
+            assert all(amount >= MIN_BALANCE for amount in amounts)
+            withdrawals += len(amounts)
+        assert withdrawals # The race was exercised, not just the credits
+
+    asyncio.run(scenario())
@@ -0,0 +1,24 @@
+import hashlib
+import hmac
+
+from config import TARGET_BASE_URL, POSTBACK_SECRET
+
+def link_token(user_tg_id: int, link_seq: int) -> str:
+    """HMAC that proves a (user, link_seq) pair was issued by this bot."""
+    message = f"{user_tg_id}:{link_seq}".encode()
+    return hmac.new(POSTBACK_SECRET.encode(), message, hashlib.sha256).hexdigest()[:32]
+
+def verify_link_token(user_tg_id: int, link_seq: int, token: str) -> bool:
+    # Compared as bytes: compare_digest rejects non-ASCII str with a TypeError
+    return hmac.compare_digest(link_token(user_tg_id, link_seq).encode(), token.encode())
+
+def build_target_url(user_tg_id: int, link_seq: int) -> str:
+    """Builds the page a user's shortlink points to.
+
+    The URL is a pure function of the user and their link sequence number, so
+    shortlinks for upcoming sequence numbers can be generated ahead of time.
+    """
+    # The target page echoes user, link_seq and token back to the postback
+    # endpoint once the link is completed.
+    token = link_token(user_tg_id, link_seq)
+    return f"{TARGET_BASE_URL}?user={user_tg_id}&link_seq={link_seq}&token={token}"